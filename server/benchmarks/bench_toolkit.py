@@ -0,0 +1,337 @@
+"""
+Offline micro-benchmarks for the CPU-bound helpers in mcp_toolkit.py.
+
+Every fixture is generated locally from a fixed seed and the Google services are
+replaced by in-memory fakes, so the suite needs no network or credentials.
+
+Usage:
+    python benchmarks/bench_toolkit.py                      # run everything
+    python benchmarks/bench_toolkit.py --filter pdf         # only matching cases
+    python benchmarks/bench_toolkit.py --json out.json      # save results
+    python benchmarks/bench_toolkit.py --compare out.json   # flag regressions vs a saved run
+"""
+import argparse
+import base64
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+os.environ.setdefault("MCP_TOOLKIT_STATE_DIR", tempfile.mkdtemp(prefix="mcp_bench_"))
+
+import mcp_toolkit  # noqa: E402
+
+SEED = 1234
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut "
+         "labore et dolore magna aliqua quarterly report meeting invoice schedule update").split()
+
+# ==================== FIXTURES ====================
+
+def make_text(rng, size: int) -> str:
+    """Plain text of roughly size characters, with short and very long lines"""
+    lines, total = [], 0
+    while total < size:
+        n_words = rng.choice((0, 5, 12, 40, 120))
+        line = " ".join(rng.choice(WORDS) for _ in range(n_words))
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)
+
+def make_newsletter(rng, size: int) -> str:
+    """Table-heavy marketing HTML of roughly size characters"""
+    parts, total = ["<html><head><style>td{padding:0}</style></head><body><table>"], 0
+    while total < size:
+        chunk = (f'<tr><td class="c{rng.randint(0, 9)}"><a href="https://example.com/{rng.randint(0, 10**6)}">'
+                 f'{" ".join(rng.choice(WORDS) for _ in range(8))}</a>&nbsp;&amp;&nbsp;'
+                 f'<span style="color:#{rng.randint(0, 0xffffff):06x}">{rng.choice(WORDS)}</span></td></tr>\n')
+        parts.append(chunk)
+        total += len(chunk)
+    parts.append("</table></body></html>")
+    return "".join(parts)
+
+def make_mime_tree(rng, depth: int, fanout: int) -> dict:
+    """Nested multipart payload whose only text/html body sits at the deepest, last leaf"""
+    def encode(text):
+        return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+    def node(level):
+        if level == depth:
+            return {"mimeType": "text/html", "body": {"data": encode(make_newsletter(rng, 2000))}}
+        parts = [{"mimeType": "image/png", "filename": f"img{i}.png", "body": {"attachmentId": f"a{level}{i}", "size": 100}}
+                 for i in range(fanout - 1)]
+        parts.append(node(level + 1))
+        return {"mimeType": "multipart/mixed", "parts": parts}
+    return node(0)
+
+def make_base64(rng, n_bytes: int) -> str:
+    return base64.b64encode(rng.randbytes(n_bytes)).decode("ascii")
+
+def drain(reader, chunk_size: int = 1024 * 1024) -> int:
+    """Read a file object to the end in upload-sized chunks."""
+    total = 0
+    for chunk in iter(lambda: reader.read(chunk_size), b""):
+        total += len(chunk)
+    return total
+
+# ==================== FAKE SERVICES ====================
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+        self.headers = {}
+
+    def execute(self, *args, **kwargs):
+        return self.result
+
+class FakeDrive:
+    def __init__(self, items):
+        self.items = items
+
+    def files(self):
+        return self
+
+    def list(self, **kwargs):
+        return FakeRequest({"files": self.items})
+
+    def get(self, **kwargs):
+        return FakeRequest({"name": "Benchmark Folder"})
+
+class FakeGmail:
+    def __init__(self, labels):
+        self._labels = labels
+
+    def users(self):
+        return self
+
+    def labels(self):
+        return self
+
+    def list(self, **kwargs):
+        return FakeRequest({"labels": self._labels})
+
+class FakeCalendar:
+    def __init__(self, events):
+        self._events = events
+
+    def calendarList(self):
+        return FakeCalendarList()
+
+    def events(self):
+        return self
+
+    def list(self, **kwargs):
+        return FakeRequest({"items": [] if kwargs.get("syncToken") else self._events, "nextSyncToken": "bench"})
+
+class FakeCalendarList:
+    def list(self, **kwargs):
+        return FakeRequest({"items": [{"id": "bench@example.com", "summary": "Bench", "primary": True}]})
+
+def make_drive_items(rng, n: int) -> list:
+    mime_types = ["application/vnd.google-apps.folder", "application/pdf", "text/plain",
+                  "application/vnd.google-apps.document", "image/png"]
+    return [{
+        "id": f"id{i:08d}",
+        "name": f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i}",
+        "mimeType": rng.choice(mime_types),
+        "size": str(rng.randint(1, 10**8)),
+        "modifiedTime": "2024-05-01T10:00:00.000Z",
+        "createdTime": "2024-01-01T10:00:00.000Z",
+        "owners": [{"displayName": "Bench User"}],
+        "shared": rng.random() < 0.3,
+    } for i in range(n)]
+
+def make_calendar_events(rng, n: int) -> list:
+    events = []
+    for i in range(n):
+        day, hour = 1 + i % 28, 8 + i % 10
+        events.append({
+            "id": f"ev{i}",
+            "summary": " ".join(rng.choice(WORDS) for _ in range(4)),
+            "description": make_text(rng, 300),
+            "start": {"dateTime": f"2024-03-{day:02d}T{hour:02d}:00:00Z"},
+            "end": {"dateTime": f"2024-03-{day:02d}T{hour:02d}:45:00Z"},
+        })
+    return events
+
+# ==================== CASES ====================
+
+def build_cases(quick: bool) -> list:
+    """Return [(name, size label, callable)]; fixture generation happens here, untimed"""
+    rng = random.Random(SEED)
+    scale = 0.1 if quick else 1
+    cases = []
+
+    for size in (10_000, 100_000, 1_000_000):
+        html = make_newsletter(rng, int(size * scale))
+        cases.append(("strip_html_tags", f"{len(html) // 1000}KB", lambda html=html: mcp_toolkit.strip_html_tags(html)))
+
+    for depth, fanout in ((5, 3), (25, 4), (100, 8)):
+        payload = make_mime_tree(rng, depth, fanout)
+        cases.append(("extract_email_body", f"depth{depth}x{fanout}",
+                      lambda payload=payload: mcp_toolkit.extract_email_body(payload)))
+
+    for size in (10_000, 100_000, 1_000_000):
+        text = make_text(rng, int(size * scale))
+        cases.append(("create_pdf_from_text", f"{len(text) // 1000}KB",
+                      lambda text=text: mcp_toolkit.create_pdf_from_text(text)))
+
+    if mcp_toolkit.PDF_SUPPORT:
+        for size in (20_000, 200_000):
+            pdf_bytes = mcp_toolkit.create_pdf_from_text(make_text(rng, int(size * scale))).read()
+            cases.append(("extract_pdf_text", f"{len(pdf_bytes) // 1000}KB-pdf",
+                          lambda data=pdf_bytes: mcp_toolkit.extract_pdf_text(mcp_toolkit.io.BytesIO(data))))
+
+    for n_bytes in (100_000, 1_000_000, 4_000_000):
+        encoded = make_base64(rng, int(n_bytes * scale))
+        cases.append(("Base64Reader", f"b64-{len(encoded) // 1000}KB",
+                      lambda s=encoded: drain(mcp_toolkit.Base64Reader(s))))
+
+    for n in (100, 1000):
+        n = max(10, int(n * scale))
+        drive = FakeDrive(make_drive_items(rng, n))
+        cases.append(("drive_list_all_files", f"{n}items",
+                      lambda drive=drive, n=n: with_services(mcp_toolkit.drive_list_all_files, drive_service=drive,
+                                                             max_results=n)))
+        cases.append(("drive_list_folder_contents", f"{n}items",
+                      lambda drive=drive: with_services(mcp_toolkit.drive_list_folder_contents, drive_service=drive,
+                                                        folder_id="root")))
+        gmail = FakeGmail([{"id": f"Label_{i}", "name": f"{rng.choice(WORDS)}/{i}"} for i in range(n)])
+        cases.append(("gmail_list_labels", f"{n}labels",
+                      lambda gmail=gmail: with_services(mcp_toolkit.gmail_list_labels, gmail_service=gmail)))
+        calendar = FakeCalendar(make_calendar_events(rng, n))
+        user_id = prime_calendar_store(calendar, n)
+        cases.append(("calendar_list_events", f"{n}events",
+                      lambda calendar=calendar, n=n, user_id=user_id: with_services(
+                          mcp_toolkit.calendar_list_events, calendar_service=calendar, user_id=user_id,
+                          timeMin="2024-03-01T00:00:00Z", timeMax="2024-04-01T00:00:00Z", maxResults=n)))
+
+    # Per-call instrumentation cost; must stay in the low microseconds per observation
+    registry = mcp_toolkit.ToolkitMetrics()
+    latencies = [rng.expovariate(5) for _ in range(1000)]
+    cases.append(("metrics_observe", "1000calls",
+                  lambda: [registry.observe_tool(f"tool{i % 40}", t, False, 500) or
+                           registry.observe_api(f"api.method{i % 60}", t, False) for i, t in enumerate(latencies)]))
+    cases.append(("metrics_prometheus", "40tools-60methods", registry.to_prometheus))
+    return cases
+
+def prime_calendar_store(calendar, n: int) -> str:
+    """Fill a dedicated user's local event store so the timed calls measure query + formatting"""
+    user_id = f"bench-calendar-{n}"
+    with_services(lambda: mcp_toolkit.get_calendar_store().sync(full=True), calendar_service=calendar, user_id=user_id)
+    return user_id
+
+def with_services(tool, **kwargs):
+    """Call a tool with fake services swapped into the toolkit module"""
+    services = {k: kwargs.pop(k) for k in list(kwargs) if k.endswith("_service")}
+    user_id = kwargs.pop("user_id", None)
+    previous = {k: getattr(mcp_toolkit, k) for k in services}
+    previous_user = os.environ.get("SESSION_USER_ID")
+    for k, v in services.items():
+        setattr(mcp_toolkit, k, v)
+    if user_id:
+        os.environ["SESSION_USER_ID"] = user_id
+    try:
+        result = tool(**kwargs)
+    finally:
+        for k, v in previous.items():
+            setattr(mcp_toolkit, k, v)
+        if user_id:
+            if previous_user is None:
+                os.environ.pop("SESSION_USER_ID", None)
+            else:
+                os.environ["SESSION_USER_ID"] = previous_user
+    # Tools report failures as ErrorResult strings; a broken fixture must not pass as a fast run
+    if mcp_toolkit.is_error_result(result):
+        raise RuntimeError(result[:200])
+    return result
+
+# ==================== RUNNER ====================
+
+def time_case(fn, min_time: float, max_repeats: int) -> list:
+    """Time fn repeatedly (after one warm-up call) until min_time has elapsed"""
+    fn()
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_repeats and (len(timings) < 3 or time.perf_counter() - started < min_time):
+        gc.collect()
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return timings
+
+def peak_memory(fn) -> int:
+    """Peak Python heap allocated by a single call (measured separately from timing)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:8.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:8.2f}ms"
+    return f"{seconds:8.3f}s "
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks for mcp_toolkit helpers")
+    parser.add_argument("--filter", help="Only run cases whose name contains this text")
+    parser.add_argument("--quick", action="store_true", help="Use 10x smaller fixtures")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Minimum seconds of timing per case")
+    parser.add_argument("--max-repeats", type=int, default=50, help="Maximum timed repetitions per case")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Compare medians against a previous --json result")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+
+    results = []
+    regressions = 0
+    print(f"{'case':<28} {'size':<16} {'median':>10} {'min':>10} {'runs':>5} {'peak mem':>10}"
+          + ("   vs baseline" if baseline else ""))
+    for name, size, fn in build_cases(args.quick):
+        if args.filter and args.filter not in name:
+            continue
+        timings = time_case(fn, args.min_time, args.max_repeats)
+        result = {
+            "name": name,
+            "size": size,
+            "median_s": statistics.median(timings),
+            "min_s": min(timings),
+            "runs": len(timings),
+            "peak_bytes": peak_memory(fn),
+        }
+        results.append(result)
+        line = (f"{name:<28} {size:<16} {format_seconds(result['median_s']):>10} {format_seconds(result['min_s']):>10} "
+                f"{result['runs']:>5} {result['peak_bytes'] / 1e6:>8.2f}MB")
+        previous = baseline.get((name, size))
+        if previous:
+            ratio = result["median_s"] / previous["median_s"]
+            flag = "  REGRESSION" if ratio > args.threshold else ""
+            regressions += bool(flag)
+            line += f"   {ratio:5.2f}x{flag}"
+        print(line, flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "quick": args.quick, "results": results}, f, indent=2)
+    if regressions:
+        print(f"\n{regressions} case(s) slower than {args.threshold}x baseline")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
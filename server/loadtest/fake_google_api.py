@@ -0,0 +1,707 @@
+"""
+Local stand-in for the subset of Drive v3, Gmail v1, Calendar v3 and Docs v1 used by mcp_toolkit.py.
+
+Point the toolkit at it with GOOGLE_API_ENDPOINT=http://127.0.0.1:<port> (see loadtest_toolkit.py).
+State is generated from a seed and kept in memory; latency, error rates and 429 responses can be
+injected to see how the toolkit behaves under a slow or flaky backend.
+
+Usage:
+    python loadtest/fake_google_api.py --port 8765 --latency-ms 40 --jitter-ms 20 --rate-429 0.02
+    curl http://127.0.0.1:8765/_fake/stats
+"""
+import argparse
+import base64
+import email
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+USER_EMAIL = "loadtest@example.com"
+FOLDER_MIME = "application/vnd.google-apps.folder"
+DOC_MIME = "application/vnd.google-apps.document"
+WORDS = ("alpha beta gamma delta report invoice meeting budget roadmap review design launch "
+         "customer partner quarterly weekly summary draft final notes agenda").split()
+
+class FakeError(Exception):
+    def __init__(self, status: int, message: str, reason: str = "error"):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+class FakeGoogleState:
+    """In-memory Drive/Gmail/Calendar/Docs data, generated deterministically from a seed"""
+
+    def __init__(self, seed: int = 1, n_files: int = 200, n_messages: int = 200, n_events: int = 300):
+        self.rng = random.Random(seed)
+        self.lock = threading.RLock()
+        self.version = 1
+        self.files, self.contents, self.docs = {}, {}, {}
+        self.messages, self.attachments, self.labels = {}, {}, []
+        self.events = {}
+        self.sent = 0
+        self.uploads = {}
+        self._generate(n_files, n_messages, n_events)
+
+    def sentence(self, n: int) -> str:
+        return " ".join(self.rng.choice(WORDS) for _ in range(n))
+
+    def _generate(self, n_files, n_messages, n_events):
+        now = datetime(2024, 6, 3, tzinfo=timezone.utc)
+        folders = []
+        for i in range(n_files):
+            file_id = f"file{i:05d}"
+            kind = i % 6
+            mime = [FOLDER_MIME, DOC_MIME, "text/plain", "application/json", "image/png", "text/plain"][kind]
+            parent = self.rng.choice(folders) if folders and self.rng.random() < 0.6 else "root"
+            meta = {
+                "id": file_id, "name": f"{self.sentence(2)} {i}", "mimeType": mime, "parents": [parent],
+                "modifiedTime": (now - timedelta(days=i)).isoformat().replace("+00:00", "Z"),
+                "createdTime": (now - timedelta(days=400 + i)).isoformat().replace("+00:00", "Z"),
+                "owners": [{"displayName": "Load Test", "emailAddress": USER_EMAIL}],
+                "shared": i % 7 == 0, "trashed": False,
+                "webViewLink": f"https://drive.example.com/{file_id}/view",
+            }
+            if mime == FOLDER_MIME:
+                folders.append(file_id)
+            elif mime == DOC_MIME:
+                sections = []
+                for s in range(1 + i % 8):
+                    sections.append(f"# Section {s + 1} {self.sentence(2)}")
+                    sections.extend(self.sentence(self.rng.randint(10, 60)) for _ in range(self.rng.randint(2, 12)))
+                self.docs[file_id] = "\n".join(sections) + "\n"
+            else:
+                size = self.rng.choice((200, 5_000, 50_000, 500_000))
+                if mime == "image/png":
+                    data = self.rng.randbytes(size)
+                else:
+                    data = "\n".join(self.sentence(12) for _ in range(max(1, size // 80))).encode("utf-8")
+                self.contents[file_id] = data
+                meta["size"] = str(len(data))
+                meta["webContentLink"] = f"https://drive.example.com/{file_id}/download"
+            self.files[file_id] = meta
+
+        self.labels = [{"id": label, "name": label, "type": "system"} for label in ("INBOX", "SENT", "IMPORTANT", "UNREAD")]
+        self.labels += [{"id": f"Label_{i}", "name": f"Projects/{self.sentence(1)}{i}", "type": "user"} for i in range(20)]
+        for i in range(n_messages):
+            message_id = f"msg{i:05d}"
+            body = "\n".join(self.sentence(15) for _ in range(self.rng.randint(2, 30)))
+            parts = [{"partId": "0", "mimeType": "text/plain", "filename": "",
+                      "body": {"size": len(body), "data": b64url(body.encode("utf-8"))}}]
+            if i % 3 == 0:
+                attachment = "\n".join(self.sentence(10) for _ in range(200)).encode("utf-8")
+                attachment_id = f"att{i:05d}"
+                self.attachments[attachment_id] = attachment
+                parts.append({"partId": "1", "mimeType": "text/plain", "filename": f"notes{i}.txt",
+                              "body": {"attachmentId": attachment_id, "size": len(attachment)}})
+            date = now - timedelta(hours=i * 3)
+            self.messages[message_id] = {
+                "id": message_id, "threadId": message_id, "labelIds": ["INBOX"],
+                "snippet": body[:100], "internalDate": str(int(date.timestamp() * 1000)),
+                "payload": {
+                    "mimeType": "multipart/mixed",
+                    "headers": [
+                        {"name": "From", "value": f"Sender {i % 17} <sender{i % 17}@example.com>"},
+                        {"name": "To", "value": USER_EMAIL},
+                        {"name": "Subject", "value": f"{self.sentence(4).title()} #{i}"},
+                        {"name": "Date", "value": date.strftime("%a, %d %b %Y %H:%M:%S +0000")},
+                    ],
+                    "parts": parts,
+                },
+            }
+
+        for i in range(n_events):
+            start = now + timedelta(days=i // 4 - 30, hours=9 + (i % 4) * 2)
+            self.events[f"ev{i:05d}"] = self._new_event(f"ev{i:05d}", {
+                "summary": self.sentence(3).title(),
+                "description": self.sentence(20),
+                "start": {"dateTime": start.isoformat().replace("+00:00", "Z")},
+                "end": {"dateTime": (start + timedelta(minutes=45)).isoformat().replace("+00:00", "Z")},
+            })
+
+    def _new_event(self, event_id, body):
+        self.version += 1
+        event = dict(body, id=event_id, status="confirmed", etag=f'"{self.version}"',
+                     htmlLink=f"https://calendar.example.com/{event_id}", _version=self.version)
+        return event
+
+    def public_event(self, event):
+        return {k: v for k, v in event.items() if not k.startswith("_")}
+
+    # ---------- Docs structure ----------
+
+    def doc_structure(self, doc_id):
+        """Build a Docs API body from the document's text; indexes count from 1 like the real API"""
+        text = self.docs[doc_id]
+        content = [{"startIndex": 0, "endIndex": 1, "sectionBreak": {}}]
+        index = 1
+        for n, line in enumerate(text.splitlines(keepends=True)):
+            style = "HEADING_1" if line.startswith("# ") else "NORMAL_TEXT"
+            end = index + len(line)
+            paragraph_style = {"namedStyleType": style}
+            if style != "NORMAL_TEXT":
+                paragraph_style["headingId"] = f"h.{n}"
+            content.append({
+                "startIndex": index, "endIndex": end,
+                "paragraph": {"elements": [{"startIndex": index, "endIndex": end, "textRun": {"content": line}}],
+                              "paragraphStyle": paragraph_style},
+            })
+            index = end
+        return {"documentId": doc_id, "title": self.files[doc_id]["name"],
+                "revisionId": f"rev{self.files[doc_id].get('_version', 1)}", "body": {"content": content}}
+
+def b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+class FakeGoogleApi:
+    """Routes (method, path) to handlers and applies latency/fault injection"""
+
+    def __init__(self, state: FakeGoogleState, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, rate_429=0.0, seed=1):
+        self.state = state
+        self.latency_ms, self.jitter_ms = latency_ms, jitter_ms
+        self.error_rate, self.rate_429 = error_rate, rate_429
+        self.fault_rng = random.Random(seed + 1)
+        self.fault_lock = threading.Lock()
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.traces = []
+        self.routes = [
+            ("GET", r"/drive/v3/files", self.drive_list),
+            ("POST", r"/drive/v3/files", self.drive_create),
+            ("GET", r"/drive/v3/files/([^/]+)/export", self.drive_export),
+            ("POST", r"/drive/v3/files/([^/]+)/permissions", self.drive_permission),
+            ("GET", r"/drive/v3/files/([^/]+)", self.drive_get),
+            ("PATCH", r"/drive/v3/files/([^/]+)", self.drive_update),
+            ("POST", r"/upload/drive/v3/files", self.upload_start),
+            ("PATCH", r"/upload/drive/v3/files/([^/]+)", self.upload_start),
+            ("PUT", r"/upload/session/([^/]+)", self.upload_chunk),
+            ("GET", r"/gmail/v1/users/me/profile", self.gmail_profile),
+            ("GET", r"/gmail/v1/users/me/labels", self.gmail_labels),
+            ("GET", r"/gmail/v1/users/me/messages", self.gmail_list),
+            ("POST", r"/gmail/v1/users/me/messages/send", self.gmail_send),
+            ("GET", r"/gmail/v1/users/me/messages/([^/]+)/attachments/([^/]+)", self.gmail_attachment),
+            ("GET", r"/gmail/v1/users/me/messages/([^/]+)", self.gmail_get),
+            ("POST", r"/gmail/v1/users/me/messages/([^/]+)/modify", self.gmail_modify),
+            ("DELETE", r"/gmail/v1/users/me/messages/([^/]+)", self.gmail_delete),
+            ("GET", r"/calendar/v3/users/me/calendarList", self.calendar_list),
+            ("POST", r"/calendar/v3/freeBusy", self.calendar_freebusy),
+            ("GET", r"/calendar/v3/calendars/([^/]+)/events", self.events_list),
+            ("POST", r"/calendar/v3/calendars/([^/]+)/events", self.events_insert),
+            ("GET", r"/calendar/v3/calendars/([^/]+)/events/([^/]+)", self.events_get),
+            ("PATCH", r"/calendar/v3/calendars/([^/]+)/events/([^/]+)", self.events_patch),
+            ("PUT", r"/calendar/v3/calendars/([^/]+)/events/([^/]+)", self.events_patch),
+            ("DELETE", r"/calendar/v3/calendars/([^/]+)/events/([^/]+)", self.events_delete),
+            ("POST", r"/batch/calendar/v3", self.batch),
+            ("POST", r"/batch/drive/v3", self.batch),
+            ("POST", r"/batch", self.batch),
+            ("GET", r"/v1/documents/([^/:]+)", self.docs_get),
+            ("POST", r"/v1/documents/([^/:]+):batchUpdate", self.docs_batch_update),
+            ("GET", r"/_fake/stats", self.fake_stats),
+            ("GET", r"/_fake/traces", self.fake_traces),
+            ("POST", r"/v1/traces", self.collect_traces),
+        ]
+        self.routes = [(method, re.compile(pattern + "$"), handler) for method, pattern, handler in self.routes]
+
+    # ---------- dispatch ----------
+
+    def dispatch(self, method, raw_path, headers, body, inject=True):
+        """Return (status, headers dict, body bytes) for one request"""
+        parsed = urlparse(raw_path)
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        override = headers.get("x-http-method-override")
+        if override:
+            method = override
+            query.update({k: v[-1] for k, v in parse_qs(body.decode("utf-8")).items()})
+            body = b""
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(parsed.path)
+            if route_method == method and match:
+                name = handler.__name__
+                started = time.perf_counter()
+                try:
+                    if inject and name not in ("fake_stats", "fake_traces", "collect_traces", "batch"):
+                        self.inject_faults()
+                    result = handler(*match.groups(), query=query, headers=headers, body=body)
+                    status, extra_headers, payload = result if isinstance(result, tuple) else (200, {}, result)
+                except FakeError as e:
+                    status, extra_headers = e.status, {"retry-after": "1"} if e.status == 429 else {}
+                    payload = {"error": {"code": e.status, "message": str(e),
+                                         "errors": [{"reason": e.reason, "message": str(e)}]}}
+                self.record(name, status, time.perf_counter() - started)
+                if isinstance(payload, (dict, list)):
+                    extra_headers.setdefault("content-type", "application/json; charset=UTF-8")
+                    payload = json.dumps(payload).encode("utf-8")
+                return status, extra_headers, payload
+        self.record("not_found", 404, 0)
+        return 404, {"content-type": "application/json"}, json.dumps(
+            {"error": {"code": 404, "message": f"No fake route for {method} {parsed.path}"}}).encode("utf-8")
+
+    def inject_faults(self):
+        with self.fault_lock:
+            delay = self.latency_ms + self.fault_rng.uniform(0, self.jitter_ms)
+            roll = self.fault_rng.random()
+        if delay:
+            time.sleep(delay / 1000)
+        if roll < self.rate_429:
+            raise FakeError(429, "Rate Limit Exceeded", "rateLimitExceeded")
+        if roll < self.rate_429 + self.error_rate:
+            raise FakeError(503, "Backend Error", "backendError")
+
+    def record(self, name, status, seconds):
+        with self.stats_lock:
+            entry = self.stats.setdefault(name, {"calls": 0, "errors": 0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["errors"] += status >= 400
+            entry["seconds"] += seconds
+
+    def fake_stats(self, **_):
+        with self.stats_lock:
+            return {"routes": self.stats, "sent_messages": self.state.sent,
+                    "spans_received": sum(len(s) for s in self.traces)}
+
+    # ---------- OTLP collector stand-in ----------
+
+    def collect_traces(self, body, **_):
+        """Accept OTLP/JSON exports (MCP_TRACE_EXPORT=http://host:port/v1/traces)"""
+        payload = json.loads(body or b"{}")
+        spans = [span for resource in payload.get("resourceSpans", [])
+                 for scope in resource.get("scopeSpans", []) for span in scope.get("spans", [])]
+        with self.stats_lock:
+            self.traces.append(spans)
+            del self.traces[:-500]
+        return {"partialSuccess": {}}
+
+    def fake_traces(self, **_):
+        """Received spans grouped by trace id, slowest trace first"""
+        with self.stats_lock:
+            spans = [span for batch in self.traces for span in batch]
+        traces = {}
+        for span in spans:
+            traces.setdefault(span["traceId"], []).append(span)
+        def duration(span):
+            return (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+        result = []
+        for trace_id, trace in traces.items():
+            root = next((span for span in trace if "parentSpanId" not in span), trace[0])
+            result.append({"traceId": trace_id, "root": root["name"], "duration_ms": duration(root),
+                           "spans": sorted(({"name": span["name"], "duration_ms": duration(span)} for span in trace),
+                                           key=lambda span: -span["duration_ms"])})
+        return {"traces": sorted(result, key=lambda t: -t["duration_ms"])}
+
+    # ---------- Drive ----------
+
+    def drive_list(self, query, **_):
+        state = self.state
+        q = query.get("q", "")
+        with state.lock:
+            items = [f for f in state.files.values() if not f["trashed"] or "trashed=false" not in q]
+        parent = re.search(r"'([^']+)' in parents", q)
+        if parent:
+            items = [f for f in items if parent.group(1) in f["parents"]]
+        for op, value in re.findall(r"mimeType\s*(=|contains)\s*'([^']+)'", q):
+            items = [f for f in items if (f["mimeType"] == value if op == "=" else value in f["mimeType"])]
+        text = re.search(r"fullText contains '((?:[^'\\]|\\.)*)'", q)
+        if text:
+            needle = text.group(1).replace("\\'", "'").lower()
+            items = [f for f in items if needle in f["name"].lower()
+                     or needle in state.contents.get(f["id"], b"")[:20000].decode("utf-8", "ignore").lower()]
+        page_size = int(query.get("pageSize", 100))
+        offset = int(query.get("pageToken", 0) or 0)
+        page = items[offset:offset + page_size]
+        result = {"files": [public_file(f) for f in page]}
+        if offset + page_size < len(items):
+            result["nextPageToken"] = str(offset + page_size)
+        return result
+
+    def drive_get(self, file_id, query, **_):
+        state = self.state
+        with state.lock:
+            meta = state.files.get(file_id)
+            if meta is None:
+                raise FakeError(404, f"File not found: {file_id}", "notFound")
+            if query.get("alt") == "media":
+                data = state.contents.get(file_id, b"")
+                return 200, {"content-type": meta["mimeType"], "content-length": str(len(data))}, data
+            return public_file(meta)
+
+    def drive_export(self, file_id, **_):
+        with self.state.lock:
+            if file_id not in self.state.docs:
+                raise FakeError(404, f"File not found: {file_id}", "notFound")
+            data = self.state.docs[file_id].encode("utf-8")
+        return 200, {"content-type": "text/markdown", "content-length": str(len(data))}, data
+
+    def drive_create(self, body, headers, **_):
+        return public_file(self.create_file(json.loads(body or b"{}"), None))
+
+    def create_file(self, metadata, data):
+        state = self.state
+        with state.lock:
+            file_id = f"new{uuid.uuid4().hex[:12]}"
+            meta = {
+                "id": file_id, "name": metadata.get("name", "Untitled"),
+                "mimeType": metadata.get("mimeType", "application/octet-stream"),
+                "parents": metadata.get("parents", ["root"]), "trashed": False, "shared": False,
+                "modifiedTime": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+                "createdTime": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+                "owners": [{"displayName": "Load Test", "emailAddress": USER_EMAIL}],
+                "webViewLink": f"https://drive.example.com/{file_id}/view",
+            }
+            if meta["mimeType"] == DOC_MIME:
+                state.docs[file_id] = (data or b"").decode("utf-8", "replace") or "\n"
+            elif data is not None:
+                state.contents[file_id] = data
+                meta["size"] = str(len(data))
+            state.files[file_id] = meta
+            return meta
+
+    def drive_update(self, file_id, query, body, **_):
+        state = self.state
+        with state.lock:
+            meta = state.files.get(file_id)
+            if meta is None:
+                raise FakeError(404, f"File not found: {file_id}", "notFound")
+            meta.update({k: v for k, v in json.loads(body or b"{}").items() if k in ("name", "trashed", "description")})
+            if query.get("addParents"):
+                removed = set(query.get("removeParents", "").split(","))
+                meta["parents"] = [p for p in meta["parents"] if p not in removed] + query["addParents"].split(",")
+            return public_file(meta)
+
+    def drive_permission(self, file_id, **_):
+        if file_id not in self.state.files:
+            raise FakeError(404, f"File not found: {file_id}", "notFound")
+        return {"id": uuid.uuid4().hex[:10], "type": "user", "role": "reader"}
+
+    def upload_start(self, file_id=None, query=None, headers=None, body=b"", **_):
+        """Media upload: multipart (one shot) or the first step of a resumable session"""
+        upload_type = query.get("uploadType")
+        if upload_type == "multipart":
+            message = email.message_from_bytes(
+                b"Content-Type: " + headers["content-type"].encode("latin-1") + b"\r\n\r\n" + body)
+            parts = message.get_payload()
+            metadata = json.loads(parts[0].get_payload())
+            data = parts[1].get_payload(decode=True)
+            return self.finish_upload(file_id, metadata, data)
+        if upload_type == "resumable":
+            session_id = uuid.uuid4().hex
+            with self.state.lock:
+                self.state.uploads[session_id] = {"file_id": file_id, "metadata": json.loads(body or b"{}"),
+                                                  "data": bytearray()}
+            host = headers.get("host", "127.0.0.1")
+            return 200, {"location": f"http://{host}/upload/session/{session_id}"}, b""
+        # uploadType=media
+        return self.finish_upload(file_id, {}, body)
+
+    def upload_chunk(self, session_id, headers, body, **_):
+        with self.state.lock:
+            session = self.state.uploads.get(session_id)
+            if session is None:
+                raise FakeError(404, "Upload session not found", "notFound")
+            session["data"].extend(body)
+            content_range = headers.get("content-range", "")
+            total = content_range.rsplit("/", 1)[-1] if "/" in content_range else "*"
+            if total != "*" and len(session["data"]) < int(total):
+                return 308, {"range": f"bytes=0-{len(session['data']) - 1}"}, b""
+            del self.state.uploads[session_id]
+        return self.finish_upload(session["file_id"], session["metadata"], bytes(session["data"]))
+
+    def finish_upload(self, file_id, metadata, data):
+        state = self.state
+        if file_id is None:
+            return public_file(self.create_file(metadata, data))
+        with state.lock:
+            meta = state.files.get(file_id)
+            if meta is None:
+                raise FakeError(404, f"File not found: {file_id}", "notFound")
+            if meta["mimeType"] == DOC_MIME:
+                state.docs[file_id] = data.decode("utf-8", "replace")
+            else:
+                state.contents[file_id] = data
+                meta["size"] = str(len(data))
+            meta.update({k: v for k, v in metadata.items() if k == "name"})
+            return public_file(meta)
+
+    # ---------- Gmail ----------
+
+    def gmail_profile(self, **_):
+        return {"emailAddress": USER_EMAIL, "messagesTotal": len(self.state.messages)}
+
+    def gmail_labels(self, **_):
+        return {"labels": self.state.labels}
+
+    def gmail_list(self, query, **_):
+        with self.state.lock:
+            items = list(self.state.messages.values())
+        q = query.get("q", "")
+        if "has:attachment" in q:
+            items = [m for m in items if len(m["payload"]["parts"]) > 1]
+        sender = re.search(r"from:\(([^)]*)\)", q)
+        if sender:
+            items = [m for m in items if sender.group(1).lower() in m["payload"]["headers"][0]["value"].lower()]
+        max_results = int(query.get("maxResults", 100))
+        offset = int(query.get("pageToken", 0) or 0)
+        page = items[offset:offset + max_results]
+        result = {"messages": [{"id": m["id"], "threadId": m["threadId"]} for m in page],
+                  "resultSizeEstimate": len(items)}
+        if offset + max_results < len(items):
+            result["nextPageToken"] = str(offset + max_results)
+        return result
+
+    def gmail_get(self, message_id, query, **_):
+        message = self.state.messages.get(message_id)
+        if message is None:
+            raise FakeError(404, "Requested entity was not found.", "notFound")
+        if query.get("format") == "metadata":
+            return dict(message, payload={"mimeType": message["payload"]["mimeType"],
+                                          "headers": message["payload"]["headers"]})
+        return message
+
+    def gmail_attachment(self, message_id, attachment_id, **_):
+        data = self.state.attachments.get(attachment_id)
+        if data is None:
+            raise FakeError(404, "Requested entity was not found.", "notFound")
+        return {"size": len(data), "data": b64url(data)}
+
+    def gmail_send(self, body, **_):
+        payload = json.loads(body or b"{}")
+        if not payload.get("raw"):
+            raise FakeError(400, "Recipient address required", "invalidArgument")
+        with self.state.lock:
+            self.state.sent += 1
+        return {"id": f"sent{uuid.uuid4().hex[:12]}", "threadId": uuid.uuid4().hex[:12], "labelIds": ["SENT"]}
+
+    def gmail_modify(self, message_id, body, **_):
+        message = self.state.messages.get(message_id)
+        if message is None:
+            raise FakeError(404, "Requested entity was not found.", "notFound")
+        change = json.loads(body or b"{}")
+        with self.state.lock:
+            labels = [l for l in message["labelIds"] if l not in change.get("removeLabelIds", [])]
+            message["labelIds"] = labels + [l for l in change.get("addLabelIds", []) if l not in labels]
+        return {"id": message_id, "labelIds": message["labelIds"]}
+
+    def gmail_delete(self, message_id, **_):
+        with self.state.lock:
+            if self.state.messages.pop(message_id, None) is None:
+                raise FakeError(404, "Requested entity was not found.", "notFound")
+        return 204, {}, b""
+
+    # ---------- Calendar ----------
+
+    def calendar_list(self, **_):
+        return {"items": [
+            {"id": USER_EMAIL, "summary": USER_EMAIL, "primary": True, "timeZone": "UTC", "accessRole": "owner"},
+            {"id": "team@group.example.com", "summary": "Team", "timeZone": "UTC", "accessRole": "reader"},
+        ]}
+
+    def calendar_freebusy(self, body, **_):
+        request = json.loads(body or b"{}")
+        time_min, time_max = request["timeMin"], request["timeMax"]
+        calendars = {}
+        for item in request.get("items", []):
+            cal_id = item["id"]
+            if cal_id in ("primary", USER_EMAIL):
+                busy = [{"start": e["start"]["dateTime"], "end": e["end"]["dateTime"]}
+                        for e in self.state.events.values() if e["status"] != "cancelled" and "dateTime" in e["start"]
+                        and e["end"]["dateTime"] > time_min and e["start"]["dateTime"] < time_max]
+            else:
+                # Deterministic pseudo-random schedule for any other attendee
+                rng = random.Random(cal_id)
+                day = datetime.fromisoformat(time_min.replace("Z", "+00:00")).replace(hour=0, minute=0, second=0)
+                end = datetime.fromisoformat(time_max.replace("Z", "+00:00"))
+                busy = []
+                while day < end:
+                    for _ in range(rng.randint(0, 4)):
+                        start = day + timedelta(hours=rng.randint(8, 17), minutes=rng.choice((0, 30)))
+                        busy.append({"start": start.isoformat(), "end": (start + timedelta(minutes=rng.choice((30, 60, 90)))).isoformat()})
+                    day += timedelta(days=1)
+            calendars[cal_id] = {"busy": busy}
+        return {"kind": "calendar#freeBusy", "timeMin": time_min, "timeMax": time_max, "calendars": calendars}
+
+    def events_list(self, calendar_id, query, **_):
+        if calendar_id not in ("primary", USER_EMAIL):
+            return {"items": [], "nextSyncToken": f"sync{self.state.version}"}
+        with self.state.lock:
+            events = sorted(self.state.events.values(), key=lambda e: e["start"].get("dateTime", e["start"].get("date", "")))
+            version = self.state.version
+        if query.get("syncToken"):
+            since = int(query["syncToken"].replace("sync", "") or 0)
+            events = [e for e in events if e["_version"] > since]
+        else:
+            events = [e for e in events if e["status"] != "cancelled"]
+            if query.get("timeMin"):
+                events = [e for e in events if e["end"].get("dateTime", "9") > query["timeMin"]]
+            if query.get("timeMax"):
+                events = [e for e in events if e["start"].get("dateTime", "0") < query["timeMax"]]
+        max_results = int(query.get("maxResults", 250))
+        offset = int(query.get("pageToken", 0) or 0)
+        result = {"items": [self.state.public_event(e) for e in events[offset:offset + max_results]]}
+        if offset + max_results < len(events):
+            result["nextPageToken"] = str(offset + max_results)
+        else:
+            result["nextSyncToken"] = f"sync{version}"
+        return result
+
+    def events_insert(self, calendar_id, body, **_):
+        event = json.loads(body or b"{}")
+        with self.state.lock:
+            event_id = event.get("id") or f"ev{uuid.uuid4().hex[:16]}"
+            if event_id in self.state.events:
+                raise FakeError(409, "The requested identifier already exists.", "duplicate")
+            self.state.events[event_id] = self.state._new_event(event_id, event)
+            return self.state.public_event(self.state.events[event_id])
+
+    def events_get(self, calendar_id, event_id, **_):
+        event = self.state.events.get(event_id)
+        if event is None or event["status"] == "cancelled":
+            raise FakeError(404, "Not Found", "notFound")
+        return self.state.public_event(event)
+
+    def events_patch(self, calendar_id, event_id, headers, body, **_):
+        with self.state.lock:
+            event = self.state.events.get(event_id)
+            if event is None or event["status"] == "cancelled":
+                raise FakeError(404, "Not Found", "notFound")
+            if headers.get("if-match") and headers["if-match"] != event["etag"]:
+                raise FakeError(412, "Precondition Failed", "conditionNotMet")
+            changes = json.loads(body or b"{}")
+            updated = self.state._new_event(event_id, dict(self.state.public_event(event), **changes))
+            self.state.events[event_id] = updated
+            return self.state.public_event(updated)
+
+    def events_delete(self, calendar_id, event_id, **_):
+        with self.state.lock:
+            event = self.state.events.get(event_id)
+            if event is None or event["status"] == "cancelled":
+                raise FakeError(410, "Resource has been deleted", "deleted")
+            self.state.version += 1
+            event.update(status="cancelled", _version=self.state.version)
+        return 204, {}, b""
+
+    # ---------- Docs ----------
+
+    def docs_get(self, doc_id, **_):
+        with self.state.lock:
+            if doc_id not in self.state.docs:
+                raise FakeError(404, "Requested entity was not found.", "notFound")
+            return self.state.doc_structure(doc_id)
+
+    def docs_batch_update(self, doc_id, body, **_):
+        state = self.state
+        with state.lock:
+            if doc_id not in state.docs:
+                raise FakeError(404, "Requested entity was not found.", "notFound")
+            text = state.docs[doc_id]
+            request = json.loads(body or b"{}")
+            required = request.get("writeControl", {}).get("requiredRevisionId")
+            if required and required != state.doc_structure(doc_id)["revisionId"]:
+                raise FakeError(400, "The required revision ID does not match the latest revision.", "failedPrecondition")
+            for change in request.get("requests", []):
+                if "insertText" in change:
+                    insert = change["insertText"]
+                    index = insert["location"]["index"] - 1 if "location" in insert else max(len(text) - 1, 0)
+                    text = text[:index] + insert["text"] + text[index:]
+                elif "deleteContentRange" in change:
+                    span = change["deleteContentRange"]["range"]
+                    text = text[:span["startIndex"] - 1] + text[span["endIndex"] - 1:]
+            state.docs[doc_id] = text
+            state.version += 1
+            state.files[doc_id]["_version"] = state.version
+            return {"documentId": doc_id, "replies": [{} for _ in request.get("requests", [])],
+                    "writeControl": {"requiredRevisionId": f"rev{state.version}"}}
+
+    # ---------- Batch ----------
+
+    def batch(self, headers, body, **_):
+        """Split a multipart/mixed batch, run each embedded request and build the multipart reply"""
+        self.inject_faults()
+        message = email.message_from_bytes(
+            b"Content-Type: " + headers["content-type"].encode("latin-1") + b"\r\n\r\n" + body)
+        boundary = f"batch_{uuid.uuid4().hex}"
+        out = []
+        for part in message.get_payload():
+            raw = part.get_payload(decode=False).encode("utf-8")
+            head, _, inner_body = raw.replace(b"\r\n", b"\n").partition(b"\n\n")
+            request_line, *header_lines = head.decode("utf-8").split("\n")
+            method, path, _ = request_line.split(" ", 2)
+            inner_headers = {}
+            for line in header_lines:
+                if ":" in line:
+                    key, value = line.split(":", 1)
+                    inner_headers[key.strip().lower()] = value.strip()
+            status, reply_headers, payload = self.dispatch(method, urlparse(path)._replace(scheme="", netloc="").geturl(),
+                                                           inner_headers, inner_body)
+            content_id = part["Content-ID"].strip("<>")
+            reply = f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\n"
+            reply += f"Content-Type: {reply_headers.get('content-type', 'application/json')}\r\n\r\n"
+            out.append(f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                       + reply + payload.decode("utf-8") + "\r\n")
+        out.append(f"--{boundary}--\r\n")
+        return 200, {"content-type": f"multipart/mixed; boundary={boundary}"}, "".join(out).encode("utf-8")
+
+def public_file(meta):
+    return {k: v for k, v in meta.items() if not k.startswith("_")}
+
+class FakeGoogleHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; with Nagle on, every reply waits for a delayed ACK
+    disable_nagle_algorithm = True
+    api = None  # set by make_server
+
+    def handle_any(self):
+        length = int(self.headers.get("content-length") or 0)
+        body = self.rfile.read(length) if length else b""
+        headers = {k.lower(): v for k, v in self.headers.items()}
+        status, reply_headers, payload = self.api.dispatch(self.command, self.path, headers, body)
+        self.send_response(status)
+        for key, value in reply_headers.items():
+            if key != "content-length":
+                self.send_header(key, value)
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_any
+
+    def log_message(self, format, *args):
+        pass
+
+def make_server(host="127.0.0.1", port=0, **options):
+    """Create (but do not start) a fake API server; port 0 picks a free port"""
+    seed = options.pop("seed", 1)
+    state = FakeGoogleState(seed=seed, n_files=options.pop("n_files", 200),
+                            n_messages=options.pop("n_messages", 200), n_events=options.pop("n_events", 300))
+    handler = type("BoundFakeGoogleHandler", (FakeGoogleHandler,), {"api": FakeGoogleApi(state, seed=seed, **options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Google Workspace API backend for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Base latency added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Extra uniformly random latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 503")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests failing with 429")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--events", type=int, default=300)
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                         error_rate=args.error_rate, rate_429=args.rate_429, seed=args.seed,
+                         n_files=args.files, n_messages=args.messages, n_events=args.events)
+    print(f"Fake Google API listening on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+End-to-end load test: drives mcp_toolkit.py over stdio JSON-RPC (the same way server.js does)
+against the fake Google backend in fake_google_api.py.
+
+Each workload runs in a fresh toolkit process so its peak RSS can be reported on its own;
+--mixed additionally runs every workload together in one process.
+
+Usage:
+    python loadtest/loadtest_toolkit.py                                # all workloads, 200 calls each
+    python loadtest/loadtest_toolkit.py --mix drive_read,gmail_read_message --concurrency 32
+    python loadtest/loadtest_toolkit.py --duration 30 --latency-ms 50 --jitter-ms 30 --rate-429 0.02
+    python loadtest/loadtest_toolkit.py --api-endpoint http://127.0.0.1:8765   # external fake server
+    python loadtest/loadtest_toolkit.py --json results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(LOADTEST_DIR)
+sys.path.insert(0, LOADTEST_DIR)
+
+from fake_google_api import make_server  # noqa: E402
+
+BASE_DAY = datetime(2024, 6, 3, tzinfo=timezone.utc)
+
+# ==================== WORKLOADS ====================
+
+def iso(dt: datetime) -> str:
+    return dt.isoformat().replace("+00:00", "Z")
+
+def random_window(rng, days: int):
+    start = BASE_DAY + timedelta(days=rng.randint(-20, 20))
+    return iso(start), iso(start + timedelta(days=days))
+
+WORKLOADS = {
+    "drive_search": lambda rng: {"query": rng.choice(("report", "budget", "meeting", "roadmap"))},
+    "drive_read": lambda rng: {"fileId": f"file{rng.choice([i for i in range(200) if i % 6 in (1, 2, 3, 5)]):05d}"},
+    "drive_list_all_files": lambda rng: {"max_results": 50},
+    "drive_list_folder_contents": lambda rng: {"folder_id": f"file{rng.randrange(0, 60, 6):05d}",
+                                               "include_subfolders": False},
+    "drive_create": lambda rng: {"name": f"load {rng.random():.6f}.txt", "mimeType": "text/plain",
+                                 "content": "load test\n" * rng.randint(1, 500)},
+    "gmail_list_messages": lambda rng: {"max_results": 25},
+    "gmail_read_message": lambda rng: {"message_id": f"msg{rng.randrange(200):05d}"},
+    "gmail_read_attachments": lambda rng: {"message_id": f"msg{rng.randrange(0, 200, 3):05d}"},
+    "gmail_search_and_summarize": lambda rng: {"sender": f"sender{rng.randrange(17)}", "max_results": 10},
+    "gmail_send_message": lambda rng: {"to": f"user{rng.randrange(1000)}@example.com",
+                                       "subject": "Load test", "body": "Hello from the load test"},
+    "gmail_mail_merge": lambda rng: {
+        "subject_template": "Hi {name}", "body_template": "Hello {name}, your code is {code}.",
+        "recipients": [{"email": f"user{i}@example.com", "name": f"User {i}", "code": rng.randrange(10**6)}
+                       for i in range(20)],
+        "max_per_second": 50, "merge_id": f"load-{rng.getrandbits(48):x}"},
+    "calendar_list_events": lambda rng: dict(zip(("timeMin", "timeMax"), random_window(rng, 7)), maxResults=25),
+    "calendar_get_availability": lambda rng: dict(zip(("timeMin", "timeMax"), random_window(rng, 5))),
+    "calendar_find_meeting_slots": lambda rng: dict(
+        zip(("timeMin", "timeMax"), random_window(rng, 10)),
+        attendees=[f"person{rng.randrange(500)}@example.com" for _ in range(rng.randint(2, 12))],
+        duration_minutes=rng.choice((30, 60))),
+    "calendar_create_event_with_invitations": lambda rng: {
+        "summary": "Load test event", "startTime": iso(BASE_DAY + timedelta(hours=rng.randrange(24 * 30))),
+        "endTime": iso(BASE_DAY + timedelta(hours=24 * 30 + 1)), "send_invitations": False},
+    "calendar_bulk_create_events": lambda rng: {"events": [
+        {"summary": f"Bulk {rng.getrandbits(40):x}",
+         "startTime": iso(BASE_DAY + timedelta(hours=h)),
+         "endTime": iso(BASE_DAY + timedelta(hours=h, minutes=30))}
+        for h in rng.sample(range(24 * 60), 25)]},
+}
+
+# ==================== STDIO CLIENT ====================
+
+class ToolkitProcess:
+    """One mcp_toolkit.py child process spoken to with newline-delimited JSON-RPC"""
+
+    def __init__(self, api_endpoint: str, state_dir: str, timeout: float, trace_sample_rate: float = 0.0,
+                 result_cache: bool = False):
+        self.api_endpoint = api_endpoint
+        self.trace_sample_rate = trace_sample_rate
+        self.result_cache = result_cache
+        self.state_dir = state_dir
+        self.timeout = timeout
+        self.next_id = 0
+        self.pending = {}
+
+    async def start(self):
+        env = dict(os.environ,
+                   GOOGLE_ACCESS_TOKEN="fake-access-token", GOOGLE_REFRESH_TOKEN="fake-refresh-token",
+                   GOOGLE_CLIENT_ID="fake-client", GOOGLE_CLIENT_SECRET="fake-secret",
+                   GOOGLE_TOKEN_EXPIRES_AT=str(int((time.time() + 86400) * 1000)),
+                   GOOGLE_API_ENDPOINT=self.api_endpoint, MCP_TOOLKIT_STATE_DIR=self.state_dir,
+                   SESSION_USER_ID="loadtest", PYTHONUNBUFFERED="1")
+        if not self.result_cache:
+            # Measure the Google round trips, not repeated answers from the toolkit's result cache
+            env["MCP_RESULT_CACHE_MAX_ENTRIES"] = "0"
+        if self.trace_sample_rate:
+            env.update(MCP_TRACE_EXPORT=f"{self.api_endpoint}/v1/traces",
+                       MCP_TRACE_SAMPLE_RATE=str(self.trace_sample_rate))
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(SERVER_DIR, "mcp_toolkit.py"), cwd=SERVER_DIR, env=env,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+            limit=64 * 1024 * 1024)
+        self.reader = asyncio.create_task(self.read_loop())
+        await self.request("initialize", {"protocolVersion": "2024-11-05", "capabilities": {},
+                                          "clientInfo": {"name": "loadtest", "version": "1.0.0"}})
+        await self.send({"jsonrpc": "2.0", "method": "notifications/initialized"})
+
+    async def read_loop(self):
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            future = self.pending.pop(message.get("id"), None)
+            if future and not future.done():
+                future.set_result(message)
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError("toolkit process exited"))
+
+    async def send(self, message: dict):
+        self.proc.stdin.write(json.dumps(message).encode("utf-8") + b"\n")
+        await self.proc.stdin.drain()
+
+    async def request(self, method: str, params: dict) -> dict:
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[self.next_id] = future
+        await self.send({"jsonrpc": "2.0", "id": self.next_id, "method": method, "params": params})
+        return await asyncio.wait_for(future, self.timeout)
+
+    def peak_rss_mb(self) -> float:
+        """High-water RSS of the child from /proc (Linux only; 0 elsewhere)"""
+        try:
+            with open(f"/proc/{self.proc.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return 0.0
+
+    async def stop(self):
+        self.proc.stdin.close()
+        try:
+            await asyncio.wait_for(self.proc.wait(), 5)
+        except asyncio.TimeoutError:
+            self.proc.kill()
+            await self.proc.wait()
+        self.reader.cancel()
+
+# ==================== DRIVER ====================
+
+async def run_phase(names, args, api_endpoint, seed):
+    """Run one batch of calls for the given workloads in a fresh toolkit process"""
+    rng = random.Random(seed)
+    toolkit = ToolkitProcess(api_endpoint, tempfile.mkdtemp(prefix="mcp_load_"), args.timeout,
+                             args.trace_sample_rate, args.result_cache)
+    await toolkit.start()
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    remaining = [args.requests]
+
+    async def worker():
+        while True:
+            if deadline is not None:
+                if time.perf_counter() >= deadline:
+                    return
+            elif remaining[0] <= 0:
+                return
+            else:
+                remaining[0] -= 1
+            name = rng.choice(names)
+            started = time.perf_counter()
+            try:
+                reply = await toolkit.request("tools/call", {"name": name, "arguments": WORKLOADS[name](rng)})
+                result = reply.get("result") or {}
+                text = "".join(c.get("text", "") for c in result.get("content", []))
+                failed = "error" in reply or result.get("isError")
+                if failed and args.verbose:
+                    print(f"  {name}: {(text or reply.get('error'))!s:.200}", file=sys.stderr)
+            except (asyncio.TimeoutError, RuntimeError):
+                failed = True
+            samples[name].append(time.perf_counter() - started)
+            errors[name] += bool(failed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    peak_rss = toolkit.peak_rss_mb()
+    toolkit_metrics = None
+    if args.server_metrics:
+        reply = await toolkit.request("resources/read", {"uri": "toolkit://metrics"})
+        toolkit_metrics = json.loads(reply["result"]["contents"][0]["text"])
+    await toolkit.stop()
+    results = {name: summarize(samples[name], errors[name], elapsed, peak_rss) for name in names}
+    if toolkit_metrics:
+        print_api_metrics(toolkit_metrics)
+        for name in names:
+            results[name]["server_metrics"] = toolkit_metrics
+    return results
+
+def summarize(samples, errors, elapsed, peak_rss):
+    ordered = sorted(samples) or [0.0]
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+    return {"calls": len(samples), "errors": errors, "throughput": len(samples) / elapsed if elapsed else 0.0,
+            "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99),
+            "mean_ms": statistics.fmean(ordered) * 1000, "peak_rss_mb": peak_rss}
+
+def print_table(title, results):
+    print(f"\n{title}")
+    print(f"{'workload':42} {'calls':>6} {'err':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak MB':>8}")
+    for name, r in results.items():
+        print(f"{name:42} {r['calls']:6d} {r['errors']:5d} {r['throughput']:8.1f} "
+              f"{r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {r['p99_ms']:9.1f} {r['peak_rss_mb']:8.1f}")
+
+def print_api_metrics(snapshot):
+    """Google API breakdown reported by the toolkit's own toolkit://metrics resource"""
+    for method, m in snapshot["google_api"].items():
+        print(f"    {method:40} calls={m['calls']:<5} errors={m['errors']:<4} retries={m['retries']:<4} "
+              f"sent={m['bytes_sent']:<9} received={m['bytes_received']:<10} p95={m['latency_ms_p95']:.0f}ms")
+    for stage, m in snapshot.get("transport", {}).items():
+        print(f"    {stage:40} frames={m['frames']:<6} bytes={m['bytes']:<11} avg={m['latency_ms_avg']:.2f}ms "
+              f"p99={m['latency_ms_p99']:.0f}ms")
+
+async def main_async(args):
+    server = None
+    api_endpoint = args.api_endpoint
+    if not api_endpoint:
+        server = make_server(port=0, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                             error_rate=args.error_rate, rate_429=args.rate_429, seed=args.seed)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        api_endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+
+    names = [n.strip() for n in args.mix.split(",")] if args.mix else list(WORKLOADS)
+    unknown = [n for n in names if n not in WORKLOADS]
+    if unknown:
+        raise SystemExit(f"Unknown workloads: {', '.join(unknown)} (choose from {', '.join(WORKLOADS)})")
+
+    report = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "per_tool": {}, "mixed": None}
+    try:
+        for n, name in enumerate(names):
+            report["per_tool"].update(await run_phase([name], args, api_endpoint, args.seed + n))
+        print_table(f"Per-workload ({args.concurrency} concurrent, fresh process each)", report["per_tool"])
+        if args.mixed and len(names) > 1:
+            report["mixed"] = await run_phase(names, args, api_endpoint, args.seed)
+            print_table("Mixed (all workloads in one process; peak MB is for the whole run)", report["mixed"])
+    finally:
+        if server:
+            server.shutdown()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {args.json}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test mcp_toolkit.py against a fake Google API backend")
+    parser.add_argument("--mix", help="Comma-separated workloads (default: all)")
+    parser.add_argument("--concurrency", type=int, default=8, help="In-flight tools/call requests")
+    parser.add_argument("--requests", type=int, default=200, help="Calls per phase (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0.0, help="Seconds per phase instead of a call count")
+    parser.add_argument("--mixed", action="store_true", help="Also run all workloads together in one process")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-call timeout, like server.js")
+    parser.add_argument("--api-endpoint", help="Use an already running fake server instead of starting one")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--server-metrics", action="store_true",
+                        help="Read toolkit://metrics after each phase and print the Google API breakdown")
+    parser.add_argument("--trace-sample-rate", type=float, default=0.0,
+                        help="Export this fraction of tool calls as traces to the fake server's /v1/traces "
+                             "(inspect with GET /_fake/traces)")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="Leave the toolkit's result cache on (off by default so every call reaches the backend)")
+    parser.add_argument("--verbose", action="store_true", help="Print failing tool results")
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -1,1808 +1,5593 @@
-import json
-import os
-import sys
-import base64
-import io
-import re
-import mimetypes # <--- ADDED
-from typing import Any, Dict, List, Optional
-from datetime import datetime, timedelta
-from html import unescape
-from googleapiclient.errors import HttpError
-# Email handling imports
-from email.mime.multipart import MIMEMultipart # <--- ADDED
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase # <--- ADDED
-from email import encoders # <--- ADDED
-
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials 
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload, MediaFileUpload # <--- MODIFIED
-
-# PDF text extraction and creation
-try:
-    import PyPDF2
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib.styles import getSampleStyleSheet
-    from reportlab.platypus import SimpleDocTemplate, Paragraph
-    from reportlab.lib.units import inch
-    PDF_SUPPORT = True
-except ImportError:
-    PDF_SUPPORT = False
-
-from mcp.server.fastmcp import FastMCP
-
-# Combined OAuth scopes for both Drive and Gmail
-SCOPES = [
-    'https://www.googleapis.com/auth/drive',
-    'https://www.googleapis.com/auth/gmail.readonly',
-    'https://www.googleapis.com/auth/gmail.send',
-    'https://www.googleapis.com/auth/gmail.labels',
-    'https://www.googleapis.com/auth/gmail.modify',
-    "https://www.googleapis.com/auth/calendar.events",
-    "https://www.googleapis.com/auth/calendar.readonly",
-    'https://www.googleapis.com/auth/documents'
-]
-
-# Global service instances
-drive_service = None
-gmail_service = None
-calendar_service = None
-docs_service = None 
-
-# Create FastMCP instance
-mcp = FastMCP("Google Drive & Gmail MCP Server")
-
-def load_credentials():
-    """Load credentials from environment (from Supabase), not a file."""
-    access_token = os.getenv("GOOGLE_ACCESS_TOKEN")
-    refresh_token = os.getenv("GOOGLE_REFRESH_TOKEN")
-    expires_at = os.getenv("GOOGLE_TOKEN_EXPIRES_AT")
-    client_id = os.getenv("GOOGLE_CLIENT_ID")
-    client_secret = os.getenv("GOOGLE_CLIENT_SECRET")
-
-    if all([access_token, refresh_token, client_id, client_secret]):
-        print(access_token,file=sys.stderr) #debugging
-        print(refresh_token,file=sys.stderr)# debugging
-        print(expires_at,file=sys.stderr) #debugging
-        print(client_id,file=sys.stderr)
-        
-        print("got all required environment variables for Google OAuth",file=sys.stderr)
-
-    try:
-        creds = Credentials(
-            token=access_token,
-            refresh_token=refresh_token,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=client_id,
-            client_secret=client_secret,
-            scopes=SCOPES
-        )
-
-        # Manually set expiration if available
-        if expires_at:
-            creds.expiry = datetime.utcfromtimestamp(int(expires_at) / 1000)
-
-        if creds and creds.expired and creds.refresh_token:
-            print("🔁 Refreshing token...",file=sys.stderr)
-            creds.refresh(Request())
-
-        return creds
-    except Exception as e:
-        print("❌ Error loading credentials:", e,file=sys.stderr)
-        return None
-# ==================== GOOGLE DRIVE FUNCTIONS ====================
-
-def get_export_mime_type(google_mime_type: str) -> str:
-    """Get the export MIME type for Google Workspace files."""
-    mime_type_map = {
-        'application/vnd.google-apps.document': 'text/markdown',
-        'application/vnd.google-apps.spreadsheet': 'text/csv',
-        'application/vnd.google-apps.presentation': 'text/plain',
-        'application/vnd.google-apps.drawing': 'image/png',
-    }
-    return mime_type_map.get(google_mime_type, 'text/plain')
-
-def extract_pdf_text(file_io: io.BytesIO) -> str:
-    """Extract text content from PDF file."""
-    if not PDF_SUPPORT:
-        return "PDF text extraction not available. Please install PyPDF2: pip install PyPDF2"
-    
-    try:
-        file_io.seek(0)  # Reset file pointer
-        pdf_reader = PyPDF2.PdfReader(file_io)
-        text_content = []
-        
-        for page_num, page in enumerate(pdf_reader.pages, 1):
-            try:
-                page_text = page.extract_text()
-                if page_text.strip():
-                    text_content.append(f"--- Page {page_num} ---\n{page_text}")
-            except Exception as e:
-                text_content.append(f"--- Page {page_num} ---\n[Error extracting text: {e}]")
-        
-        if not text_content:
-            return "No text content could be extracted from this PDF."
-        
-        return "\n\n".join(text_content)
-    
-    except Exception as e:
-        return f"Error extracting PDF text: {e}"
-
-def create_pdf_from_text(text_content: str) -> io.BytesIO:
-    """Create a PDF file from text content."""
-    if not PDF_SUPPORT:
-        raise Exception("PDF creation not available. Please install reportlab: pip install reportlab")
-    
-    try:
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=72, bottomMargin=72)
-        styles = getSampleStyleSheet()
-        normal_style = styles['Normal']
-        
-        # Split text into paragraphs and create PDF content
-        paragraphs = []
-        
-        # Process text line by line
-        lines = text_content.split('\n')
-        for line in lines:
-            if line.strip():
-                # Clean the text more thoroughly
-                cleaned_line = (line.replace('<', '&lt;')
-                                  .replace('>', '&gt;')
-                                  .replace('&', '&amp;')
-                                  .replace('"', '&quot;')
-                                  .replace("'", '&apos;'))
-                
-                # Handle very long lines by wrapping them
-                if len(cleaned_line) > 100:
-                    words = cleaned_line.split(' ')
-                    current_line = []
-                    for word in words:
-                        current_line.append(word)
-                        if len(' '.join(current_line)) > 80:
-                            if len(current_line) > 1:
-                                paragraphs.append(Paragraph(' '.join(current_line[:-1]), normal_style))
-                                current_line = [word]
-                    if current_line:
-                        paragraphs.append(Paragraph(' '.join(current_line), normal_style))
-                else:
-                    paragraphs.append(Paragraph(cleaned_line, normal_style))
-            else:
-                # Add spacing for empty lines
-                paragraphs.append(Paragraph('&nbsp;', normal_style))
-        
-        # Build the PDF
-        doc.build(paragraphs)
-        buffer.seek(0)
-        return buffer
-    
-    except Exception as e:
-        raise Exception(f"Error creating PDF: {e}")
-
-def is_base64_content(content: str) -> bool:
-    """Check if content is base64 encoded."""
-    try:
-        # Try to decode as base64
-        decoded = base64.b64decode(content)
-        # Check if it re-encodes to the same string
-        return base64.b64encode(decoded).decode('utf-8') == content
-    except:
-        return False
-
-@mcp.resource("gdrive:///{file_id}")
-def read_file(file_id: str) -> str:
-    """Read a Google Drive file resource."""
-    try:
-        # Get file metadata
-        file_metadata = drive_service.files().get(fileId=file_id, fields='mimeType').execute()
-        mime_type = file_metadata.get('mimeType', '')
-        
-        # Handle Google Workspace files
-        if mime_type.startswith('application/vnd.google-apps'):
-            export_mime_type = get_export_mime_type(mime_type)
-            request = drive_service.files().export_media(fileId=file_id, mimeType=export_mime_type)
-            
-            file_io = io.BytesIO()
-            downloader = MediaIoBaseDownload(file_io, request)
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
-            
-            content = file_io.getvalue().decode('utf-8')
-            return content
-        
-        # Handle regular files
-        request = drive_service.files().get_media(fileId=file_id)
-        file_io = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_io, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        
-        # Handle different file types
-        if mime_type.startswith('text/') or mime_type == 'application/json':
-            return file_io.getvalue().decode('utf-8')
-        elif mime_type == 'application/pdf':
-            return extract_pdf_text(file_io)
-        else:
-            # Return base64 encoded for other binary files
-            return base64.b64encode(file_io.getvalue()).decode('utf-8')
-            
-    except Exception as e:
-        raise Exception(f"Error reading file {file_id}: {e}")
-
-# ==================== GOOGLE DRIVE TOOLS ====================
-
-@mcp.tool()
-def drive_search(query: str) -> str:
-    """Search for files in Google Drive"""
-    try:
-        # Escape special characters for Drive API
-        escaped_query = query.replace("\\", "\\\\").replace("'", "\\'")
-        formatted_query = f"fullText contains '{escaped_query}'"
-        
-        results = drive_service.files().list(
-            q=formatted_query,
-            pageSize=10,
-            fields="files(id, name, mimeType, modifiedTime, size)"
-        ).execute()
-        
-        files = results.get('files', [])
-        file_count = len(files)
-        
-        if file_count == 0:
-            return "No files found."
-        
-        file_list = []
-        for file in files:
-            file_list.append(f"{file['name']} ({file['mimeType']}) [ID: {file['id']}]")
-        
-        return f"Found {file_count} files:\n" + "\n".join(file_list)
-    
-    except Exception as e:
-        return f"Error searching files: {str(e)}"
-
-@mcp.tool()
-def drive_read(fileId: str) -> str:
-    """Read the contents of a file from Google Drive using its fileId"""
-    try:
-        # Get file metadata
-        file_metadata = drive_service.files().get(fileId=fileId, fields='mimeType,name').execute()
-        mime_type = file_metadata.get('mimeType', '')
-        file_name = file_metadata.get('name', 'Unknown')
-        
-        # Handle Google Workspace files
-        if mime_type.startswith('application/vnd.google-apps'):
-            export_mime_type = get_export_mime_type(mime_type)
-            request = drive_service.files().export_media(fileId=fileId, mimeType=export_mime_type)
-            
-            file_io = io.BytesIO()
-            downloader = MediaIoBaseDownload(file_io, request)
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
-            
-            content = file_io.getvalue().decode('utf-8')
-            return f"File: {file_name}\nContent:\n\n{content}"
-        
-        # Handle regular files
-        request = drive_service.files().get_media(fileId=fileId)
-        file_io = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_io, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        
-        # Handle different file types
-        if mime_type.startswith('text/') or mime_type == 'application/json':
-            content = file_io.getvalue().decode('utf-8')
-            return f"File: {file_name}\nContent:\n\n{content}"
-        elif mime_type == 'application/pdf':
-            content = extract_pdf_text(file_io)
-            return f"File: {file_name}\nExtracted Text Content:\n\n{content}"
-        else:
-            # For other binary files, return file info and base64 if small enough
-            file_size = len(file_io.getvalue())
-            if file_size <= 1024 * 1024:  # 1MB limit for base64 encoding
-                encoded_content = base64.b64encode(file_io.getvalue()).decode('utf-8')
-                return f"File: {file_name}\nBinary file (Base64 encoded):\n\n{encoded_content}"
-            else:
-                return f"File: {file_name}\nBinary file too large to encode. File size: {file_size} bytes, MIME type: {mime_type}"
-    
-    except Exception as e:
-        return f"Error reading file {fileId}: {str(e)}"
-
-@mcp.tool()
-def drive_edit(fileId: str, content: str) -> str:
-    """Edit the content of an existing file in Google Drive"""
-    try:
-        # Get current file metadata to preserve MIME type
-        file_metadata = drive_service.files().get(fileId=fileId, fields='mimeType,name').execute()
-        mime_type = file_metadata.get('mimeType', 'text/plain')
-        file_name = file_metadata.get('name', 'Unknown')
-        
-        # Handle PDF editing differently
-        if mime_type == 'application/pdf':
-            if is_base64_content(content):
-                # Content is already base64 encoded binary data
-                binary_content = base64.b64decode(content)
-                media = MediaIoBaseUpload(
-                    io.BytesIO(binary_content),
-                    mimetype=mime_type,
-                    resumable=True
-                )
-            else:
-                # Content is text that needs to be converted to PDF
-                pdf_buffer = create_pdf_from_text(content)
-                media = MediaIoBaseUpload(
-                    pdf_buffer,
-                    mimetype=mime_type,
-                    resumable=True
-                )
-        else:
-            # Handle other file types
-            if is_base64_content(content) and not mime_type.startswith('text/'):
-                # Binary content encoded as base64
-                binary_content = base64.b64decode(content)
-                media = MediaIoBaseUpload(
-                    io.BytesIO(binary_content),
-                    mimetype=mime_type,
-                    resumable=True
-                )
-            else:
-                # Text content
-                media = MediaIoBaseUpload(
-                    io.BytesIO(content.encode('utf-8')),
-                    mimetype=mime_type,
-                    resumable=True
-                )
-        
-        file = drive_service.files().update(
-            fileId=fileId,
-            media_body=media,
-            fields='id, name, mimeType'
-        ).execute()
-        
-        return f"File updated successfully: {file['name']} (ID: {file['id']}, MIME type: {file['mimeType']})"
-    
-    except Exception as e:
-        return f"Error editing file {fileId}: {str(e)}"
-
-@mcp.tool()
-def drive_delete(fileId: str) -> str:
-    """Delete a file from Google Drive using its fileId"""
-    try:
-        # Move to trash
-        drive_service.files().update(
-            fileId=fileId,
-            body={'trashed': True}
-        ).execute()
-        
-        return f"File with ID {fileId} has been moved to the trash."
-    
-    except Exception as e:
-        return f"Error deleting file {fileId}: {str(e)}"
-
-# Add these tools to your mcp_toolkit.py file
-
-@mcp.tool()
-def drive_upload_file(file_path: str, file_name: Optional[str] = None, folder_id: Optional[str] = None) -> str:
-    """
-    Upload a file to Google Drive
-    
-    Args:
-        file_path: Path to the file to upload (from uploads directory)
-        file_name: Optional custom name for the file (defaults to original filename)
-        folder_id: Optional Google Drive folder ID to upload to (defaults to root)
-    """
-    try:
-        # Check if file exists
-        if not os.path.exists(file_path):
-            return f"Error: File not found at {file_path}"
-        
-        # Get file info
-        original_filename = os.path.basename(file_path)
-        upload_filename = file_name if file_name else original_filename
-        
-        # Detect MIME type
-        mime_type, _ = mimetypes.guess_type(file_path)
-        if not mime_type:
-            mime_type = 'application/octet-stream'
-        
-        # Prepare file metadata
-        file_metadata = {
-            'name': upload_filename
-        }
-        
-        # Add parent folder if specified
-        if folder_id:
-            file_metadata['parents'] = [folder_id]
-        
-        # Create media upload object
-        media = MediaFileUpload(file_path, mimetype=mime_type, resumable=True)
-        
-        # Upload file to Drive
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id,name,size,mimeType,webViewLink'
-        ).execute()
-        
-        # Get file size
-        file_size = os.path.getsize(file_path)
-        
-        response = f"File uploaded to Google Drive successfully!\n"
-        response += f"File Name: {file['name']}\n"
-        response += f"File ID: {file['id']}\n"
-        response += f"MIME Type: {file['mimeType']}\n"
-        response += f"Size: {file_size} bytes\n"
-        response += f"View Link: {file.get('webViewLink', 'N/A')}\n"
-        
-        return response
-        
-    except HttpError as e:
-        return f"Google Drive API error: {str(e)}"
-    except Exception as e:
-        return f"Error uploading file to Drive: {str(e)}"
-
-
-@mcp.tool()
-def drive_move(fileId: str, targetFolderId: str) -> str:
-    """Move a file to a different folder in Google Drive"""
-    try:
-        # Get current parents
-        file = drive_service.files().get(fileId=fileId, fields='parents').execute()
-        previous_parents = ','.join(file.get('parents', []))
-        
-        # Move file
-        file = drive_service.files().update(
-            fileId=fileId,
-            addParents=targetFolderId,
-            removeParents=previous_parents,
-            fields='id, name, parents'
-        ).execute()
-        
-        return f"File moved successfully: {file['name']} (ID: {file['id']}) to folder ID: {targetFolderId}"
-    
-    except Exception as e:
-        return f"Error moving file {fileId}: {str(e)}"
-
-@mcp.tool()
-def drive_share_file(fileId: str, email: str, role: str = "reader", send_notification: bool = True) -> str:
-    """Share a Google Drive file with someone and get shareable link
-    
-    Args:
-        fileId: ID of the file to share
-        email: Email address to share with
-        role: Permission level ('reader', 'writer', 'commenter')
-        send_notification: Whether to send email notification
-    """
-    try:
-        # Create permission
-        permission = {
-            'type': 'user',
-            'role': role,
-            'emailAddress': email
-        }
-        
-        drive_service.permissions().create(
-            fileId=fileId,
-            body=permission,
-            sendNotificationEmail=send_notification
-        ).execute()
-        
-        # Get shareable link
-        file_metadata = drive_service.files().get(
-            fileId=fileId, 
-            fields='webViewLink,name'
-        ).execute()
-        
-        return f"File '{file_metadata['name']}' shared with {email} as {role}.\nShareable link: {file_metadata['webViewLink']}"
-    
-    except Exception as e:
-        return f"Error sharing file {fileId}: {str(e)}"
-
-@mcp.tool()
-def drive_get_shareable_link(fileId: str, make_public: bool = False) -> str:
-    """Get shareable link for a Google Drive file
-    
-    Args:
-        fileId: ID of the file
-        make_public: Whether to make file publicly accessible
-    """
-    try:
-        if make_public:
-            # Make file publicly readable
-            permission = {
-                'type': 'anyone',
-                'role': 'reader'
-            }
-            drive_service.permissions().create(
-                fileId=fileId,
-                body=permission
-            ).execute()
-        
-        # Get file metadata including links
-        file_metadata = drive_service.files().get(
-            fileId=fileId, 
-            fields='webViewLink,webContentLink,name'
-        ).execute()
-        
-        result = f"File: {file_metadata['name']}\n"
-        result += f"View link: {file_metadata['webViewLink']}\n"
-        if 'webContentLink' in file_metadata:
-            result += f"Download link: {file_metadata['webContentLink']}"
-        
-        return result
-    
-    except Exception as e:
-        return f"Error getting shareable link for {fileId}: {str(e)}"
-
-@mcp.tool()
-def drive_create_folder(name: str, parent_folder_id: str = None) -> str:
-    """Create a new folder in Google Drive
-    
-    Args:
-        name: Name of the folder to create
-        parent_folder_id: ID of parent folder (None for root directory)
-    """
-    try:
-        folder_metadata = {
-            'name': name,
-            'mimeType': 'application/vnd.google-apps.folder'
-        }
-        
-        # Set parent folder if specified
-        if parent_folder_id:
-            folder_metadata['parents'] = [parent_folder_id]
-        
-        folder = drive_service.files().create(
-            body=folder_metadata,
-            fields='id, name, parents'
-        ).execute()
-        
-        parent_info = f" in folder ID: {parent_folder_id}" if parent_folder_id else " in root directory"
-        return f"Folder created successfully: '{folder['name']}' (ID: {folder['id']}){parent_info}"
-    
-    except Exception as e:
-        return f"Error creating folder: {str(e)}"
-
-@mcp.tool()
-def drive_list_folder_contents(folder_id: str, include_subfolders: bool = True) -> str:
-    """List all files and folders within a specific folder
-    
-    Args:
-        folder_id: ID of the folder to list contents (use 'root' for root directory)
-        include_subfolders: Whether to include subfolders in the listing
-    """
-    try:
-        # Query to get files in the specified folder
-        query = f"'{folder_id}' in parents and trashed=false"
-        
-        results = drive_service.files().list(
-            q=query,
-            pageSize=100,
-            fields="files(id, name, mimeType, size, modifiedTime, owners)",
-            orderBy="folder,name"
-        ).execute()
-        
-        items = results.get('files', [])
-        
-        if not items:
-            return f"No files or folders found in the specified location."
-        
-        # Get folder name for context
-        try:
-            if folder_id == 'root':
-                folder_name = "My Drive (Root)"
-            else:
-                folder_info = drive_service.files().get(fileId=folder_id, fields='name').execute()
-                folder_name = folder_info.get('name', 'Unknown Folder')
-        except:
-            folder_name = f"Folder ID: {folder_id}"
-        
-        # Separate folders and files
-        folders = []
-        files = []
-        
-        for item in items:
-            item_info = {
-                'name': item['name'],
-                'id': item['id'],
-                'mimeType': item.get('mimeType', ''),
-                'size': item.get('size', 'N/A'),
-                'modified': item.get('modifiedTime', 'Unknown'),
-                'owner': item.get('owners', [{}])[0].get('displayName', 'Unknown') if item.get('owners') else 'Unknown'
-            }
-            
-            if item['mimeType'] == 'application/vnd.google-apps.folder':
-                folders.append(item_info)
-            else:
-                files.append(item_info)
-        
-        # Build response
-        response = f"Contents of '{folder_name}':\n"
-        response += f"Total items: {len(items)} ({len(folders)} folders, {len(files)} files)\n\n"
-        
-        # List folders first
-        if folders:
-            response += "📁 FOLDERS:\n"
-            for folder in folders:
-                response += f"  📁 {folder['name']} (ID: {folder['id']}) - Modified: {folder['modified'][:10]}\n"
-            response += "\n"
-        
-        # List files
-        if files:
-            response += "📄 FILES:\n"
-            for file in files:
-                size_info = f" - {format_file_size(file['size'])}" if file['size'] != 'N/A' else ""
-                file_type = get_file_type_emoji(file['mimeType'])
-                response += f"  {file_type} {file['name']} (ID: {file['id']}){size_info} - Modified: {file['modified'][:10]}\n"
-        
-        # Add subfolder contents if requested
-        if include_subfolders and folders:
-            response += "\n" + "="*50 + "\n"
-            response += "SUBFOLDER CONTENTS:\n"
-            for folder in folders[:3]:  # Limit to first 3 subfolders to avoid overwhelming output
-                try:
-                    subfolder_query = f"'{folder['id']}' in parents and trashed=false"
-                    subfolder_results = drive_service.files().list(
-                        q=subfolder_query,
-                        pageSize=20,
-                        fields="files(id, name, mimeType)"
-                    ).execute()
-                    
-                    subfolder_items = subfolder_results.get('files', [])
-                    if subfolder_items:
-                        response += f"\n📁 {folder['name']} ({len(subfolder_items)} items):\n"
-                        for item in subfolder_items[:10]:  # Show first 10 items
-                            emoji = "📁" if item['mimeType'] == 'application/vnd.google-apps.folder' else get_file_type_emoji(item['mimeType'])
-                            response += f"    {emoji} {item['name']} (ID: {item['id']})\n"
-                        if len(subfolder_items) > 10:
-                            response += f"    ... and {len(subfolder_items) - 10} more items\n"
-                except:
-                    response += f"\n📁 {folder['name']}: [Could not access contents]\n"
-            
-            if len(folders) > 3:
-                response += f"\n... and {len(folders) - 3} more subfolders not shown. Use include_subfolders=False for cleaner output.\n"
-        
-        return response
-    
-    except Exception as e:
-        return f"Error listing folder contents: {str(e)}"
-
-@mcp.tool()
-def drive_list_all_files(max_results: int = 50, file_type: str = None, order_by: str = "name") -> str:
-    """List all files and folders in Google Drive
-    
-    Args:
-        max_results: Maximum number of items to return (default: 50, max: 1000)
-        file_type: Filter by file type ('folder', 'document', 'spreadsheet', 'presentation', 'pdf', 'image', etc.)
-        order_by: Sort order ('name', 'modifiedTime', 'createdTime', 'quotaBytesUsed')
-    """
-    try:
-        # Build query based on file_type filter
-        query = "trashed=false"
-        
-        if file_type:
-            file_type_queries = {
-                'folder': "mimeType='application/vnd.google-apps.folder'",
-                'document': "mimeType='application/vnd.google-apps.document'",
-                'spreadsheet': "mimeType='application/vnd.google-apps.spreadsheet'",
-                'presentation': "mimeType='application/vnd.google-apps.presentation'",
-                'pdf': "mimeType='application/pdf'",
-                'image': "mimeType contains 'image/'",
-                'video': "mimeType contains 'video/'",
-                'audio': "mimeType contains 'audio/'",
-                'text': "mimeType contains 'text/'"
-            }
-            
-            if file_type.lower() in file_type_queries:
-                query += f" and {file_type_queries[file_type.lower()]}"
-            else:
-                return f"Unsupported file type filter: {file_type}. Supported types: {', '.join(file_type_queries.keys())}"
-        
-        # Limit max_results to prevent overwhelming output
-        max_results = min(max_results, 1000)
-        
-        results = drive_service.files().list(
-            q=query,
-            pageSize=max_results,
-            fields="files(id, name, mimeType, size, modifiedTime, createdTime, owners, parents, shared, webViewLink)",
-            orderBy=order_by
-        ).execute()
-        
-        items = results.get('files', [])
-        
-        if not items:
-            filter_text = f" matching filter '{file_type}'" if file_type else ""
-            return f"No files found{filter_text}."
-        
-        # Build response
-        filter_text = f" (filtered by: {file_type})" if file_type else ""
-        response = f"All Files in Google Drive{filter_text}:\n"
-        response += f"Showing {len(items)} items (ordered by {order_by}):\n\n"
-        
-        # Separate folders and files for better organization
-        folders = []
-        files = []
-        
-        for item in items:
-            if item['mimeType'] == 'application/vnd.google-apps.folder':
-                folders.append(item)
-            else:
-                files.append(item)
-        
-        # Show folders first
-        if folders:
-            response += f"📁 FOLDERS ({len(folders)}):\n"
-            for folder in folders:
-                modified_date = folder.get('modifiedTime', 'Unknown')[:10]
-                shared_status = " [SHARED]" if folder.get('shared', False) else ""
-                response += f"  📁 {folder['name']} (ID: {folder['id']}) - Modified: {modified_date}{shared_status}\n"
-            response += "\n"
-        
-        # Show files
-        if files:
-            response += f"📄 FILES ({len(files)}):\n"
-            for file in files:
-                size_info = f" - {format_file_size(file.get('size', 'N/A'))}" if file.get('size') else ""
-                modified_date = file.get('modifiedTime', 'Unknown')[:10]
-                shared_status = " [SHARED]" if file.get('shared', False) else ""
-                file_emoji = get_file_type_emoji(file['mimeType'])
-                
-                response += f"  {file_emoji} {file['name']} (ID: {file['id']}){size_info} - Modified: {modified_date}{shared_status}\n"
-        
-        # Add summary statistics
-        total_size = 0
-        size_count = 0
-        for item in items:
-            if item.get('size') and item['size'].isdigit():
-                total_size += int(item['size'])
-                size_count += 1
-        
-        response += f"\n📊 SUMMARY:\n"
-        response += f"  Total items: {len(items)}\n"
-        response += f"  Folders: {len(folders)}\n"
-        response += f"  Files: {len(files)}\n"
-        if size_count > 0:
-            response += f"  Total size (files with size info): {format_file_size(str(total_size))}\n"
-        
-        return response
-    
-    except Exception as e:
-        return f"Error listing all files: {str(e)}"
-# In mcp_toolkit.py, replace the old drive_create_enhanced function with this:
-
-@mcp.tool()
-def drive_create(name: str, mimeType: str, content: str, folder_id: Optional[str] = None) -> str:
-    """
-    Create a new file in Google Drive. Handles Google Docs, PDFs, and plain text.
-    
-    Args:
-        name: Name of the file.
-        mimeType: MIME type ('application/vnd.google-apps.document' for Google Docs, 'application/pdf', 'text/plain', etc.).
-        content: File content. For Google Docs, this is the text that will be in the document.
-        folder_id: Optional Google Drive folder ID to create the file in.
-    """
-    try:
-        file_metadata = {
-            'name': name,
-            'mimeType': mimeType
-        }
-        if folder_id:
-            file_metadata['parents'] = [folder_id]
-
-        # Special handling for Google Docs - create the doc then insert text.
-        if mimeType == 'application/vnd.google-apps.document':
-            
-            # Create an empty document first
-            doc_file = drive_service.files().create(body=file_metadata).execute()
-            document_id = doc_file['id']
-            
-            # Insert the content
-            requests = [{
-                'insertText': {
-                    'location': {'index': 1},
-                    'text': content
-                }
-            }]
-            docs_service.documents().batchUpdate(
-                documentId=document_id,
-                body={'requests': requests}
-            ).execute()
-
-            # Get the document link
-            file_metadata = drive_service.files().get(
-                fileId=document_id, 
-                fields='webViewLink,name'
-            ).execute()
-            
-            return f"✅ Google Document created successfully!\n\n📄 **{name}**\n🆔 Document ID: {document_id}\n🔗 Link: {file_metadata['webViewLink']}"
-
-        # Handle other file types as before
-        media = None
-        if mimeType == 'application/pdf':
-            if is_base64_content(content):
-                binary_content = base64.b64decode(content)
-                media = MediaIoBaseUpload(io.BytesIO(binary_content), mimetype=mimeType, resumable=True)
-            else:
-                pdf_buffer = create_pdf_from_text(content)
-                media = MediaIoBaseUpload(pdf_buffer, mimetype=mimeType, resumable=True)
-        else:
-            if is_base64_content(content) and not mimeType.startswith('text/'):
-                binary_content = base64.b64decode(content)
-                media = MediaIoBaseUpload(io.BytesIO(binary_content), mimetype=mimeType, resumable=True)
-            else:
-                media = MediaIoBaseUpload(io.BytesIO(content.encode('utf-8')), mimetype=mimeType, resumable=True)
-
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, name, mimeType, webViewLink'
-        ).execute()
-        
-        return f"✅ File created successfully!\n\n📄 **{file['name']}**\n🆔 ID: {file['id']}\n📋 MIME type: {file['mimeType']}\n🔗 Link: {file.get('webViewLink', 'N/A')}"
-    
-    except Exception as e:
-        return f"❌ Error creating file: {str(e)}"
-# Helper functions to add at the end of the file (before if __name__ == "__main__":)
-def format_file_size(size_str: str) -> str:
-    """Format file size in human-readable format"""
-    try:
-        if size_str == 'N/A' or not size_str or not size_str.isdigit():
-            return 'Size unknown'
-        
-        size_bytes = int(size_str)
-        
-        if size_bytes < 1024:
-            return f"{size_bytes} B"
-        elif size_bytes < 1024 * 1024:
-            return f"{size_bytes / 1024:.1f} KB"
-        elif size_bytes < 1024 * 1024 * 1024:
-            return f"{size_bytes / (1024 * 1024):.1f} MB"
-        else:
-            return f"{size_bytes / (1024 * 1024 * 1024):.1f} GB"
-    except:
-        return 'Size unknown'
-
-def get_file_type_emoji(mime_type: str) -> str:
-    """Get emoji based on file MIME type"""
-    emoji_map = {
-        'application/vnd.google-apps.folder': '📁',
-        'application/vnd.google-apps.document': '📝',
-        'application/vnd.google-apps.spreadsheet': '📊',
-        'application/vnd.google-apps.presentation': '📽️',
-        'application/vnd.google-apps.drawing': '🎨',
-        'application/pdf': '📄',
-        'image/': '🖼️',
-        'video/': '🎥',
-        'audio/': '🎵',
-        'text/': '📄',
-        'application/zip': '📦',
-        'application/json': '🔧',
-    }
-    
-    # Check exact matches first
-    if mime_type in emoji_map:
-        return emoji_map[mime_type]
-    
-    # Check partial matches
-    for key, emoji in emoji_map.items():
-        if key.endswith('/') and mime_type.startswith(key):
-            return emoji
-    
-    # Default for unknown types
-    return '📄'
-
-# ==================== GMAIL TOOLS ====================
-def strip_html_tags(html_content):
-    """Remove HTML tags and convert to clean text"""
-    if not html_content:
-        return ""
-    
-    # Remove HTML tags
-    clean = re.sub('<.*?>', '', html_content)
-    # Decode HTML entities
-    clean = unescape(clean)
-    # Clean up whitespace
-    clean = re.sub(r'\s+', ' ', clean).strip()
-    return clean
-
-def format_file_size(size_str):
-    """Format file size in human readable format"""
-    try:
-        size = int(size_str)
-        for unit in ['B', 'KB', 'MB', 'GB']:
-            if size < 1024:
-                return f"{size:.1f} {unit}"
-            size /= 1024
-        return f"{size:.1f} TB"
-    except:
-        return size_str
-
-@mcp.tool()
-def gmail_list_messages(max_results: int = 10, query: Optional[str] = None) -> str:
-    """List recent emails with clean, AI-friendly format"""
-    try:
-        params = {'userId': 'me', 'maxResults': max_results}
-        if query:
-            params['q'] = query
-        response = gmail_service.users().messages().list(**params).execute()
-        messages = response.get('messages', [])
-        
-        if not messages:
-            return "No messages found."
-        
-        # Get clean info for each message
-        message_list = []
-        for msg in messages:
-            try:
-                full_msg = gmail_service.users().messages().get(
-                    userId='me', id=msg['id'], format='metadata',
-                    metadataHeaders=['From', 'Subject', 'Date', 'To']
-                ).execute()
-                
-                headers = full_msg.get('payload', {}).get('headers', [])
-                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-                from_addr = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-                to_addr = next((h['value'] for h in headers if h['name'] == 'To'), 'Unknown Recipient')
-                date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
-                
-                # Clean sender name (extract name from "Name <email>" format)
-                sender_clean = from_addr.split('<')[0].strip().strip('"') if '<' in from_addr else from_addr
-                
-                message_list.append(f"ID: {msg['id']}\nSubject: {subject}\nFrom: {sender_clean}\nTo: {to_addr}\nDate: {date}\n")
-                
-            except Exception as e:
-                message_list.append(f"ID: {msg['id']}\nError: Could not fetch details - {str(e)}\n")
-        
-        return "\n" + "="*50 + "\n".join(message_list)
-    
-    except HttpError as e:
-        return f"Gmail API Error: {str(e)}"
-
-@mcp.tool()
-def gmail_read_message(message_id: str, include_attachments_info: bool = True) -> str:
-    """Read email content in clean, AI-friendly format with optional attachment info"""
-    try:
-        message = gmail_service.users().messages().get(
-            userId='me', id=message_id, format='full'
-        ).execute()
-
-        # Extract headers
-        headers = message.get('payload', {}).get('headers', [])
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-        recipient = next((h['value'] for h in headers if h['name'] == 'To'), 'Unknown Recipient')
-        date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
-        
-        # Clean sender name
-        sender_clean = sender.split('<')[0].strip().strip('"') if '<' in sender else sender
-        
-        # Extract body text
-        body = extract_email_body(message.get('payload', {}))
-        
-        # Format response
-        response = f"EMAIL DETAILS:\n"
-        response += f"Message ID: {message_id}\n"
-        response += f"Subject: {subject}\n"
-        response += f"From: {sender_clean}\n"
-        response += f"To: {recipient}\n"
-        response += f"Date: {date}\n\n"
-        response += f"BODY:\n{body}\n"
-        
-        # Add attachment info if requested
-        if include_attachments_info:
-            attachments = get_attachment_info(message.get('payload', {}))
-            if attachments:
-                response += f"\nATTACHMENTS ({len(attachments)}):\n"
-                for i, att in enumerate(attachments, 1):
-                    response += f"{i}. {att['filename']} ({att['size']}, {att['mime_type']})\n"
-            else:
-                response += "\nNo attachments found.\n"
-
-        return response
-
-    except HttpError as e:
-        return f"Gmail API Error: {str(e)}"
-    except Exception as e:
-        return f"Error reading message: {str(e)}"
-
-def extract_email_body(payload):
-    """Extract clean text body from email payload"""
-    # Try to get plain text first
-    plain_text = extract_text_from_payload(payload, 'text/plain')
-    if plain_text:
-        return plain_text
-    
-    # Fall back to HTML and strip tags
-    html_text = extract_text_from_payload(payload, 'text/html')
-    if html_text:
-        return strip_html_tags(html_text)
-    
-    return "No readable text content found."
-
-def extract_text_from_payload(payload, mime_type):
-    """Recursively extract text of specific MIME type from payload"""
-    if payload.get('mimeType') == mime_type:
-        data = payload.get('body', {}).get('data')
-        if data:
-            try:
-                return base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-            except:
-                return None
-
-    for part in payload.get('parts', []):
-        result = extract_text_from_payload(part, mime_type)
-        if result:
-            return result
-
-    return None
-
-def get_attachment_info(payload):
-    """Get basic attachment information without downloading"""
-    attachments = []
-    
-    def process_parts(parts):
-        for part in parts:
-            if 'parts' in part:
-                process_parts(part['parts'])
-            elif part.get('filename') and part['body'].get('attachmentId'):
-                attachments.append({
-                    'filename': part['filename'],
-                    'mime_type': part['mimeType'],
-                    'size': format_file_size(str(part['body'].get('size', 0))),
-                    'attachment_id': part['body']['attachmentId']
-                })
-    
-    if 'parts' in payload:
-        process_parts(payload['parts'])
-    
-    return attachments
-
-@mcp.tool()
-def gmail_read_attachments(
-    message_id: Optional[str] = None,
-    sender: Optional[str] = None,
-    subject_contains: Optional[str] = None,
-    days_back: int = 7,
-    max_results: int = 5,
-    max_attachment_size_mb: int = 10,
-    read_text_content: bool = True
-) -> str:
-    """
-    Efficiently read email attachments with flexible search options
-    
-    Args:
-        message_id: Specific email ID to read attachments from
-        sender: Filter by sender email/name  
-        subject_contains: Filter by subject keywords
-        days_back: How many days back to search (default: 7)
-        max_results: Max emails to process (default: 5)
-        max_attachment_size_mb: Max attachment size to process in MB
-        read_text_content: Whether to extract and preview text content
-    """
-    try:
-        # If specific message ID provided, process that email only
-        if message_id:
-            return process_single_email_attachments(message_id, max_attachment_size_mb, read_text_content)
-        
-        # Build search query for emails with attachments
-        query_parts = ["has:attachment"]
-        
-        # Add date filter
-        date_filter = datetime.now() - timedelta(days=days_back)
-        query_parts.append(f"after:{date_filter.strftime('%Y/%m/%d')}")
-        
-        # Add optional filters
-        if sender:
-            query_parts.append(f"from:({sender})")
-        if subject_contains:
-            query_parts.append(f'subject:"{subject_contains}"')
-        
-        search_query = " ".join(query_parts)
-        
-        # Search for messages
-        results = gmail_service.users().messages().list(
-            userId='me',
-            q=search_query,
-            maxResults=max_results
-        ).execute()
-        
-        messages = results.get('messages', [])
-        
-        if not messages:
-            return f"No emails with attachments found.\nSearch criteria: {search_query}"
-        
-        response = f"FOUND {len(messages)} EMAIL(S) WITH ATTACHMENTS\n"
-        response += f"Search Query: {search_query}\n\n"
-        
-        # Process each email
-        for i, message in enumerate(messages, 1):
-            try:
-                email_response = process_single_email_attachments(
-                    message['id'], max_attachment_size_mb, read_text_content
-                )
-                response += f"EMAIL {i}:\n{email_response}\n"
-                response += "="*60 + "\n"
-                
-            except Exception as e:
-                response += f"EMAIL {i}: Error processing {message['id']} - {str(e)}\n"
-                continue
-        
-        return response
-        
-    except Exception as e:
-        return f"Error reading attachments: {str(e)}"
-
-def process_single_email_attachments(message_id: str, max_size_mb: int, read_content: bool) -> str:
-    """Process attachments from a single email"""
-    try:
-        # Get full message
-        message = gmail_service.users().messages().get(
-            userId='me', id=message_id, format='full'
-        ).execute()
-        
-        # Extract email metadata
-        headers = message['payload'].get('headers', [])
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-        date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
-        
-        sender_clean = sender.split('<')[0].strip().strip('"') if '<' in sender else sender
-        
-        response = f"Subject: {subject}\n"
-        response += f"From: {sender_clean}\n"
-        response += f"Date: {date}\n"
-        response += f"Message ID: {message_id}\n\n"
-        
-        # Process attachments
-        attachments = extract_attachments_from_message(message_id, message['payload'], max_size_mb, read_content)
-        
-        if not attachments:
-            return response + "No attachments found in this email."
-        
-        response += f"ATTACHMENTS ({len(attachments)}):\n"
-        
-        for i, attachment in enumerate(attachments, 1):
-            response += f"\n{i}. {attachment['filename']}\n"
-            response += f"   Type: {attachment['mime_type']}\n"
-            response += f"   Size: {attachment['size']}\n"
-            response += f"   Status: {attachment['status']}\n"
-            
-            if attachment.get('content_preview'):
-                response += f"   Content Preview:\n   {attachment['content_preview'][:300]}...\n"
-        
-        return response
-        
-    except Exception as e:
-        return f"Error processing email {message_id}: {str(e)}"
-
-def extract_attachments_from_message(message_id: str, payload: dict, max_size_mb: int, read_content: bool) -> List[Dict]:
-    """Extract and optionally read attachment content from message payload"""
-    attachments = []
-    
-    def process_parts(parts):
-        for part in parts:
-            if 'parts' in part:
-                process_parts(part['parts'])
-            elif part.get('filename') and part['body'].get('attachmentId'):
-                filename = part['filename']
-                mime_type = part['mimeType']
-                size_bytes = part['body'].get('size', 0)
-                attachment_id = part['body']['attachmentId']
-                
-                # Check size limit
-                size_mb = size_bytes / (1024 * 1024) if size_bytes else 0
-                
-                attachment_info = {
-                    'filename': filename,
-                    'mime_type': mime_type,
-                    'size': format_file_size(str(size_bytes)),
-                    'attachment_id': attachment_id
-                }
-                
-                if size_mb > max_size_mb:
-                    attachment_info['status'] = f'Skipped - too large ({size_mb:.1f}MB > {max_size_mb}MB)'
-                    attachment_info['content_preview'] = None
-                else:
-                    try:
-                        # Download attachment data
-                        attachment_data = gmail_service.users().messages().attachments().get(
-                            userId='me',
-                            messageId=message_id,
-                            id=attachment_id
-                        ).execute()
-                        
-                        file_data = base64.urlsafe_b64decode(attachment_data['data'])
-                        attachment_info['status'] = 'Successfully downloaded'
-                        
-                        # Extract content preview if requested
-                        if read_content:
-                            attachment_info['content_preview'] = extract_attachment_content(file_data, mime_type)
-                        else:
-                            attachment_info['content_preview'] = None
-                            
-                    except Exception as e:
-                        attachment_info['status'] = f'Download failed: {str(e)}'
-                        attachment_info['content_preview'] = None
-                
-                attachments.append(attachment_info)
-    
-    if 'parts' in payload:
-        process_parts(payload['parts'])
-    
-    return attachments
-
-def extract_attachment_content(file_data: bytes, mime_type: str) -> str:
-    """Extract readable content from attachment based on MIME type"""
-    try:
-        if mime_type.startswith('text/'):
-            return file_data.decode('utf-8', errors='ignore')
-        
-        elif mime_type == 'application/json':
-            return file_data.decode('utf-8', errors='ignore')
-        
-        elif mime_type in ['application/xml', 'text/xml']:
-            return file_data.decode('utf-8', errors='ignore')
-        
-        elif mime_type == 'application/pdf':
-            # Basic PDF text extraction (you'd need PyPDF2 or similar for full extraction)
-            text = file_data.decode('utf-8', errors='ignore')
-            # Remove PDF binary parts and keep readable text
-            cleaned = re.sub(r'[^\x20-\x7E\n\r\t]', '', text)
-            return cleaned if cleaned.strip() else "PDF content (binary - use PDF reader)"
-        
-        else:
-            return f"Binary file ({mime_type}) - {len(file_data)} bytes"
-            
-    except Exception as e:
-        return f"Content extraction failed: {str(e)}"
-
-@mcp.tool()
-def gmail_search_and_summarize(
-    query: Optional[str] = None,
-    sender: Optional[str] = None, 
-    recipient: Optional[str] = None,
-    subject_contains: Optional[str] = None,
-    max_results: int = 10
-) -> str:
-    """Search emails with clean, summarized results"""
-    try:
-        # Build search query
-        search_parts = []
-        
-        if sender:
-            search_parts.append(f"from:({sender})")
-        if recipient:
-            search_parts.append(f"to:({recipient})")
-        if subject_contains:
-            search_parts.append(f"subject:({subject_contains})")
-        if query:
-            search_parts.append(f"({query})")
-            
-        gmail_query = " ".join(search_parts) if search_parts else "in:inbox"
-        
-        # Search messages
-        results = gmail_service.users().messages().list(
-            userId='me',
-            q=gmail_query,
-            maxResults=max_results
-        ).execute()
-        
-        messages = results.get('messages', [])
-        
-        if not messages:
-            return f"No emails found for query: {gmail_query}"
-        
-        response = f"SEARCH RESULTS ({len(messages)} emails):\n"
-        response += f"Query: {gmail_query}\n\n"
-        
-        # Process each message
-        for i, msg in enumerate(messages, 1):
-            try:
-                message = gmail_service.users().messages().get(
-                    userId='me', id=msg['id'], format='full'
-                ).execute()
-                
-                # Extract headers
-                headers = message['payload'].get('headers', [])
-                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-                sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
-                date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown')
-                
-                sender_clean = sender.split('<')[0].strip().strip('"') if '<' in sender else sender
-                
-                # Get body preview
-                body = extract_email_body(message['payload'])
-                body_preview = body[:200].replace('\n', ' ').strip() + "..." if len(body) > 200 else body
-                
-                response += f"{i}. {subject}\n"
-                response += f"   From: {sender_clean}\n"
-                response += f"   Date: {date}\n"
-                response += f"   Preview: {body_preview}\n"
-                response += f"   ID: {msg['id']}\n\n"
-                
-            except Exception as e:
-                response += f"{i}. Error processing email {msg['id']}: {str(e)}\n\n"
-        
-        return response
-        
-    except Exception as e:
-        return f"Search error: {str(e)}"
-
-@mcp.tool()
-def gmail_send_message(to: str, subject: str, body: str) -> str:
-    """Send a simple email"""
-    try:
-        # Add service validation
-        if gmail_service is None:
-            return "Error: Gmail service not initialized. Please re-authenticate."
-        
-        # Test the service connection first
-        try:
-            profile = gmail_service.users().getProfile(userId='me').execute()
-            from_email = profile['emailAddress']
-            print(f"yeri teri profile {profile}",file=sys.stderr)
-        except Exception as auth_error:
-            return f"Error: Gmail authentication failed. Please re-authenticate. Details: {str(auth_error)}"
-        
-        msg = MIMEText(body)
-        msg['to'] = to
-        msg['from'] = from_email
-        msg['subject'] = subject
-        raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
-        
-        result = gmail_service.users().messages().send(
-            userId='me', body={'raw': raw}
-        ).execute()
-        
-        return f"Email sent successfully!\nMessage ID: {result['id']}\nTo: {to}\nSubject: {subject}"
-    
-    except Exception as e:
-        return f"Error sending email: {str(e)}"
-
-
-@mcp.tool() 
-def gmail_list_labels() -> str:
-    """List Gmail labels in clean format"""
-    try:
-        response = gmail_service.users().labels().list(userId='me').execute()
-        labels = response.get('labels', [])
-        
-        if not labels:
-            return "No labels found."
-        
-        result = "GMAIL LABELS:\n"
-        for label in labels:
-            result += f"- {label['name']} (ID: {label['id']})\n"
-        
-        return result
-        
-    except Exception as e:
-        return f"Error listing labels: {str(e)}"
-
-@mcp.tool()
-def gmail_modify_labels(
-    message_id: str,
-    add_labels: Optional[List[str]] = None,
-    remove_labels: Optional[List[str]] = None
-) -> str:
-    """Add or remove labels - returns simple confirmation"""
-    try:
-        add = add_labels or []
-        remove = remove_labels or []
-        body = {'addLabelIds': add, 'removeLabelIds': remove}
-        
-        gmail_service.users().messages().modify(
-            userId='me', id=message_id, body=body
-        ).execute()
-        
-        actions = []
-        if add:
-            actions.append(f"Added: {', '.join(add)}")
-        if remove:
-            actions.append(f"Removed: {', '.join(remove)}")
-        
-        return f"Labels updated for message {message_id}\n{' | '.join(actions)}"
-        
-    except Exception as e:
-        return f"Error modifying labels: {str(e)}"
-
-@mcp.tool()
-def gmail_delete_message(message_id: str) -> str:
-    """Delete an email - returns simple confirmation"""
-    try:
-        gmail_service.users().messages().delete(userId='me', id=message_id).execute()
-        return f"Email {message_id} deleted successfully."
-    except Exception as e:
-        return f"Error deleting email: {str(e)}"
-
-@mcp.tool()
-def gmail_send_with_drive_attachment(
-    to: str, subject: str, body: str, drive_file_id: str, 
-    share_with_recipient: bool = True
-) -> str:
-    """Send email with Google Drive file link"""
-    try:
-        # Get file info
-        file_metadata = drive_service.files().get(
-            fileId=drive_file_id, 
-            fields='name,webViewLink'
-        ).execute()
-        
-        file_name = file_metadata['name']
-        file_link = file_metadata['webViewLink']
-        
-        # Share file if requested
-        share_status = "not shared"
-        if share_with_recipient:
-            try:
-                permission = {
-                    'type': 'user',
-                    'role': 'reader', 
-                    'emailAddress': to
-                }
-                drive_service.permissions().create(
-                    fileId=drive_file_id,
-                    body=permission,
-                    sendNotificationEmail=False
-                ).execute()
-                share_status = "shared with recipient"
-            except:
-                share_status = "sharing failed"
-        
-        # Enhanced email body
-        enhanced_body = f"{body}\n\n---\nAttached Google Drive File: {file_name}\nLink: {file_link}"
-        
-        # Send email
-        profile = gmail_service.users().getProfile(userId='me').execute()
-        from_email = profile['emailAddress']
-        
-        msg = MIMEText(enhanced_body)
-        msg['to'] = to
-        msg['from'] = from_email
-        msg['subject'] = subject
-        raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
-        
-        result = gmail_service.users().messages().send(
-            userId='me', body={'raw': raw}
-        ).execute()
-        
-        return f"Email sent with Drive file!\nMessage ID: {result['id']}\nFile: {file_name} ({share_status})\nLink: {file_link}"
-    
-    except Exception as e:
-        return f"Error sending email with Drive attachment: {str(e)}"
-
-@mcp.tool()
-def gmail_send_multiple_attachments(
-    to: str, subject: str, body: str, file_paths: List[str]
-) -> str:
-    """Send email with multiple file attachments"""
-    try:
-        # Check files exist
-        missing_files = [f for f in file_paths if not os.path.exists(f)]
-        if missing_files:
-            return f"Files not found: {', '.join(missing_files)}"
-        
-        # Get sender info
-        profile = gmail_service.users().getProfile(userId='me').execute()
-        from_email = profile['emailAddress']
-        
-        # Create multipart message
-        msg = MIMEMultipart()
-        msg['to'] = to
-        msg['from'] = from_email
-        msg['subject'] = subject
-        msg.attach(MIMEText(body, 'plain'))
-        
-        attached_files = []
-        total_size = 0
-        
-        # Attach files
-        for file_path in file_paths:
-            filename = os.path.basename(file_path)
-            file_size = os.path.getsize(file_path)
-            total_size += file_size
-            
-            with open(file_path, 'rb') as f:
-                file_data = f.read()
-            
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(file_data)
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', f'attachment; filename= {filename}')
-            msg.attach(part)
-            
-            attached_files.append({'name': filename, 'size': format_file_size(str(file_size))})
-        
-        # Send email
-        raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
-        result = gmail_service.users().messages().send(userId='me', body={'raw': raw}).execute()
-        
-        files_info = ", ".join([f"{f['name']} ({f['size']})" for f in attached_files])
-        return f"Email sent with {len(attached_files)} attachments!\nMessage ID: {result['id']}\nFiles: {files_info}\nTotal Size: {format_file_size(str(total_size))}"
-        
-    except Exception as e:
-        return f"Error sending email with attachments: {str(e)}"
-# ==================== GOOGLE CALENDAR TOOLS ====================
-
-@mcp.tool()
-def calendar_list_events(timeMin: str, timeMax: str, maxResults: int = 10) -> str:
-    """List upcoming calendar events within a time range
-    
-    Args:
-        timeMin: RFC3339 timestamp for start of range (e.g., '2024-01-01T00:00:00Z')
-        timeMax: RFC3339 timestamp for end of range (e.g., '2024-01-31T23:59:59Z') 
-        maxResults: Maximum number of events to return (default: 10)
-    """
-    try:
-        events_result = calendar_service.events().list(
-            calendarId="primary",
-            timeMin=timeMin,
-            timeMax=timeMax,
-            maxResults=maxResults,
-            singleEvents=True,
-            orderBy="startTime"
-        ).execute()
-
-        events = events_result.get('items', [])
-
-        if not events:
-            return "No upcoming events found."
-
-        event_list = []
-        for event in events:
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            location = event.get('location', 'No location')
-            description = event.get('description', 'No description')
-            event_id = event.get('id', 'No ID')
-            
-            event_info = f"ID: {event_id}\nTitle: {event['summary']}\nTime: {start}\nLocation: {location}\nDescription: {description[:100]}{'...' if len(description) > 100 else ''}"
-            event_list.append(event_info)
-
-        return f"Found {len(events)} events:\n\n" + "\n\n---\n\n".join(event_list)
-
-    except Exception as e:
-        return f"Error listing events: {str(e)}"
-
-@mcp.tool()
-def calendar_create_event_with_invitations(
-    summary: str,
-    startTime: str, 
-    endTime: str,
-    attendees: Optional[List[str]] = None,
-    location: Optional[str] = None,
-    description: Optional[str] = None,
-    send_invitations: bool = True
-) -> str:
-    """
-    Create a calendar event and automatically send invitations to attendees.
-    
-    Args:
-        summary: Event title
-        startTime: RFC3339 start time (e.g., '2024-01-15T10:00:00Z')
-        endTime: RFC3339 end time (e.g., '2024-01-15T11:00:00Z')
-        attendees: List of attendee emails
-        location: Event location (optional)
-        description: Event description (optional)
-        send_invitations: Whether to send email invitations (default: True)
-    """
-    try:
-        # Prepare event data
-        event_data = {
-            'summary': summary,
-            'start': {
-                'dateTime': startTime,
-                'timeZone': 'UTC',
-            },
-            'end': {
-                'dateTime': endTime,
-                'timeZone': 'UTC',
-            },
-        }
-        
-        # Add optional fields
-        if location:
-            event_data['location'] = location
-        if description:
-            event_data['description'] = description
-            
-        # Add attendees if provided
-        if attendees:
-            event_data['attendees'] = [{'email': email} for email in attendees]
-        
-        # Create the calendar event
-        event = calendar_service.events().insert(
-            calendarId='primary', 
-            body=event_data,
-            sendUpdates='all' if send_invitations and attendees else 'none'
-        ).execute()
-        
-        event_id = event['id']
-        event_link = event.get('htmlLink', '')
-        
-        response = f"Calendar event created successfully!\n"
-        response += f"Event ID: {event_id}\n"
-        response += f"Title: {summary}\n"
-        response += f"Start: {startTime}\n"
-        response += f"End: {endTime}\n"
-        
-        if location:
-            response += f"Location: {location}\n"
-        if description:
-            response += f"Description: {description}\n"
-        if event_link:
-            response += f"Event Link: {event_link}\n"
-            
-        # If attendees were added and invitations should be sent
-        if attendees and send_invitations:
-            response += f"\nInvitations sent to {len(attendees)} attendees:\n"
-            for email in attendees:
-                response += f"- {email}\n"
-                
-            response += f"\nNote: Calendar invitations have been automatically sent via Google Calendar."
-        elif attendees and not send_invitations:
-            response += f"\nAttendees added (no invitations sent):\n"
-            for email in attendees:
-                response += f"- {email}\n"
-        
-        return response
-        
-    except Exception as e:
-        return f"Error creating calendar event: {str(e)}"
-
-@mcp.tool()
-def calendar_get_availability(timeMin: str, timeMax: str) -> str:
-    """Get free/busy information for primary calendar
-    
-    Args:
-        timeMin: RFC3339 timestamp for start of range
-        timeMax: RFC3339 timestamp for end of range
-    """
-    try:
-        body = {
-            "timeMin": timeMin,
-            "timeMax": timeMax,
-            "items": [{"id": "primary"}]
-        }
-
-        busy_info = calendar_service.freebusy().query(body=body).execute()
-        busy_times = busy_info.get("calendars", {}).get("primary", {}).get("busy", [])
-
-        if not busy_times:
-            return f"No busy times found between {timeMin} and {timeMax}\nYou appear to be free during this entire period!"
-        else:
-            busy_list = []
-            for busy_period in busy_times:
-                start = busy_period.get("start")
-                end = busy_period.get("end")
-                busy_list.append(f"- Busy from {start} to {end}")
-
-            return f"Busy periods between {timeMin} and {timeMax}:\n\n" + "\n".join(busy_list)
-
-    except Exception as e:
-        return f"Error getting availability: {str(e)}"
-
-@mcp.tool()
-def calendar_update_event(event_id: str, 
-                         summary: Optional[str] = None,
-                         startTime: Optional[str] = None,
-                         endTime: Optional[str] = None,
-                         attendees: Optional[List[str]] = None,
-                         location: Optional[str] = None,
-                         description: Optional[str] = None) -> str:
-    """Update an existing calendar event
-    
-    Args:
-        event_id: ID of the event to update
-        summary: New event title (optional)
-        startTime: New RFC3339 start time (optional)
-        endTime: New RFC3339 end time (optional)
-        attendees: New list of attendee emails (optional)
-        location: New event location (optional)
-        description: New event description (optional)
-    """
-    try:
-        # Get the existing event
-        existing_event = calendar_service.events().get(
-            calendarId="primary",
-            eventId=event_id
-        ).execute()
-
-        # Update only the fields that were provided
-        if summary is not None:
-            existing_event["summary"] = summary
-        if startTime is not None:
-            existing_event["start"]["dateTime"] = startTime
-        if endTime is not None:
-            existing_event["end"]["dateTime"] = endTime
-        if attendees is not None:
-            existing_event["attendees"] = [{"email": email} for email in attendees]
-        if location is not None:
-            existing_event["location"] = location
-        if description is not None:
-            existing_event["description"] = description
-
-        # Update the event
-        updated_event = calendar_service.events().update(
-            calendarId="primary",
-            eventId=event_id,
-            body=existing_event,
-            sendUpdates="all"
-        ).execute()
-
-        return f"Event updated successfully!\n\nUpdated Details:\n- Title: {updated_event.get('summary')}\n- Event ID: {event_id}\n- Link: {updated_event.get('htmlLink')}"
-
-    except Exception as e:
-        return f"Error updating event: {str(e)}"
-
-@mcp.tool()
-def calendar_delete_event(event_id: str) -> str:
-    """Delete a calendar event
-    
-    Args:
-        event_id: ID of the event to delete
-    """
-    try:
-        calendar_service.events().delete(
-            calendarId="primary",
-            eventId=event_id,
-            sendUpdates="all"
-        ).execute()
-
-        return f"Event with ID '{event_id}' has been deleted successfully!"
-
-    except Exception as e:
-        return f"Error deleting event: {str(e)}"
-
-def initialize_services():
-    """Initialize all Google services."""
-    global drive_service, gmail_service, calendar_service, docs_service
-    
-    creds = load_credentials()
-    if not creds:
-        print("Warning: No credentials available. Services will not be initialized.",file=sys.stderr)
-        return
-    
-    try:
-        # Initialize Google Drive service
-        drive_service = build('drive', 'v3', credentials=creds)
-        print("✅ Google Drive service initialized",file=sys.stderr)
-        
-        # Initialize Gmail service
-        gmail_service = build('gmail', 'v1', credentials=creds)
-        profile = gmail_service.users().getProfile(userId='me').execute()
-        print(f"✅ Gmail service initialized: {profile['emailAddress']}",file=sys.stderr)
-        
-        # Initialize Calendar service
-        calendar_service = build('calendar', 'v3', credentials=creds)
-        calendar_list = calendar_service.calendarList().list().execute()
-        primary_calendar = next((cal for cal in calendar_list.get('items', []) if cal.get('primary')), None)
-        if primary_calendar:
-            print(f"✅ Google Calendar service initialized: {primary_calendar.get('summary', 'Primary Calendar')}",file=sys.stderr)
-        
-        # Initialize Docs service
-        docs_service = build('docs', 'v1', credentials=creds)
-        print("✅ Google Docs service initialized",file=sys.stderr)
-
-        if not PDF_SUPPORT:
-            print("⚠️ PDF libraries not installed. PDF creation/editing will be limited.", file=sys.stderr)
-        
-        print("\n🚀 Server ready with Google Drive, Gmail, Calendar, and Docs integration",file=sys.stderr)
-
-    except HttpError as e:
-        print(f"❌ A Google API error occurred during initialization: {e}",file=sys.stderr)
-        # Depending on severity, you might want to exit or handle this
-    except Exception as e:
-        print(f"❌ An unexpected error occurred during initialization: {e}",file=sys.stderr)
-
-if __name__ == "__main__":
-    initialize_services()
-    print("MCP Toolkit started. Waiting for initialization command...", file=sys.stderr)
-    mcp.run(transport="stdio")
+import argparse
+import asyncio
+import json
+import os
+import sys
+import base64
+import io
+import re
+import mimetypes # <--- ADDED
+import pstats
+import queue
+import atexit
+import bisect
+import contextvars
+import difflib
+import cProfile
+import fnmatch
+import functools
+import hashlib
+import inspect
+import random
+import shutil
+import socket
+import sqlite3
+import string
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+import weakref
+import zlib
+from contextlib import asynccontextmanager, contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from html import unescape
+from googleapiclient.errors import HttpError
+# Email handling imports
+from email.mime.multipart import MIMEMultipart # <--- ADDED
+from email.mime.text import MIMEText
+from email.mime.base import MIMEBase # <--- ADDED
+from email import encoders # <--- ADDED
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials 
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, MediaIoBaseDownload, MediaIoBaseUpload, MediaFileUpload, build_http # <--- MODIFIED
+
+# PDF text extraction and creation
+try:
+    import PyPDF2
+    from reportlab.pdfbase import pdfmetrics
+    PDF_SUPPORT = True
+except ImportError:
+    PDF_SUPPORT = False
+
+import anyio
+import anyio.lowlevel
+import anyio.to_thread
+from pydantic import TypeAdapter
+from mcp.server.fastmcp import FastMCP
+from mcp.server.lowlevel.server import request_ctx
+from mcp.shared.message import SessionMessage
+from mcp.types import CallToolResult, JSONRPCMessage, ToolAnnotations
+
+# Combined OAuth scopes for both Drive and Gmail
+SCOPES = [
+    'https://www.googleapis.com/auth/drive',
+    'https://www.googleapis.com/auth/gmail.readonly',
+    'https://www.googleapis.com/auth/gmail.send',
+    'https://www.googleapis.com/auth/gmail.labels',
+    'https://www.googleapis.com/auth/gmail.modify',
+    "https://www.googleapis.com/auth/calendar.events",
+    "https://www.googleapis.com/auth/calendar.readonly",
+    'https://www.googleapis.com/auth/documents'
+]
+
+# Global service instances
+drive_service = None
+gmail_service = None
+calendar_service = None
+docs_service = None 
+credentials = None
+
+# ==================== INSTRUMENTATION ====================
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram in seconds (Prometheus bucket bounds)."""
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile."""
+        target, running = q * self.count, 0
+        for bound, n in zip(LATENCY_BUCKETS + (float('inf'),), self.counts):
+            running += n
+            if running and running >= target:
+                return bound
+        return 0.0
+
+class ToolkitMetrics:
+    """Process-wide counters for MCP tool calls and the Google API requests they make."""
+
+    TOOL_FIELDS = ('calls', 'errors', 'response_chars', 'coalesced', 'cache_hits', 'timeouts', 'cancelled')
+    API_FIELDS = ('calls', 'errors', 'retries', 'bytes_sent', 'bytes_received')
+    TRANSPORT_FIELDS = ('frames', 'bytes')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.tools = {}
+        self.api = {}
+        self.transport = {}
+
+    def _entry(self, table: dict, name: str, fields) -> dict:
+        entry = table.get(name)
+        if entry is None:
+            entry = table[name] = dict.fromkeys(fields, 0)
+            entry['latency'] = LatencyHistogram()
+        return entry
+
+    def observe_tool(self, name: str, seconds: float, error: bool, response_chars: int):
+        with self.lock:
+            entry = self._entry(self.tools, name, self.TOOL_FIELDS)
+            entry['calls'] += 1
+            entry['errors'] += error
+            entry['response_chars'] += response_chars
+            entry['latency'].observe(seconds)
+
+    def count_tool(self, name: str, **increments):
+        with self.lock:
+            entry = self._entry(self.tools, name, self.TOOL_FIELDS)
+            for field, value in increments.items():
+                entry[field] += value
+
+    def observe_api(self, method: str, seconds: float, error: bool):
+        with self.lock:
+            entry = self._entry(self.api, method, self.API_FIELDS)
+            entry['calls'] += 1
+            entry['errors'] += error
+            entry['latency'].observe(seconds)
+
+    def count_api(self, method: str, **increments):
+        with self.lock:
+            entry = self._entry(self.api, method, self.API_FIELDS)
+            for field, value in increments.items():
+                entry[field] += value
+
+    def observe_transport(self, stage: str, seconds: float, nbytes: int):
+        """Time spent encoding, decoding or writing protocol frames (not part of any tool's latency)."""
+        with self.lock:
+            entry = self._entry(self.transport, stage, self.TRANSPORT_FIELDS)
+            entry['frames'] += 1
+            entry['bytes'] += nbytes
+            entry['latency'].observe(seconds)
+
+    def snapshot(self) -> dict:
+        """Plain-dict view with p50/p95/p99 estimated from the histogram buckets."""
+        def view(table):
+            result = {}
+            for name, entry in sorted(table.items()):
+                latency = entry['latency']
+                result[name] = {k: v for k, v in entry.items() if k != 'latency'}
+                result[name].update({
+                    'latency_ms_avg': round(latency.total / latency.count * 1000, 2) if latency.count else 0.0,
+                    'latency_ms_p50': latency.quantile(0.5) * 1000,
+                    'latency_ms_p95': latency.quantile(0.95) * 1000,
+                    'latency_ms_p99': latency.quantile(0.99) * 1000,
+                })
+            return result
+
+        with self.lock:
+            return {'uptime_seconds': round(time.time() - self.started, 1),
+                    'tools': view(self.tools), 'google_api': view(self.api),
+                    'transport': view(self.transport)}
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+
+        def emit(table, prefix, label, fields):
+            for field in fields:
+                metric = f"{prefix}_{field}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.extend(f'{metric}{{{label}="{name}"}} {entry[field]}' for name, entry in sorted(table.items()))
+            metric = f"{prefix}_duration_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for name, entry in sorted(table.items()):
+                latency, running = entry['latency'], 0
+                for bound, n in zip(LATENCY_BUCKETS + (float('inf'),), latency.counts):
+                    running += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="{le}"}} {running}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {latency.total:.6f}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {latency.count}')
+
+        with self.lock:
+            emit(self.tools, 'mcp_tool', 'tool', self.TOOL_FIELDS)
+            emit(self.api, 'mcp_google_api', 'method', self.API_FIELDS)
+            emit(self.transport, 'mcp_transport', 'stage', self.TRANSPORT_FIELDS)
+        return "\n".join(lines) + "\n"
+
+metrics = ToolkitMetrics()
+
+class ErrorResult(str):
+    """Message a tool returns when it failed.
+
+    The client gets it as a result with isError set; it is counted as an error in
+    metrics and traces, never cached, and fails the toolkit_batch step that got it.
+    """
+
+def is_error_result(result) -> bool:
+    return isinstance(result, ErrorResult)
+
+def tool_result_text(result) -> str:
+    """Concatenated text of a FastMCP call_tool result."""
+    content = result[0] if isinstance(result, tuple) else result
+    if not isinstance(content, (list, tuple)):
+        return ""
+    return "".join(getattr(block, 'text', None) or "" for block in content)
+
+# ==================== TRACING ====================
+
+# Sampled tool calls are exported as OTLP/JSON, appended to a file or POSTed to a collector URL
+TRACE_EXPORT = os.getenv("MCP_TRACE_EXPORT")
+TRACE_SAMPLE_RATE = float(os.getenv("MCP_TRACE_SAMPLE_RATE", "1.0")) if TRACE_EXPORT else 0.0
+
+_current_span = contextvars.ContextVar('mcp_toolkit_span', default=None)
+
+class Span:
+    """One timed operation; every span of a sampled tool call is collected on the root's trace list."""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'trace', 'attributes', 'error', 'start_ns', 'end_ns')
+
+    def __init__(self, name: str, parent: Optional['Span'], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.trace = parent.trace if parent else []
+        self.attributes = attributes
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+
+    def to_otlp(self) -> dict:
+        span = {
+            'traceId': self.trace_id, 'spanId': self.span_id, 'name': self.name,
+            'kind': 2 if self.parent_id is None else 1,
+            'startTimeUnixNano': str(self.start_ns), 'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': k, 'value': otlp_value(v)} for k, v in self.attributes.items()],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+def otlp_value(value) -> dict:
+    """Encode an attribute value as an OTLP AnyValue."""
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+@contextmanager
+def trace_span(name: str, root: bool = False, **attributes):
+    """Time the enclosed block as a child of the current span.
+
+    With root=True a new trace is started (subject to MCP_TRACE_SAMPLE_RATE) when
+    there is no current span. Outside a sampled trace this is a no-op yielding None.
+    """
+    parent = _current_span.get()
+    if parent is None and not (root and random.random() < TRACE_SAMPLE_RATE):
+        yield None
+        return
+    if parent is None:
+        # Recorded now: the exporter thread that ships the trace doesn't know whose call it was
+        attributes.setdefault('mcp.user', current_user_id())
+    span = Span(name, parent, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"[:500]
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end_ns = time.time_ns()
+        span.trace.append(span)
+        if parent is None:
+            trace_exporter.export(span.trace)
+
+def traced(func):
+    """Record calls to a CPU-heavy helper as a stage span of the current trace."""
+    name = f"stage {func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _current_span.get() is None:
+            return func(*args, **kwargs)
+        with trace_span(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+class TraceExporter:
+    """Ships finished traces from a background thread in OTLP/JSON batches.
+
+    A target starting with http:// or https:// is POSTed to (an OTLP collector's
+    /v1/traces); anything else is a file that gets one JSON document per line.
+    """
+
+    def __init__(self, target: Optional[str], batch_size: int = 64, max_queue: int = 10000):
+        self.target = target
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def export(self, spans: List[Span]):
+        if not self.target:
+            return
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self.thread.start()
+                    atexit.register(self.flush)
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, block: bool) -> List[Span]:
+        spans = []
+        try:
+            spans.extend(self.queue.get(timeout=1.0) if block else self.queue.get_nowait())
+            while len(spans) < self.batch_size * 8:
+                spans.extend(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return spans
+
+    def _run(self):
+        while True:
+            spans = self._drain(block=True)
+            if spans:
+                self._write(spans)
+
+    def flush(self):
+        while True:
+            spans = self._drain(block=False)
+            if not spans:
+                return
+            self._write(spans)
+
+    def _write(self, spans: List[Span]):
+        payload = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name', 'value': {'stringValue': 'mcp-toolkit'}},
+            ]},
+            'scopeSpans': [{'scope': {'name': 'mcp_toolkit'}, 'spans': [span.to_otlp() for span in spans]}],
+        }]})
+        try:
+            if self.target.startswith(('http://', 'https://')):
+                request = urllib.request.Request(self.target, data=payload.encode('utf-8'),
+                                                 headers={'Content-Type': 'application/json'})
+                urllib.request.urlopen(request, timeout=5).close()
+            else:
+                with open(self.target, 'a', encoding='utf-8') as f:
+                    f.write(payload + "\n")
+        except Exception as e:
+            print(f"Trace export to {self.target} failed: {e}", file=sys.stderr)
+
+trace_exporter = TraceExporter(TRACE_EXPORT)
+
+# ==================== PROFILING ====================
+
+# Profile every call of matching tools: MCP_PROFILE_TOOLS="drive_read,gmail_*" with MCP_PROFILE_MODE=cpu|memory|both.
+# A single tools/call can opt in instead with "_meta": {"profile": "cpu" | "memory" | "both"}.
+PROFILE_TOOLS = [pattern.strip() for pattern in os.getenv("MCP_PROFILE_TOOLS", "").split(",") if pattern.strip()]
+PROFILE_MODE = os.getenv("MCP_PROFILE_MODE", "cpu")
+PROFILE_MODES = ("cpu", "memory", "both")
+
+_profile_lock = threading.Lock()
+
+def profile_mode_for(name: str, meta) -> Optional[str]:
+    """Profiling mode requested for this call by its _meta or by MCP_PROFILE_TOOLS, if any."""
+    requested = getattr(meta, 'profile', None) if meta is not None else None
+    if requested:
+        mode = "both" if requested is True else str(requested).lower()
+        return mode if mode in PROFILE_MODES else None
+    if PROFILE_TOOLS and any(fnmatch.fnmatchcase(name, pattern) for pattern in PROFILE_TOOLS):
+        return PROFILE_MODE if PROFILE_MODE in PROFILE_MODES else "cpu"
+    return None
+
+@contextmanager
+def profile_tool_call(name: str, mode: Optional[str], request_id=None):
+    """Run the enclosed tool call under cProfile and/or tracemalloc and write a report.
+
+    Yields the report path (set once the block finishes) in a one-element list.
+    """
+    report = [None]
+    if mode is None:
+        yield report
+        return
+    # One profiler per thread and a process-wide tracemalloc: profile one call at a time
+    if not _profile_lock.acquire(blocking=False):
+        print(f"Profiling of {name} skipped: another profiled call is running", file=sys.stderr)
+        yield report
+        return
+    profiler = cProfile.Profile() if mode in ("cpu", "both") else None
+    trace_memory = mode in ("memory", "both")
+    stop_tracing = trace_memory and not tracemalloc.is_tracing()
+    try:
+        if stop_tracing:
+            tracemalloc.start(25)
+        if trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+        started = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield report
+        finally:
+            if profiler:
+                profiler.disable()
+            elapsed = time.perf_counter() - started
+            memory = None
+            if trace_memory:
+                memory = (before, tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1])
+            try:
+                report[0] = write_profile_report(name, request_id, elapsed, profiler, memory)
+                print(f"📊 Profile of {name} written to {report[0]}", file=sys.stderr)
+            except Exception as e:
+                print(f"Failed to write profile for {name}: {e}", file=sys.stderr)
+    finally:
+        if stop_tracing:
+            tracemalloc.stop()
+        _profile_lock.release()
+
+def write_profile_report(name: str, request_id, elapsed: float, profiler, memory) -> str:
+    """Write <dir>/<time>-<tool>-<request id>.txt (plus .prof for CPU profiles); return the .txt path."""
+    directory = os.getenv("MCP_PROFILE_DIR") or get_state_dir("profiles", user_state_name(current_user_id()))
+    os.makedirs(directory, exist_ok=True)
+    # The request id comes from the client, so only word characters and dashes reach the file name
+    safe_id = re.sub(r'[^\w-]', '_', str(request_id))[:64]
+    base = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{safe_id}")
+    lines = [f"Tool: {name}", f"Request id: {request_id}", f"User: {current_user_id()}",
+             f"Wall time: {elapsed * 1000:.1f} ms", ""]
+    if profiler:
+        profiler.dump_stats(base + ".prof")
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+        lines += [f"CPU profile (full data in {base}.prof), top 40 by cumulative time:", out.getvalue()]
+    if memory:
+        before, after, peak = memory
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        growth = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')
+        lines.append(f"Memory: {peak / 1024 / 1024:.2f} MB peak traced during the call "
+                     "(process-wide, so concurrent calls are included). Top 25 allocation sites by net growth:")
+        lines += [f"  {stat}" for stat in growth[:25]]
+    with open(base + ".txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return base + ".txt"
+
+# ==================== TOOL EXECUTION ====================
+
+# Sync tools run on this pool so a slow call no longer blocks the event loop and every other request
+TOOL_WORKERS = int(os.getenv("MCP_TOOL_WORKERS", "8"))
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="mcp-tool")
+
+# Tools that only read Google data: advertised with readOnlyHint, and identical
+# concurrent calls share a single execution
+READ_ONLY_TOOLS = frozenset({
+    'drive_search', 'drive_read', 'drive_list_folder_contents', 'drive_list_all_files',
+    'gmail_list_messages', 'gmail_read_message', 'gmail_read_attachments', 'gmail_search_and_summarize',
+    'gmail_list_labels', 'calendar_sync', 'calendar_list_events', 'calendar_get_availability',
+    'calendar_find_meeting_slots', 'job_status', 'job_results', 'job_list', 'docs_outline', 'docs_read_section',
+})
+
+# Default per-call deadline in seconds (0 = none); a tools/call can set its own with "_meta": {"timeoutMs": N}
+TOOL_TIMEOUT = float(os.getenv("MCP_TOOL_TIMEOUT", "0"))
+
+_tool_call = contextvars.ContextVar('mcp_toolkit_tool_call', default=None)
+_cancel_event = contextvars.ContextVar('mcp_toolkit_cancel_event', default=None)
+_inflight = {}
+
+class ToolCall:
+    """State of one tools/call request, visible to the worker thread that runs it."""
+
+    __slots__ = ('name', 'request_id', 'profile_mode', 'deadline', 'progress_token', 'session', 'loop',
+                 'progress_value', 'progress_sent')
+
+    def __init__(self, name: str, request_id=None, profile_mode: Optional[str] = None, meta=None, session=None):
+        self.name = name
+        self.request_id = request_id
+        self.profile_mode = profile_mode
+        timeout_ms = getattr(meta, 'timeoutMs', None) if meta is not None else None
+        timeout = float(timeout_ms) / 1000 if timeout_ms else TOOL_TIMEOUT
+        self.deadline = time.monotonic() + timeout if timeout > 0 else None
+        self.progress_token = getattr(meta, 'progressToken', None) if meta is not None else None
+        self.session = session
+        self.loop = asyncio.get_running_loop() if self.progress_token is not None else None
+        self.progress_value = None
+        self.progress_sent = 0.0
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+# Minimum seconds between progress notifications of one call (the final one is always sent)
+PROGRESS_INTERVAL = float(os.getenv("MCP_PROGRESS_INTERVAL", "0.25"))
+_progress_lock = threading.Lock()
+
+def report_progress(progress: float, total: Optional[float] = None, message: Optional[str] = None):
+    """Send a throttled MCP progress notification for the running tool call.
+
+    A no-op unless the caller sent a progressToken; safe to call from worker threads.
+    Values that do not increase are dropped, as the protocol requires.
+    """
+    call = _tool_call.get()
+    if call is None or call.progress_token is None:
+        return
+    now = time.monotonic()
+    with _progress_lock:
+        if call.progress_value is not None and progress <= call.progress_value:
+            return
+        final = total is not None and progress >= total
+        if not final and now - call.progress_sent < PROGRESS_INTERVAL:
+            return
+        call.progress_value, call.progress_sent = progress, now
+    try:
+        asyncio.run_coroutine_threadsafe(call.session.send_progress_notification(
+            call.progress_token, progress, total, message, related_request_id=call.request_id), call.loop)
+    except RuntimeError:
+        pass  # event loop already closed
+
+class ToolCancelled(BaseException):
+    """Raised inside a running tool once no request is waiting for its result anymore.
+
+    A BaseException, like KeyboardInterrupt, so the tools' `except Exception` blocks
+    don't turn it into an ordinary error result.
+    """
+
+def check_cancelled():
+    """Stop the current tool if its caller cancelled or its deadline passed (call at loop/chunk boundaries)."""
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise ToolCancelled("Tool call was cancelled or exceeded its deadline")
+
+def cancellable_sleep(seconds: float):
+    """time.sleep that wakes up and raises ToolCancelled as soon as the call is cancelled."""
+    event = _cancel_event.get()
+    if event is None:
+        time.sleep(seconds)
+    elif event.wait(seconds):
+        check_cancelled()
+
+class ToolExecution:
+    """One run of a tool function on the worker pool, shared by every request coalesced onto it.
+
+    Each waiting request holds a reference; when the last one goes away (cancelled,
+    or its deadline passed) before the run finishes, the run is told to stop.
+    """
+
+    __slots__ = ('name', 'future', 'waiters', 'cancelled')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.future = None
+        self.waiters = 0
+        self.cancelled = threading.Event()
+
+    def start(self, loop, fn, *args):
+        context = contextvars.copy_context()
+        context.run(_cancel_event.set, self.cancelled)
+        self.future = loop.run_in_executor(tool_executor, context.run, fn, *args)
+
+    async def wait(self):
+        """Await the shared result within the calling request's own deadline."""
+        call = _tool_call.get()
+        self.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.future), call.remaining() if call else None)
+        except asyncio.TimeoutError:
+            metrics.count_tool(self.name, timeouts=1)
+            return ErrorResult(f"Error: {self.name} did not finish before its deadline and was stopped")
+        finally:
+            self.waiters -= 1
+            if self.waiters <= 0 and not self.future.done() and not self.cancelled.is_set():
+                self.cancelled.set()
+                metrics.count_tool(self.name, cancelled=1)
+
+def coalesce_key(name: str, kwargs: Dict[str, Any]) -> tuple:
+    """Single-flight identity of a call: user, tool and normalized arguments."""
+    return (current_user_id(), name, json.dumps(kwargs, sort_keys=True, default=str))
+
+# ==================== RESULT CACHE ====================
+
+# Seconds a successful result of these read-only tools (and the gdrive:/// resource) is reused.
+# Override with MCP_RESULT_CACHE_TTLS="drive_read=60,gmail_list_labels=0"; 0 disables caching a tool.
+RESULT_CACHE_TTLS = {
+    'drive_read': 300, 'read_file': 300, 'drive_get_shareable_link': 600,
+    'drive_search': 60, 'drive_list_all_files': 120, 'drive_list_folder_contents': 120,
+    'gmail_read_message': 600, 'gmail_read_attachments': 600, 'gmail_list_labels': 600,
+    'gmail_list_messages': 30, 'gmail_search_and_summarize': 60,
+    'calendar_list_events': 60, 'calendar_get_availability': 60, 'calendar_find_meeting_slots': 60,
+}
+for _item in os.getenv("MCP_RESULT_CACHE_TTLS", "").split(","):
+    if "=" in _item:
+        _tool, _ttl = _item.split("=", 1)
+        RESULT_CACHE_TTLS[_tool.strip()] = float(_ttl)
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("MCP_RESULT_CACHE_MAX_ENTRIES", "512"))
+
+# Tags every cached result of a tool carries, besides the ones derived from its arguments
+# and the Drive files / Gmail messages its API responses contained
+CACHE_TOOL_TAGS = {
+    'drive_search': ('drive:global',), 'drive_list_all_files': ('drive:global',),
+    'gmail_list_messages': ('gmail:listing',), 'gmail_search_and_summarize': ('gmail:listing',),
+    'gmail_list_labels': ('gmail:labels',),
+    'calendar_list_events': ('calendar',), 'calendar_get_availability': ('calendar',),
+    'calendar_find_meeting_slots': ('calendar',),
+}
+CACHE_ARG_TAGS = {'fileId': 'file', 'file_id': 'file', 'folder_id': 'folder', 'message_id': 'msg'}
+
+_observed_tags = contextvars.ContextVar('mcp_toolkit_observed_tags', default=None)
+
+class ResultCache:
+    """LRU of tool results keyed by (user, tool, arguments), with TTLs and tag invalidation."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.by_tag = {}
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[1]
+
+    def generation(self, user: str) -> int:
+        """Counter of the user's invalidations; put() compares it to detect one during a call."""
+        return self.generations.get(user, 0)
+
+    def put(self, key: tuple, value, ttl: float, tags: set, generation: int):
+        """Store value unless the user's entries were invalidated since the call producing it started."""
+        user = key[0]
+        with self.lock:
+            if generation != self.generations.get(user, 0) or self.max_entries <= 0:
+                return
+            self._remove(key)
+            self.entries[key] = (time.monotonic() + ttl, value, tags)
+            for tag in tags:
+                self.by_tag.setdefault((user, tag), set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, user: str, tags: Optional[set]) -> int:
+        """Evict the user's entries carrying any of tags; tags=None evicts all of the user's entries."""
+        with self.lock:
+            self.generations[user] = self.generations.get(user, 0) + 1
+            if tags is None:
+                keys = [key for key in self.entries if key[0] == user]
+            else:
+                keys = set()
+                for tag in tags:
+                    keys.update(self.by_tag.get((user, tag), ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def _remove(self, key: tuple):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            for tag in entry[2]:
+                keys = self.by_tag.get((key[0], tag))
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.by_tag[(key[0], tag)]
+
+result_cache = ResultCache(RESULT_CACHE_MAX_ENTRIES)
+
+def result_cache_ttl(name: str, kwargs: Dict[str, Any]) -> float:
+    """Seconds this call's result may be cached (0 = not cacheable)."""
+    if name == 'drive_get_shareable_link' and kwargs.get('make_public'):
+        return 0
+    return RESULT_CACHE_TTLS.get(name, 0)
+
+def argument_cache_tags(kwargs: Dict[str, Any]) -> set:
+    return {f"{CACHE_ARG_TAGS[arg]}:{value}" for arg, value in kwargs.items() if arg in CACHE_ARG_TAGS and value}
+
+def invalidation_tags(name: str, kwargs: Dict[str, Any]) -> Optional[set]:
+    """Cache tags a mutating tool call makes stale; None means everything cached for the user."""
+    if name in ('drive_edit', 'drive_delete', 'drive_move', 'drive_share_file', 'drive_get_shareable_link'):
+        tags = {f"file:{kwargs.get('fileId')}", 'drive:global'}
+        if kwargs.get('targetFolderId'):
+            # A folder is also a file listed in its parent, so both tags go
+            tags |= {f"folder:{kwargs['targetFolderId']}", f"file:{kwargs['targetFolderId']}"}
+        return tags
+    if name in ('drive_create', 'drive_create_folder', 'drive_upload_file'):
+        folder = kwargs.get('folder_id') or kwargs.get('parent_folder_id') or 'root'
+        return {f"folder:{folder}", f"file:{folder}", 'drive:global'}
+    if name in ('gmail_modify_labels', 'gmail_delete_message'):
+        return {f"msg:{kwargs.get('message_id')}", 'gmail:listing', 'gmail:labels'}
+    if name.startswith('gmail_send') or name == 'gmail_mail_merge':
+        return {'gmail:listing', 'gmail:labels'}
+    if name.startswith('calendar_'):
+        return {'calendar'}
+    if name.startswith('job_'):
+        return set()  # jobs invalidate as they write
+    return None
+
+def observe_cache_tags(method: str, result):
+    """Tag the running cached call with the Drive files / Gmail messages an API response contained."""
+    tags = _observed_tags.get()
+    if tags is None or not isinstance(result, dict):
+        return
+    if method == 'drive.files.list':
+        tags.update(f"file:{item['id']}" for item in result.get('files', ()) if 'id' in item)
+    elif method in ('drive.files.get', 'gmail.users.messages.get') and 'id' in result:
+        tags.add(f"{'file' if method.startswith('drive') else 'msg'}:{result['id']}")
+
+def run_in_worker(fn, coalesce: bool):
+    """Wrap a sync tool or resource function in a coroutine that runs it on tool_executor.
+
+    Cacheable calls are answered from result_cache when possible. With coalesce=True
+    a call identical to one already in flight awaits that call's result instead of
+    running again. Calls of non-read-only tools invalidate the cache entries they affect.
+    """
+    name = fn.__name__
+
+    def invoke(kwargs, key, ttl):
+        call = _tool_call.get()
+        generation = result_cache.generation(key[0])
+        tags = set() if ttl else None
+        _observed_tags.set(tags)
+        try:
+            # The request may have gone away while this run sat in the pool's queue
+            check_cancelled()
+            with profile_tool_call(name, call.profile_mode if call else None,
+                                   call.request_id if call else None) as report:
+                result = fn(**kwargs)
+        except ToolCancelled:
+            result = None
+        finally:
+            # calendar_sync only reads Google, but rewrites the store the calendar tools answer from
+            if not ttl and (not coalesce or name == 'calendar_sync'):
+                result_cache.invalidate(key[0], invalidation_tags(name, kwargs))
+        if _cancel_event.get().is_set():
+            # Whatever a stopped run returned may be partial: never cached or handed to a waiter as a result
+            return ErrorResult(f"Error: {name} was cancelled before it finished")
+        span = _current_span.get()
+        if span is not None and report[0]:
+            span.attributes['mcp.profile_report'] = report[0]
+        if ttl and not is_error_result(result):
+            tags |= argument_cache_tags(kwargs) | set(CACHE_TOOL_TAGS.get(name, ()))
+            result_cache.put(key, result, ttl, tags, generation)
+        return result
+
+    @functools.wraps(fn)
+    async def wrapper(**kwargs):
+        loop = asyncio.get_running_loop()
+        key = coalesce_key(name, kwargs)
+        ttl = result_cache_ttl(name, kwargs)
+        if ttl:
+            hit, value = result_cache.get(key)
+            if hit:
+                metrics.count_tool(name, cache_hits=1)
+                return value
+        execution = _inflight.get(key) if coalesce else None
+        if execution is not None and not execution.cancelled.is_set():
+            metrics.count_tool(name, coalesced=1)
+        else:
+            execution = ToolExecution(name)
+            execution.start(loop, invoke, kwargs, key, ttl)
+            if coalesce:
+                _inflight[key] = execution
+                execution.future.add_done_callback(
+                    lambda done: _inflight.pop(key) if _inflight.get(key) is execution else None)
+        return await execution.wait()
+    return wrapper
+
+# ==================== STDIO TRANSPORT ====================
+
+# Frames are serialized straight to UTF-8 bytes by pydantic-core and written in batches
+STDIO_FRAMING = os.getenv("MCP_STDIO_FRAMING", "fast")
+STDIO_WRITE_BATCH = int(os.getenv("MCP_STDIO_WRITE_BATCH", str(256 * 1024)))
+
+_jsonrpc_adapter = TypeAdapter(JSONRPCMessage)
+
+def encode_jsonrpc_frame(message: JSONRPCMessage) -> bytes:
+    """One newline-delimited JSON-RPC frame, timed under the stdio.encode transport metric."""
+    started = time.perf_counter()
+    frame = _jsonrpc_adapter.dump_json(message, by_alias=True, exclude_none=True) + b"\n"
+    metrics.observe_transport('stdio.encode', time.perf_counter() - started, len(frame))
+    return frame
+
+def decode_jsonrpc_frame(line: bytes) -> JSONRPCMessage:
+    """Parse one frame read from stdin, timed under the stdio.decode transport metric."""
+    started = time.perf_counter()
+    message = JSONRPCMessage.model_validate_json(line)
+    metrics.observe_transport('stdio.decode', time.perf_counter() - started, len(line))
+    return message
+
+def write_frames(out, frames: List[bytes]):
+    """Write a batch of frames with one flush; large frames go to the fd without being copied."""
+    started = time.perf_counter()
+    out.writelines(frames)
+    out.flush()
+    metrics.observe_transport('stdio.write', time.perf_counter() - started, sum(map(len, frames)))
+
+@asynccontextmanager
+async def fast_stdio_server(stdin=None, stdout=None):
+    """stdio transport with the same streams as mcp.server.stdio.stdio_server.
+
+    Responses queued while a write is in progress are sent together with a single
+    flush. The write stream is unbuffered, so a client that stops reading blocks
+    the writer thread and, through it, every tool trying to respond.
+    """
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    read_stream_writer, read_stream = anyio.create_memory_object_stream(0)
+    write_stream, write_stream_reader = anyio.create_memory_object_stream(0)
+
+    async def stdin_reader():
+        try:
+            async with read_stream_writer:
+                async for line in anyio.wrap_file(stdin):
+                    if not line.strip():
+                        continue
+                    try:
+                        message = decode_jsonrpc_frame(line)
+                    except Exception as exc:
+                        await read_stream_writer.send(exc)
+                        continue
+                    await read_stream_writer.send(SessionMessage(message))
+        except anyio.ClosedResourceError:
+            await anyio.lowlevel.checkpoint()
+
+    async def stdout_writer():
+        try:
+            async with write_stream_reader:
+                async for session_message in write_stream_reader:
+                    frames = [encode_jsonrpc_frame(session_message.message)]
+                    size = len(frames[0])
+                    while size < STDIO_WRITE_BATCH:
+                        try:
+                            session_message = write_stream_reader.receive_nowait()
+                        except (anyio.WouldBlock, anyio.EndOfStream):
+                            break
+                        frames.append(encode_jsonrpc_frame(session_message.message))
+                        size += len(frames[-1])
+                    await anyio.to_thread.run_sync(write_frames, stdout, frames)
+        except anyio.ClosedResourceError:
+            await anyio.lowlevel.checkpoint()
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(stdin_reader)
+        tg.start_soon(stdout_writer)
+        yield read_stream, write_stream
+
+class ToolkitMCP(FastMCP):
+    """FastMCP server that runs sync tools off the event loop and records metrics,
+    a root trace span and optional profiles for every tool call."""
+
+    def tool(self, *args, **kwargs):
+        """Register a sync tool; the module keeps the plain function for direct calls."""
+        def register(fn):
+            if inspect.iscoroutinefunction(fn):
+                # Async tools (toolkit_batch) run on the event loop and do their own dispatching
+                super(ToolkitMCP, self).tool(*args, **kwargs)(fn)
+                return fn
+            options = dict(kwargs)
+            read_only = fn.__name__ in READ_ONLY_TOOLS
+            if read_only:
+                options.setdefault('annotations', ToolAnnotations(readOnlyHint=True))
+            super(ToolkitMCP, self).tool(*args, **options)(run_in_worker(fn, coalesce=read_only))
+            return fn
+        return register
+
+    async def call_tool_text(self, name: str, arguments: Dict[str, Any]) -> Any:
+        """Run a registered tool from inside the current tool call (no new root span or metrics)."""
+        return await self._tool_manager.call_tool(name, arguments)
+
+    def resource(self, uri: str, **kwargs):
+        """Register a sync resource; reads run on the worker pool and identical reads are coalesced."""
+        def register(fn):
+            super(ToolkitMCP, self).resource(uri, **kwargs)(run_in_worker(fn, coalesce=True))
+            return fn
+        return register
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any]):
+        started = time.perf_counter()
+        error, response_chars = True, 0
+        request = request_ctx.get(None)
+        request_id = request.request_id if request else None
+        meta = request.meta if request else None
+        user_token = await bind_user_services(request)
+        token = _tool_call.set(ToolCall(name, request_id, profile_mode_for(name, meta), meta,
+                                        request.session if request else None))
+        with trace_span(f"tool {name}", root=True, **{'mcp.tool': name}) as span:
+            if span is not None:
+                span.attributes['jsonrpc.request_id'] = str(request_id)
+            try:
+                # Converted here rather than by FastMCP so the tool's own return value can be checked
+                raw = await self._tool_manager.call_tool(name, arguments, context=self.get_context())
+                result = self._tool_manager.get_tool(name).fn_metadata.convert_result(raw)
+                text = tool_result_text(result)
+                error, response_chars = is_error_result(raw), len(text)
+                if error:
+                    if span is not None:
+                        span.error = text[:500]
+                    content, structured = result if isinstance(result, tuple) else (result, None)
+                    return CallToolResult(content=list(content), structuredContent=structured, isError=True)
+                return result
+            finally:
+                _tool_call.reset(token)
+                metrics.observe_tool(name, time.perf_counter() - started, error, response_chars)
+                _user_services.reset(user_token)
+
+    async def run_stdio_async(self):
+        if STDIO_FRAMING != "fast":
+            return await super().run_stdio_async()
+        async with fast_stdio_server() as (read_stream, write_stream):
+            await self._mcp_server.run(read_stream, write_stream,
+                                       self._mcp_server.create_initialization_options())
+
+    async def read_resource(self, uri):
+        user_token = await bind_user_services(request_ctx.get(None))
+        try:
+            return await super().read_resource(uri)
+        finally:
+            _user_services.reset(user_token)
+
+# Create FastMCP instance
+mcp = ToolkitMCP("Google Drive & Gmail MCP Server")
+
+# Local state (checkpoints, caches) lives here; override with MCP_TOOLKIT_STATE_DIR
+STATE_DIR = os.getenv("MCP_TOOLKIT_STATE_DIR", os.path.join(os.path.expanduser("~"), ".mcp_toolkit"))
+
+# Send all Google API traffic to a stand-in backend instead (load testing only)
+GOOGLE_API_ENDPOINT = os.getenv("GOOGLE_API_ENDPOINT")
+GOOGLE_API_HOST_RE = re.compile(r'^https://[a-z0-9.-]*googleapis\.com/')
+
+# ==================== SHARED HELPERS ====================
+
+_thread_local = threading.local()
+_sender_emails = {}
+
+# The user a network-transport request is served for (see USER SESSIONS)
+_user_services = contextvars.ContextVar('mcp_toolkit_user_services', default=None)
+
+def current_user_id() -> str:
+    """Return the id of the user the current call is served for."""
+    services = _user_services.get()
+    return services.user_id if services is not None else os.getenv("SESSION_USER_ID", "default")
+
+def current_credentials():
+    """Return the Google credentials of the user the current call is served for."""
+    services = _user_services.get()
+    return services.credentials if services is not None else credentials
+
+def get_state_dir(*parts: str) -> str:
+    """Return (and create) a directory under the toolkit state dir."""
+    path = os.path.join(STATE_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def user_state_name(user_id: str) -> str:
+    """File name for a user's state; user ids arrive in request headers, so they are never used as is."""
+    return hashlib.sha1(user_id.encode('utf-8')).hexdigest()[:16]
+
+def get_thread_http(creds):
+    """Get an http object authorized with creds and owned by the calling thread.
+
+    httplib2 connections are not thread-safe, so every worker thread gets its own
+    (one per user it serves; dropped with the user's credentials).
+    """
+    https = getattr(_thread_local, 'https', None)
+    if https is None:
+        https = _thread_local.https = weakref.WeakKeyDictionary()
+    http = https.get(creds)
+    if http is None:
+        http = AuthorizedHttp(creds, http=build_http())
+        if GOOGLE_API_ENDPOINT:
+            http = ApiEndpointOverride(http, GOOGLE_API_ENDPOINT)
+        http = https[creds] = MeteredHttp(http)
+    return http
+
+class ApiEndpointOverride:
+    """Wraps an http object and rewrites Google API URLs to GOOGLE_API_ENDPOINT.
+
+    Rewriting at the transport covers regular calls, media uploads/downloads and
+    batch requests alike, whose URLs googleapiclient builds in different places.
+    """
+
+    def __init__(self, http, endpoint: str):
+        self.http = http
+        self.endpoint = endpoint.rstrip('/') + '/'
+
+    def request(self, uri, *args, **kwargs):
+        return self.http.request(GOOGLE_API_HOST_RE.sub(self.endpoint, uri), *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+def api_key_from_uri(uri: str) -> str:
+    """Metrics key for raw http traffic made outside HttpRequest.execute (media downloads, batches)."""
+    path, _, query = uri.partition('://')[2].partition('/')[2].partition('?')
+    parts = path.split('/')
+    if parts[0] == 'upload' and len(parts) > 1:
+        return f"{parts[1]}.upload"
+    if parts[0] == 'batch':
+        return f"batch.{parts[1]}" if len(parts) > 1 and parts[1] else "batch"
+    if 'alt=media' in query or path.endswith('/export'):
+        return f"{parts[0]}.download"
+    return f"{parts[0]}.http"
+
+class MeteredHttp:
+    """Wraps an http object and counts bytes sent and received per API method."""
+
+    def __init__(self, http):
+        self.http = http
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        # Every API call and media chunk passes here, so abandoned calls stop between chunks
+        check_cancelled()
+        method_id = getattr(_thread_local, 'api_method', None)
+        if method_id is not None:
+            resp, content = self.http.request(uri, method=method, body=body, headers=headers, **kwargs)
+        else:
+            # Raw traffic (media downloads, batches) has no execute() around it to time it
+            method_id = api_key_from_uri(uri)
+            started = time.perf_counter()
+            with trace_span(f"google {method_id}", **{'http.method': method, 'url.path': urlsplit(uri).path}) as span:
+                resp, content = self.http.request(uri, method=method, body=body, headers=headers, **kwargs)
+                if span is not None:
+                    span.attributes['http.status_code'] = resp.status
+            metrics.observe_api(method_id, time.perf_counter() - started, resp.status >= 400)
+        # Resumable uploads pass the media stream itself; its size is in Content-Length
+        sent = len(body) if isinstance(body, (bytes, str)) else int((headers or {}).get('Content-Length', 0))
+        metrics.count_api(method_id, bytes_sent=sent, bytes_received=len(content or b''))
+        return resp, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+class ToolkitHttpRequest(HttpRequest):
+    """HttpRequest that runs on the calling thread's own http connection.
+
+    Passed as requestBuilder to build() so the global service objects can be
+    shared by worker threads (mail merge, chunked free/busy queries, ...).
+    Every execute() is timed and counted under its API method id.
+    """
+
+    def __init__(self, http, *args, **kwargs):
+        creds = current_credentials()
+        if creds is not None:
+            http = get_thread_http(creds)
+        super().__init__(http, *args, **kwargs)
+        self._sleep = self._retry_sleep
+
+    def next_chunk(self, http=None, num_retries=0):
+        status, body = super().next_chunk(http=http, num_retries=num_retries)
+        if status is not None:
+            report_progress(status.resumable_progress, status.total_size, "Uploading")
+        elif body is not None and self.resumable is not None and self.resumable.size():
+            report_progress(self.resumable.size(), self.resumable.size(), "Upload complete")
+        return status, body
+
+    def _retry_sleep(self, seconds: float):
+        metrics.count_api(self.methodId or 'unknown', retries=1)
+        cancellable_sleep(seconds)
+
+    def execute(self, http=None, num_retries=0):
+        method = self.methodId or 'unknown'
+        outer = getattr(_thread_local, 'api_method', None)
+        _thread_local.api_method = method
+        started = time.perf_counter()
+        error = True
+        try:
+            with trace_span(f"google {method}", **{'http.method': self.method, 'url.path': urlsplit(self.uri).path}) as span:
+                try:
+                    result = super().execute(http=http, num_retries=num_retries)
+                except HttpError as e:
+                    if span is not None:
+                        span.attributes['http.status_code'] = e.resp.status
+                    raise
+            observe_cache_tags(method, result)
+            error = False
+            return result
+        finally:
+            metrics.observe_api(method, time.perf_counter() - started, error)
+            _thread_local.api_method = outer
+
+class RateLimiter:
+    """Thread-safe token bucket limiting how many operations start per second."""
+
+    def __init__(self, rate_per_second: float, burst: int = 1):
+        self.rate = max(rate_per_second, 0.001)
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            cancellable_sleep(wait)
+
+# Media is transferred in chunks of this size so long transfers report progress and can be
+# cancelled between chunks (resumable uploads need a multiple of 256 KB)
+MEDIA_CHUNK_SIZE = 8 * 1024 * 1024
+
+def download_media(request, label: str, file_io=None):
+    """Download a media request chunk by chunk (into file_io, default a new BytesIO), reporting byte progress."""
+    if file_io is None:
+        file_io = io.BytesIO()
+    downloader = MediaIoBaseDownload(file_io, request, chunksize=MEDIA_CHUNK_SIZE)
+    done = False
+    while not done:
+        status, done = downloader.next_chunk()
+        report_progress(status.resumable_progress, status.total_size or None, f"Downloading {label}")
+    return file_io
+
+def get_sender_address() -> str:
+    """Return the authenticated user's email address, fetched once per user."""
+    user_id = current_user_id()
+    if user_id not in _sender_emails:
+        profile = gmail_service.users().getProfile(userId='me').execute()
+        _sender_emails[user_id] = profile['emailAddress']
+    return _sender_emails[user_id]
+
+def make_credentials(access_token: str, refresh_token: Optional[str], expires_at: Optional[str]) -> Credentials:
+    """Build OAuth credentials for this app's client from a user's tokens.
+
+    expires_at is the access token expiry in epoch milliseconds, as stored by the backend.
+    """
+    creds = Credentials(
+        token=access_token,
+        refresh_token=refresh_token,
+        token_uri="https://oauth2.googleapis.com/token",
+        client_id=os.getenv("GOOGLE_CLIENT_ID"),
+        client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
+        scopes=SCOPES
+    )
+
+    # Manually set expiration if available
+    if expires_at:
+        creds.expiry = datetime.utcfromtimestamp(int(expires_at) / 1000)
+    return creds
+
+def load_credentials():
+    """Load credentials from environment (from Supabase), not a file."""
+    access_token = os.getenv("GOOGLE_ACCESS_TOKEN")
+    refresh_token = os.getenv("GOOGLE_REFRESH_TOKEN")
+    expires_at = os.getenv("GOOGLE_TOKEN_EXPIRES_AT")
+    client_id = os.getenv("GOOGLE_CLIENT_ID")
+    client_secret = os.getenv("GOOGLE_CLIENT_SECRET")
+
+    if all([access_token, refresh_token, client_id, client_secret]):
+        print(access_token,file=sys.stderr) #debugging
+        print(refresh_token,file=sys.stderr)# debugging
+        print(expires_at,file=sys.stderr) #debugging
+        print(client_id,file=sys.stderr)
+        
+        print("got all required environment variables for Google OAuth",file=sys.stderr)
+
+    try:
+        creds = make_credentials(access_token, refresh_token, expires_at)
+
+        if creds and creds.expired and creds.refresh_token:
+            print("🔁 Refreshing token...",file=sys.stderr)
+            creds.refresh(Request())
+
+        return creds
+    except Exception as e:
+        print("❌ Error loading credentials:", e,file=sys.stderr)
+        return None
+
+# ==================== USER SESSIONS ====================
+
+# Under a network transport one process serves many users. Each request names its user
+# and Google tokens in these headers; the OAuth client id/secret come from the environment.
+USER_ID_HEADER = "x-session-user-id"
+ACCESS_TOKEN_HEADER = "x-google-access-token"
+REFRESH_TOKEN_HEADER = "x-google-refresh-token"
+EXPIRES_AT_HEADER = "x-google-token-expires-at"
+MAX_USER_SESSIONS = int(os.getenv("MCP_MAX_USER_SESSIONS", "256"))
+
+class UserServices:
+    """One user's credentials and the Google API clients built on them."""
+
+    def __init__(self, user_id: str, creds: Credentials):
+        self.user_id = user_id
+        self.credentials = creds
+        self.drive = build('drive', 'v3', credentials=creds, requestBuilder=ToolkitHttpRequest)
+        self.gmail = build('gmail', 'v1', credentials=creds, requestBuilder=ToolkitHttpRequest)
+        self.calendar = build('calendar', 'v3', credentials=creds, requestBuilder=ToolkitHttpRequest)
+        self.docs = build('docs', 'v1', credentials=creds, requestBuilder=ToolkitHttpRequest)
+
+class ServiceProxy:
+    """Stands in for a module-level service global under a network transport.
+
+    Attribute access goes to the current request's user's client, so the tools
+    keep using drive_service & co. unchanged.
+    """
+
+    def __init__(self, api: str):
+        self.api = api
+
+    def __getattr__(self, name):
+        services = _user_services.get()
+        if services is None:
+            raise RuntimeError(f"No Google credentials for this request; send the {ACCESS_TOKEN_HEADER} header")
+        return getattr(getattr(services, self.api), name)
+
+class UserSessionRegistry:
+    """LRU of per-user Google clients, keyed by user id and a hash of the access token.
+
+    A request only gets clients built from the very token it carries, so naming a
+    cached user id with another token builds new clients instead of borrowing theirs.
+    """
+
+    def __init__(self, max_users: int):
+        self.max_users = max(max_users, 1)
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(user_id: str, access_token: str) -> tuple:
+        return (user_id, hashlib.sha256(access_token.encode('utf-8')).hexdigest())
+
+    def lookup(self, user_id: str, access_token: str, refresh_token: Optional[str],
+               expires_at: Optional[str]) -> Optional[UserServices]:
+        """Return the clients opened for exactly these tokens, else None."""
+        key = self.key(user_id, access_token)
+        with self.lock:
+            services = self.users.get(key)
+            if services is None or services.credentials.refresh_token != refresh_token:
+                return None
+            self.users.move_to_end(key)
+            return services
+
+    def open(self, user_id: str, access_token: str, refresh_token: Optional[str],
+             expires_at: Optional[str]) -> UserServices:
+        """Build clients for a user (discovery documents are parsed, so keep this off the event loop)."""
+        services = UserServices(user_id, make_credentials(access_token, refresh_token, expires_at))
+        evicted = []
+        with self.lock:
+            key = self.key(user_id, access_token)
+            self.users[key] = services
+            self.users.move_to_end(key)
+            while len(self.users) > self.max_users:
+                evicted.append(self.users.popitem(last=False)[0][0])
+            # A user whose token was refreshed still has an entry under the new token
+            gone = {old for old in evicted if not any(other == old for other, _ in self.users)}
+        for old in gone:
+            release_user_stores(old)
+        print(f"👤 Opened Google clients for user {user_id} ({len(self.users)} cached)", file=sys.stderr)
+        resume_user_jobs(services)
+        return services
+
+user_sessions = UserSessionRegistry(MAX_USER_SESSIONS)
+default_user_services = None
+
+async def bind_user_services(request) -> contextvars.Token:
+    """Bind the Google clients of the user named in an HTTP request's headers.
+
+    stdio requests are served for the user whose tokens are in this process's
+    environment, if any. HTTP requests without the headers are refused (see require_user_headers).
+    """
+    http_request = getattr(request, 'request', None)
+    if http_request is None:
+        return _user_services.set(default_user_services)
+    headers = http_request.headers
+    user_id = headers.get(USER_ID_HEADER)
+    if not user_id or ACCESS_TOKEN_HEADER not in headers:
+        raise PermissionError(f"The {USER_ID_HEADER} and {ACCESS_TOKEN_HEADER} headers are required")
+    tokens = (user_id, headers[ACCESS_TOKEN_HEADER], headers.get(REFRESH_TOKEN_HEADER), headers.get(EXPIRES_AT_HEADER))
+    services = user_sessions.lookup(*tokens)
+    if services is None:
+        services = await asyncio.get_running_loop().run_in_executor(tool_executor, user_sessions.open, *tokens)
+    return _user_services.set(services)
+
+# ==================== BLOB STORE ====================
+
+# Binary file contents travel as blob handles ("blob:" + 32 hex digits) naming files in a
+# directory shared with the backend, never as base64 inside JSON-RPC messages. Each user has
+# their own directory, BLOB_DIR/<user_state_name(user id)>, and a handle only resolves there.
+# The backend creates a blob by writing <that directory>/<id> (under a temporary name, then
+# renaming it) or, on the HTTP transports, by POSTing the bytes to /blobs; GET /blobs/<id>
+# reads one back. Both routes act for the user named in the request headers.
+BLOB_DIR = os.getenv("MCP_BLOB_DIR") or os.path.join(STATE_DIR, "blobs")
+BLOB_TTL = int(os.getenv("MCP_BLOB_TTL", "3600"))
+BLOB_MAX_BYTES = int(os.getenv("MCP_BLOB_MAX_BYTES", str(1024 ** 3)))
+# Most bytes of unexpired blobs one user may hold
+BLOB_USER_QUOTA = int(os.getenv("MCP_BLOB_USER_QUOTA", str(4 * 1024 ** 3)))
+BLOB_ID_RE = re.compile(r'[0-9a-f]{32}')
+BLOB_HANDLE_RE = re.compile(r'blob:([0-9a-f]{32})')
+
+_blob_sweep = {'next': 0.0}
+
+def blob_dir(user_id: Optional[str] = None) -> str:
+    """The blob directory of user_id (default: the user the current call is served for)."""
+    return os.path.join(BLOB_DIR, user_state_name(user_id or current_user_id()))
+
+def blob_path(blob_id: str, user_id: Optional[str] = None) -> str:
+    return os.path.join(blob_dir(user_id), blob_id)
+
+def blob_usage(directory: str) -> int:
+    """Bytes held in a user's blob directory, partial writes included."""
+    total = 0
+    for entry in os.scandir(directory):
+        try:
+            total += entry.stat().st_size
+        except OSError:
+            pass
+    return total
+
+def resolve_blob(content: Optional[str]) -> Optional[str]:
+    """Return the current user's file behind a blob handle, or None if content is not a handle."""
+    match = BLOB_HANDLE_RE.fullmatch(content.strip()) if content and len(content) < 64 else None
+    if match is None:
+        return None
+    path = blob_path(match.group(1))
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"{match.group(0)} does not exist or has expired")
+    return path
+
+def sweep_blobs():
+    """Delete blobs (and abandoned partial writes) older than BLOB_TTL, at most once a minute."""
+    now = time.time()
+    if now < _blob_sweep['next']:
+        return
+    _blob_sweep['next'] = now + 60
+    for user_dir in os.scandir(BLOB_DIR):
+        if not user_dir.is_dir():
+            continue
+        for entry in os.scandir(user_dir.path):
+            try:
+                if entry.stat().st_mtime < now - BLOB_TTL:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+class BlobQuotaExceeded(ValueError):
+    """A blob would take its user over BLOB_USER_QUOTA (or BLOB_MAX_BYTES)."""
+
+def blob_room(user_id: Optional[str] = None) -> int:
+    """Bytes the user may still store as blobs, after sweeping expired ones; call before new_blob.
+
+    This walks blob directories, so keep it off the event loop. Raises BlobQuotaExceeded
+    if the user's blobs already fill BLOB_USER_QUOTA.
+    """
+    directory = blob_dir(user_id)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    sweep_blobs()
+    room = BLOB_USER_QUOTA - blob_usage(directory)
+    if room <= 0:
+        raise BlobQuotaExceeded(f"Blob storage of {BLOB_USER_QUOTA} bytes is full; retry once older blobs expire")
+    return room
+
+@contextmanager
+def new_blob(user_id: Optional[str] = None):
+    """Create a blob: yields (handle, binary file); the handle resolves once the block succeeds."""
+    directory = blob_dir(user_id)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    blob_id = os.urandom(16).hex()
+    partial = os.path.join(directory, f".{blob_id}.part")
+    try:
+        with os.fdopen(os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as blob_file:
+            yield f"blob:{blob_id}", blob_file
+        os.replace(partial, os.path.join(directory, blob_id))
+    except BaseException:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise
+
+async def check_blob_request(request):
+    """Apply the MCP endpoints' Host/Origin validation to the blob routes (bodies are raw bytes, not JSON)."""
+    from mcp.server.transport_security import TransportSecurityMiddleware
+    security = TransportSecurityMiddleware(mcp.settings.transport_security)
+    return await security.validate_request(request, is_post=False)
+
+@mcp.custom_route("/blobs/{blob_id}", methods=["GET"])
+async def get_blob(request):
+    from starlette.responses import FileResponse, PlainTextResponse
+    rejected = await check_blob_request(request)
+    if rejected is not None:
+        return rejected
+    blob_id = request.path_params['blob_id']
+    # require_user_headers has already refused requests without a user
+    path = blob_path(blob_id, request.headers[USER_ID_HEADER])
+    if not BLOB_ID_RE.fullmatch(blob_id) or not os.path.isfile(path):
+        return PlainTextResponse("Unknown or expired blob", status_code=404)
+    return FileResponse(path, media_type="application/octet-stream")
+
+@mcp.custom_route("/blobs", methods=["POST"])
+async def post_blob(request):
+    from starlette.responses import JSONResponse, PlainTextResponse
+    rejected = await check_blob_request(request)
+    if rejected is not None:
+        return rejected
+    user_id = request.headers[USER_ID_HEADER]
+    size = 0
+    try:
+        limit = min(BLOB_MAX_BYTES, await anyio.to_thread.run_sync(blob_room, user_id))
+        with new_blob(user_id) as (handle, blob_file):
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > limit:
+                    raise BlobQuotaExceeded(f"Blob exceeds the {limit} bytes left for this user "
+                                            f"(at most {BLOB_MAX_BYTES} per blob)")
+                await anyio.to_thread.run_sync(blob_file.write, chunk)
+    except BlobQuotaExceeded as e:
+        return PlainTextResponse(str(e), status_code=413)
+    return JSONResponse({'blob': handle, 'size': size}, status_code=201)
+
+def blob_upload(path: str, mime_type: str) -> MediaFileUpload:
+    """Upload media read straight from a blob file."""
+    return MediaFileUpload(path, mimetype=mime_type, chunksize=MEDIA_CHUNK_SIZE, resumable=True)
+
+# ==================== GOOGLE DRIVE FUNCTIONS ====================
+
+def get_export_mime_type(google_mime_type: str) -> str:
+    """Get the export MIME type for Google Workspace files."""
+    mime_type_map = {
+        'application/vnd.google-apps.document': 'text/markdown',
+        'application/vnd.google-apps.spreadsheet': 'text/csv',
+        'application/vnd.google-apps.presentation': 'text/plain',
+        'application/vnd.google-apps.drawing': 'image/png',
+    }
+    return mime_type_map.get(google_mime_type, 'text/plain')
+
+@traced
+def extract_pdf_text(file_io: io.BytesIO) -> str:
+    """Extract text content from PDF file."""
+    if not PDF_SUPPORT:
+        return ErrorResult("PDF text extraction not available. Please install PyPDF2: pip install PyPDF2")
+    
+    try:
+        file_io.seek(0)  # Reset file pointer
+        pdf_reader = PyPDF2.PdfReader(file_io)
+        text_content = []
+        
+        for page_num, page in enumerate(pdf_reader.pages, 1):
+            check_cancelled()
+            try:
+                page_text = page.extract_text()
+                if page_text.strip():
+                    text_content.append(f"--- Page {page_num} ---\n{page_text}")
+            except Exception as e:
+                text_content.append(f"--- Page {page_num} ---\n[Error extracting text: {e}]")
+        
+        if not text_content:
+            return "No text content could be extracted from this PDF."
+        
+        return "\n\n".join(text_content)
+    
+    except Exception as e:
+        return ErrorResult(f"Error extracting PDF text: {e}")
+
+# Text PDFs are set like reportlab's Normal style: Helvetica 10/12 on US letter with 1" margins
+PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT = 612, 792
+PDF_MARGIN = 72
+PDF_FONT_SIZE = 10
+PDF_LEADING = 12
+PDF_LINES_PER_PAGE = (PDF_PAGE_HEIGHT - 2 * PDF_MARGIN) // PDF_LEADING
+# Line width limit in glyph units (1/1000 of the font size)
+PDF_LINE_UNITS = (PDF_PAGE_WIDTH - 2 * PDF_MARGIN) * 1000 // PDF_FONT_SIZE
+# Generated PDFs stay in memory up to this size, then spill to a temporary file
+PDF_SPOOL_BYTES = 8 * 1024 * 1024
+
+_helvetica_widths = pdfmetrics.getFont('Helvetica').widths if PDF_SUPPORT else None
+
+@functools.lru_cache(maxsize=65536)
+def pdf_word_width(word: bytes) -> int:
+    """Width of a WinAnsi-encoded word in Helvetica glyph units."""
+    return sum(map(_helvetica_widths.__getitem__, word))
+
+def wrap_pdf_line(line: bytes, limit: int = PDF_LINE_UNITS) -> List[bytes]:
+    """Greedy word wrap of one encoded line; words wider than a line are broken anywhere."""
+    if len(line) * 1015 <= limit:  # no glyph is wider than 1015 units
+        return [line]
+    space = _helvetica_widths[32]
+    lines, current, width = [], [], 0
+    for word in line.split(b' '):
+        word_width = pdf_word_width(word) if len(word) < 64 else sum(map(_helvetica_widths.__getitem__, word))
+        if current and width + space + word_width > limit:
+            lines.append(b' '.join(current))
+            current, width = [], 0
+        while word_width > limit:
+            cut, cut_width = 0, 0
+            while cut_width + _helvetica_widths[word[cut]] <= limit:
+                cut_width += _helvetica_widths[word[cut]]
+                cut += 1
+            lines.append(word[:cut])
+            word = word[cut:]
+            word_width -= cut_width
+        width += word_width + (space if current else 0)
+        current.append(word)
+    lines.append(b' '.join(current))
+    return lines
+
+def pdf_escape(text: bytes) -> bytes:
+    return text.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)').replace(b'\r', b'')
+
+def iter_lines(text: str):
+    """Lines of text without splitting it into a list first."""
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end < 0:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+class StreamingPdfWriter:
+    """Minimal PDF writer that emits every page as soon as it is laid out.
+
+    Text is set in the standard (not embedded) Helvetica font with WinAnsi encoding. Only
+    the byte offset of each object is kept, so memory does not grow with the document.
+    """
+
+    FONT_OBJECT, PAGES_OBJECT, CATALOG_OBJECT = 1, 2, 3
+
+    def __init__(self, out):
+        self.out = out
+        self.position = 0
+        self.offsets = [0, 0, 0]  # byte offset of object n at index n - 1
+        self.pages = []
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._object(self.FONT_OBJECT,
+                     b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+
+    def _write(self, data: bytes):
+        self.out.write(data)
+        self.position += len(data)
+
+    def _object(self, number: int, body: bytes):
+        self.offsets[number - 1] = self.position
+        self._write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+
+    def _new_object(self) -> int:
+        self.offsets.append(0)
+        return len(self.offsets)
+
+    def add_page(self, lines: List[bytes]):
+        """Write one page of already wrapped, WinAnsi-encoded lines."""
+        top = PDF_PAGE_HEIGHT - PDF_MARGIN - PDF_FONT_SIZE
+        operators = [b"BT /F1 %d Tf %d TL %d %d Td" % (PDF_FONT_SIZE, PDF_LEADING, PDF_MARGIN, top)]
+        operators.extend(b"(%s) Tj T*" % pdf_escape(line) for line in lines)
+        operators.append(b"ET")
+        stream = zlib.compress(b"\n".join(operators))
+        contents, page = self._new_object(), self._new_object()
+        self._object(contents, b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(stream), stream))
+        self._object(page, b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R "
+                           b"/Resources << /Font << /F1 %d 0 R >> >> >>"
+                     % (self.PAGES_OBJECT, PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT, contents, self.FONT_OBJECT))
+        self.pages.append(page)
+
+    def close(self):
+        """Write the page tree, cross-reference table and trailer."""
+        if not self.pages:
+            self.add_page([])
+        kids = b" ".join(b"%d 0 R" % page for page in self.pages)
+        self._object(self.PAGES_OBJECT, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.pages)))
+        self._object(self.CATALOG_OBJECT, b"<< /Type /Catalog /Pages %d 0 R >>" % self.PAGES_OBJECT)
+        xref = self.position
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.offsets) + 1))
+        self._write(b"".join(b"%010d 00000 n \n" % offset for offset in self.offsets))
+        self._write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                    % (len(self.offsets) + 1, self.CATALOG_OBJECT, xref))
+
+@traced
+def create_pdf_from_text(text_content: str):
+    """Create a PDF file from text content, page by page, into a spooled temporary file.
+
+    Returns the file rewound to the start; memory use is bounded by PDF_SPOOL_BYTES.
+    """
+    if not PDF_SUPPORT:
+        raise Exception("PDF creation not available. Please install reportlab: pip install reportlab")
+    
+    try:
+        buffer = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_BYTES)
+        writer = StreamingPdfWriter(buffer)
+        page = []
+        for line in iter_lines(text_content):
+            encoded = line.rstrip('\r').expandtabs(4).encode('cp1252', errors='replace')
+            for piece in wrap_pdf_line(encoded):
+                page.append(piece)
+                if len(page) == PDF_LINES_PER_PAGE:
+                    check_cancelled()
+                    writer.add_page(page)
+                    page = []
+        if page:
+            writer.add_page(page)
+        writer.close()
+        buffer.seek(0)
+        return buffer
+    
+    except Exception as e:
+        raise Exception(f"Error creating PDF: {e}")
+
+CONTENT_ENCODINGS = ('text', 'base64', 'blob')
+
+class Base64Reader(io.RawIOBase):
+    """Seekable binary file over a base64 string, decoding only the bytes each read asks for.
+
+    MediaIoBaseUpload reads one chunk at a time, so an upload never holds more than one
+    decoded chunk next to the original string.
+    """
+
+    def __init__(self, text: str):
+        if re.search(r'\s', text):
+            text = re.sub(r'\s+', '', text)
+        if len(text) % 4:
+            raise ValueError("Invalid base64 content: length is not a multiple of 4")
+        self.text = text
+        self.size = len(text) // 4 * 3 - text.endswith('=') - text.endswith('==')
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), self.size - self.position)
+        if n <= 0:
+            return 0
+        skip = self.position % 3
+        quads = self.text[self.position // 3 * 4:(self.position + n + 2) // 3 * 4]
+        data = base64.b64decode(quads, validate=True)[skip:skip + n]
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+def content_encoding(content: str, encoding: Optional[str]) -> str:
+    """Validate a content encoding; without one, content is text unless it is a blob handle."""
+    if encoding is None:
+        return 'blob' if len(content) < 64 and BLOB_HANDLE_RE.fullmatch(content.strip()) else 'text'
+    if encoding not in CONTENT_ENCODINGS:
+        raise ValueError(f"encoding must be one of {', '.join(CONTENT_ENCODINGS)}, not {encoding!r}")
+    return encoding
+
+def content_blob(content: str) -> str:
+    path = resolve_blob(content)
+    if path is None:
+        raise ValueError("content is not a blob handle (blob:<32 hex digits>)")
+    return path
+
+def content_text(content: str, encoding: str) -> str:
+    """Content as text, for targets that take text (Google Docs)."""
+    if encoding == 'blob':
+        with open(content_blob(content), encoding='utf-8') as blob_file:
+            return blob_file.read()
+    if encoding == 'base64':
+        return base64.b64decode(content).decode('utf-8')
+    return content
+
+def content_media(content: str, encoding: str, mime_type: str):
+    """Upload media for file content; text written to a PDF is rendered as a PDF document."""
+    if encoding == 'blob':
+        return blob_upload(content_blob(content), mime_type)
+    if encoding == 'base64':
+        return MediaIoBaseUpload(Base64Reader(content), mimetype=mime_type, chunksize=MEDIA_CHUNK_SIZE, resumable=True)
+    if mime_type == 'application/pdf':
+        return MediaIoBaseUpload(create_pdf_from_text(content), mimetype=mime_type, resumable=True)
+    return MediaIoBaseUpload(io.BytesIO(content.encode('utf-8')), mimetype=mime_type, resumable=True)
+
+@mcp.resource("gdrive:///{file_id}")
+def read_file(file_id: str) -> str:
+    """Read a Google Drive file resource."""
+    try:
+        # Get file metadata
+        file_metadata = drive_service.files().get(fileId=file_id, fields='mimeType').execute()
+        mime_type = file_metadata.get('mimeType', '')
+        
+        # Handle Google Workspace files
+        if mime_type.startswith('application/vnd.google-apps'):
+            export_mime_type = get_export_mime_type(mime_type)
+            request = drive_service.files().export_media(fileId=file_id, mimeType=export_mime_type)
+            file_io = download_media(request, file_id)
+            
+            content = file_io.getvalue().decode('utf-8')
+            return content
+        
+        # Handle regular files
+        file_io = download_media(drive_service.files().get_media(fileId=file_id), file_id)
+        
+        # Handle different file types
+        if mime_type.startswith('text/') or mime_type == 'application/json':
+            return file_io.getvalue().decode('utf-8')
+        elif mime_type == 'application/pdf':
+            return extract_pdf_text(file_io)
+        else:
+            # Return base64 encoded for other binary files
+            return base64.b64encode(file_io.getvalue()).decode('utf-8')
+            
+    except Exception as e:
+        raise Exception(f"Error reading file {file_id}: {e}")
+
+# ==================== GOOGLE DRIVE TOOLS ====================
+
+@mcp.tool()
+def drive_search(query: str) -> str:
+    """Search for files in Google Drive"""
+    try:
+        # Escape special characters for Drive API
+        escaped_query = query.replace("\\", "\\\\").replace("'", "\\'")
+        formatted_query = f"fullText contains '{escaped_query}'"
+        
+        results = drive_service.files().list(
+            q=formatted_query,
+            pageSize=10,
+            fields="files(id, name, mimeType, modifiedTime, size)"
+        ).execute()
+        
+        files = results.get('files', [])
+        file_count = len(files)
+        
+        if file_count == 0:
+            return "No files found."
+        
+        file_list = []
+        for file in files:
+            file_list.append(f"{file['name']} ({file['mimeType']}) [ID: {file['id']}]")
+        
+        return f"Found {file_count} files:\n" + "\n".join(file_list)
+    
+    except Exception as e:
+        return ErrorResult(f"Error searching files: {str(e)}")
+
+@mcp.tool()
+def drive_read(fileId: str) -> str:
+    """Read the contents of a file from Google Drive using its fileId.
+
+    Text, JSON and PDF (extracted text) files are returned inline, and Google Workspace
+    files are exported whole (docs_outline and docs_read_section read part of a long
+    Google Doc). Other binary files are saved to the local blob store and returned as a
+    blob handle ("blob:...") that drive_create and drive_edit accept as content.
+    """
+    try:
+        # Get file metadata
+        file_metadata = drive_service.files().get(fileId=fileId, fields='mimeType,name').execute()
+        mime_type = file_metadata.get('mimeType', '')
+        file_name = file_metadata.get('name', 'Unknown')
+        
+        # Handle Google Workspace files
+        if mime_type.startswith('application/vnd.google-apps'):
+            export_mime_type = get_export_mime_type(mime_type)
+            request = drive_service.files().export_media(fileId=fileId, mimeType=export_mime_type)
+            file_io = download_media(request, file_name)
+            
+            content = file_io.getvalue().decode('utf-8')
+            return f"File: {file_name}\nContent:\n\n{content}"
+        
+        # Handle regular files
+        request = drive_service.files().get_media(fileId=fileId)
+        
+        # Handle different file types
+        if mime_type.startswith('text/') or mime_type == 'application/json':
+            content = download_media(request, file_name).getvalue().decode('utf-8')
+            return f"File: {file_name}\nContent:\n\n{content}"
+        elif mime_type == 'application/pdf':
+            content = extract_pdf_text(download_media(request, file_name))
+            if is_error_result(content):
+                return content
+            return f"File: {file_name}\nExtracted Text Content:\n\n{content}"
+        else:
+            # Other binary files go to the blob store, streamed straight to disk
+            blob_room()
+            with new_blob() as (handle, blob_file):
+                download_media(request, file_name, blob_file)
+                file_size = blob_file.tell()
+            return (f"File: {file_name}\nBinary file ({mime_type}, {file_size} bytes) saved as blob:\n\n{handle}\n"
+                    f"Path: {blob_path(handle[5:])}")
+    
+    except Exception as e:
+        return ErrorResult(f"Error reading file {fileId}: {str(e)}")
+
+# Just enough of a document to map its text to Docs indexes
+DOC_TEXT_FIELDS = 'revisionId,body(content(startIndex,endIndex,paragraph(elements(startIndex,endIndex,textRun(content)))))'
+
+def utf16_len(text: str) -> int:
+    """Length in UTF-16 code units, the unit of Docs API indexes."""
+    return len(text.encode('utf-16-le')) // 2
+
+def doc_plain_text(document: dict) -> Optional[str]:
+    """Body text of a document made only of text paragraphs, else None.
+
+    Tables, images and other non-text elements take up indexes without any text,
+    so offsets into the text of such documents are not Docs indexes.
+    """
+    parts, index = [], 1
+    for element in document.get('body', {}).get('content', []):
+        if 'paragraph' not in element:
+            if element.get('endIndex', 0) <= 1:  # the section break every body starts with
+                continue
+            return None
+        for run in element['paragraph'].get('elements', []):
+            if 'textRun' not in run or run.get('startIndex', 0) != index:
+                return None
+            parts.append(run['textRun'].get('content', ''))
+            index = run['endIndex']
+    return ''.join(parts)
+
+def doc_text_edits(old: str, new: str) -> List[tuple]:
+    """Replacements turning old into new as (start, end, text) in Docs indexes, last first.
+
+    Lines are matched first, then each changed block is trimmed to the characters that
+    actually differ, so a one-word change is one small replacement. When both texts end
+    with a newline, as a Docs body does, no edit deletes that newline or inserts after it.
+    """
+    old_lines, new_lines = old.splitlines(keepends=True), new.splitlines(keepends=True)
+    offsets = [1]
+    for line in old_lines:
+        offsets.append(offsets[-1] + utf16_len(line))
+    edits = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        before, after = ''.join(old_lines[i1:i2]), ''.join(new_lines[j1:j2])
+        prefix = len(os.path.commonprefix([before, after]))
+        suffix = len(os.path.commonprefix([before[prefix:][::-1], after[prefix:][::-1]]))
+        start = offsets[i1] + utf16_len(before[:prefix])
+        end = offsets[i2] - utf16_len(before[len(before) - suffix:])
+        edits.append((start, end, after[prefix:len(after) - suffix]))
+    body_end = offsets[-1]
+    if edits and edits[-1][1] == body_end and old.endswith('\n') and new.endswith('\n'):
+        # Appending or removing trailing lines: do it just before the final newline instead
+        start, end, text = edits[-1]
+        if end > start and text.endswith('\n'):
+            edits[-1] = (start, end - 1, text[:-1])
+        else:
+            edits[-1] = (start - 1, end - 1, ('\n' + text)[:-1])
+    edits.reverse()
+    return edits
+
+def edit_google_doc(document_id: str, text: str) -> Optional[str]:
+    """Apply text to a Google Doc as targeted deletes and inserts.
+
+    The batchUpdate is pinned to the revision the diff was computed against; if the
+    document changed in between it is diffed again once. Returns None when the document
+    needs a full replacement instead (non-text elements, changes too large for one request,
+    or edits the Docs API refused).
+    """
+    for attempt in range(2):
+        document = docs_service.documents().get(documentId=document_id, fields=DOC_TEXT_FIELDS).execute()
+        current = doc_plain_text(document)
+        if current is None:
+            return None
+        if current.endswith('\n') and not text.endswith('\n'):
+            text += '\n'  # the final newline of a body cannot be deleted
+        edits = doc_text_edits(current, text)
+        inserted = sum(len(new) for _, _, new in edits)
+        if inserted > DOC_INSERT_CHUNK:
+            return None
+        if not edits:
+            return "no changes"
+        requests = []
+        for start, end, new in edits:
+            if end > start:
+                requests.append({'deleteContentRange': {'range': {'startIndex': start, 'endIndex': end}}})
+            if new:
+                requests.append({'insertText': {'location': {'index': start}, 'text': new}})
+        try:
+            docs_service.documents().batchUpdate(
+                documentId=document_id,
+                body={'requests': requests, 'writeControl': {'requiredRevisionId': document['revisionId']}}
+            ).execute()
+        except HttpError as e:
+            if e.resp.status != 400:
+                raise
+            if attempt or 'revision' not in (e.reason or '').lower():
+                return None
+            continue
+        deleted = sum(end - start for start, end, _ in edits)
+        return f"{len(edits)} change(s) applied in place, {deleted} characters removed, {inserted} inserted"
+
+@mcp.tool()
+def drive_edit(fileId: str, content: str, encoding: Optional[str] = None) -> str:
+    """Edit the content of an existing file in Google Drive.
+
+    encoding says what content holds: 'text' (the default), 'base64' for binary data, or
+    'blob' for a blob handle from drive_read or the blob store (handles are recognized
+    without it). Text written to a PDF is rendered as a PDF document. A Google Doc is
+    changed only where its text differs from content.
+    """
+    try:
+        encoding = content_encoding(content, encoding)
+        # Get current file metadata to preserve MIME type
+        file_metadata = drive_service.files().get(fileId=fileId, fields='mimeType,name').execute()
+        mime_type = file_metadata.get('mimeType', 'text/plain')
+        file_name = file_metadata.get('name', 'Unknown')
+        
+        if mime_type == GOOGLE_DOC_MIME:
+            text = content_text(content, encoding)
+            summary = edit_google_doc(fileId, text)
+            if summary is not None:
+                return f"File updated successfully: {file_name} (ID: {fileId}, MIME type: {mime_type}): {summary}"
+            # Replace the whole body; Drive converts the uploaded text
+            content, encoding, mime_type = text, 'text', 'text/plain'
+        
+        media = content_media(content, encoding, mime_type)
+        
+        file = drive_service.files().update(
+            fileId=fileId,
+            media_body=media,
+            fields='id, name, mimeType'
+        ).execute()
+        
+        return f"File updated successfully: {file['name']} (ID: {file['id']}, MIME type: {file['mimeType']})"
+    
+    except Exception as e:
+        return ErrorResult(f"Error editing file {fileId}: {str(e)}")
+
+@mcp.tool()
+def drive_delete(fileId: str) -> str:
+    """Delete a file from Google Drive using its fileId"""
+    try:
+        # Move to trash
+        drive_service.files().update(
+            fileId=fileId,
+            body={'trashed': True}
+        ).execute()
+        
+        return f"File with ID {fileId} has been moved to the trash."
+    
+    except Exception as e:
+        return ErrorResult(f"Error deleting file {fileId}: {str(e)}")
+
+# Add these tools to your mcp_toolkit.py file
+
+@mcp.tool()
+def drive_upload_file(file_path: str, file_name: Optional[str] = None, folder_id: Optional[str] = None) -> str:
+    """
+    Upload a file to Google Drive
+    
+    Args:
+        file_path: Path to the file to upload (from uploads directory)
+        file_name: Optional custom name for the file (defaults to original filename)
+        folder_id: Optional Google Drive folder ID to upload to (defaults to root)
+    """
+    try:
+        # Check if file exists
+        if not os.path.exists(file_path):
+            return ErrorResult(f"Error: File not found at {file_path}")
+        
+        # Get file info
+        original_filename = os.path.basename(file_path)
+        upload_filename = file_name if file_name else original_filename
+        
+        # Detect MIME type
+        mime_type, _ = mimetypes.guess_type(file_path)
+        if not mime_type:
+            mime_type = 'application/octet-stream'
+        
+        # Prepare file metadata
+        file_metadata = {
+            'name': upload_filename
+        }
+        
+        # Add parent folder if specified
+        if folder_id:
+            file_metadata['parents'] = [folder_id]
+        
+        # Create media upload object
+        media = MediaFileUpload(file_path, mimetype=mime_type, resumable=True, chunksize=MEDIA_CHUNK_SIZE)
+        
+        # Upload file to Drive
+        file = drive_service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields='id,name,size,mimeType,webViewLink'
+        ).execute()
+        
+        # Get file size
+        file_size = os.path.getsize(file_path)
+        
+        response = f"File uploaded to Google Drive successfully!\n"
+        response += f"File Name: {file['name']}\n"
+        response += f"File ID: {file['id']}\n"
+        response += f"MIME Type: {file['mimeType']}\n"
+        response += f"Size: {file_size} bytes\n"
+        response += f"View Link: {file.get('webViewLink', 'N/A')}\n"
+        
+        return response
+        
+    except HttpError as e:
+        return ErrorResult(f"Google Drive API error: {str(e)}")
+    except Exception as e:
+        return ErrorResult(f"Error uploading file to Drive: {str(e)}")
+
+
+@mcp.tool()
+def drive_move(fileId: str, targetFolderId: str) -> str:
+    """Move a file to a different folder in Google Drive"""
+    try:
+        # Get current parents
+        file = drive_service.files().get(fileId=fileId, fields='parents').execute()
+        previous_parents = ','.join(file.get('parents', []))
+        
+        # Move file
+        file = drive_service.files().update(
+            fileId=fileId,
+            addParents=targetFolderId,
+            removeParents=previous_parents,
+            fields='id, name, parents'
+        ).execute()
+        
+        return f"File moved successfully: {file['name']} (ID: {file['id']}) to folder ID: {targetFolderId}"
+    
+    except Exception as e:
+        return ErrorResult(f"Error moving file {fileId}: {str(e)}")
+
+@mcp.tool()
+def drive_share_file(fileId: str, email: str, role: str = "reader", send_notification: bool = True) -> str:
+    """Share a Google Drive file with someone and get shareable link
+    
+    Args:
+        fileId: ID of the file to share
+        email: Email address to share with
+        role: Permission level ('reader', 'writer', 'commenter')
+        send_notification: Whether to send email notification
+    """
+    try:
+        # Create permission
+        permission = {
+            'type': 'user',
+            'role': role,
+            'emailAddress': email
+        }
+        
+        drive_service.permissions().create(
+            fileId=fileId,
+            body=permission,
+            sendNotificationEmail=send_notification
+        ).execute()
+        
+        # Get shareable link
+        file_metadata = drive_service.files().get(
+            fileId=fileId, 
+            fields='webViewLink,name'
+        ).execute()
+        
+        return f"File '{file_metadata['name']}' shared with {email} as {role}.\nShareable link: {file_metadata['webViewLink']}"
+    
+    except Exception as e:
+        return ErrorResult(f"Error sharing file {fileId}: {str(e)}")
+
+@mcp.tool()
+def drive_get_shareable_link(fileId: str, make_public: bool = False) -> str:
+    """Get shareable link for a Google Drive file
+    
+    Args:
+        fileId: ID of the file
+        make_public: Whether to make file publicly accessible
+    """
+    try:
+        if make_public:
+            # Make file publicly readable
+            permission = {
+                'type': 'anyone',
+                'role': 'reader'
+            }
+            drive_service.permissions().create(
+                fileId=fileId,
+                body=permission
+            ).execute()
+        
+        # Get file metadata including links
+        file_metadata = drive_service.files().get(
+            fileId=fileId, 
+            fields='webViewLink,webContentLink,name'
+        ).execute()
+        
+        result = f"File: {file_metadata['name']}\n"
+        result += f"View link: {file_metadata['webViewLink']}\n"
+        if 'webContentLink' in file_metadata:
+            result += f"Download link: {file_metadata['webContentLink']}"
+        
+        return result
+    
+    except Exception as e:
+        return ErrorResult(f"Error getting shareable link for {fileId}: {str(e)}")
+
+@mcp.tool()
+def drive_create_folder(name: str, parent_folder_id: str = None) -> str:
+    """Create a new folder in Google Drive
+    
+    Args:
+        name: Name of the folder to create
+        parent_folder_id: ID of parent folder (None for root directory)
+    """
+    try:
+        folder_metadata = {
+            'name': name,
+            'mimeType': 'application/vnd.google-apps.folder'
+        }
+        
+        # Set parent folder if specified
+        if parent_folder_id:
+            folder_metadata['parents'] = [parent_folder_id]
+        
+        folder = drive_service.files().create(
+            body=folder_metadata,
+            fields='id, name, parents'
+        ).execute()
+        
+        parent_info = f" in folder ID: {parent_folder_id}" if parent_folder_id else " in root directory"
+        return f"Folder created successfully: '{folder['name']}' (ID: {folder['id']}){parent_info}"
+    
+    except Exception as e:
+        return ErrorResult(f"Error creating folder: {str(e)}")
+
+@mcp.tool()
+def drive_list_folder_contents(folder_id: str, include_subfolders: bool = True) -> str:
+    """List all files and folders within a specific folder
+    
+    Args:
+        folder_id: ID of the folder to list contents (use 'root' for root directory)
+        include_subfolders: Whether to include subfolders in the listing
+    """
+    try:
+        # Query to get files in the specified folder
+        query = f"'{folder_id}' in parents and trashed=false"
+        
+        results = drive_service.files().list(
+            q=query,
+            pageSize=100,
+            fields="files(id, name, mimeType, size, modifiedTime, owners)",
+            orderBy="folder,name"
+        ).execute()
+        
+        items = results.get('files', [])
+        
+        if not items:
+            return f"No files or folders found in the specified location."
+        crawl_total = 1 + (min(3, sum(item['mimeType'] == 'application/vnd.google-apps.folder' for item in items))
+                           if include_subfolders else 0)
+        report_progress(1, crawl_total, f"Listed {len(items)} items")
+        
+        # Get folder name for context
+        try:
+            if folder_id == 'root':
+                folder_name = "My Drive (Root)"
+            else:
+                folder_info = drive_service.files().get(fileId=folder_id, fields='name').execute()
+                folder_name = folder_info.get('name', 'Unknown Folder')
+        except Exception:
+            folder_name = f"Folder ID: {folder_id}"
+        
+        # Separate folders and files
+        folders = []
+        files = []
+        
+        for item in items:
+            item_info = {
+                'name': item['name'],
+                'id': item['id'],
+                'mimeType': item.get('mimeType', ''),
+                'size': item.get('size', 'N/A'),
+                'modified': item.get('modifiedTime', 'Unknown'),
+                'owner': item.get('owners', [{}])[0].get('displayName', 'Unknown') if item.get('owners') else 'Unknown'
+            }
+            
+            if item['mimeType'] == 'application/vnd.google-apps.folder':
+                folders.append(item_info)
+            else:
+                files.append(item_info)
+        
+        # Build response
+        response = f"Contents of '{folder_name}':\n"
+        response += f"Total items: {len(items)} ({len(folders)} folders, {len(files)} files)\n\n"
+        
+        # List folders first
+        if folders:
+            response += "📁 FOLDERS:\n"
+            for folder in folders:
+                response += f"  📁 {folder['name']} (ID: {folder['id']}) - Modified: {folder['modified'][:10]}\n"
+            response += "\n"
+        
+        # List files
+        if files:
+            response += "📄 FILES:\n"
+            for file in files:
+                size_info = f" - {format_file_size(file['size'])}" if file['size'] != 'N/A' else ""
+                file_type = get_file_type_emoji(file['mimeType'])
+                response += f"  {file_type} {file['name']} (ID: {file['id']}){size_info} - Modified: {file['modified'][:10]}\n"
+        
+        # Add subfolder contents if requested
+        if include_subfolders and folders:
+            response += "\n" + "="*50 + "\n"
+            response += "SUBFOLDER CONTENTS:\n"
+            for crawled, folder in enumerate(folders[:3], 1):  # Limit to first 3 subfolders to avoid overwhelming output
+                report_progress(crawled, crawl_total, f"Listing subfolder {folder['name']}")
+                try:
+                    subfolder_query = f"'{folder['id']}' in parents and trashed=false"
+                    subfolder_results = drive_service.files().list(
+                        q=subfolder_query,
+                        pageSize=20,
+                        fields="files(id, name, mimeType)"
+                    ).execute()
+                    
+                    subfolder_items = subfolder_results.get('files', [])
+                    if subfolder_items:
+                        response += f"\n📁 {folder['name']} ({len(subfolder_items)} items):\n"
+                        for item in subfolder_items[:10]:  # Show first 10 items
+                            emoji = "📁" if item['mimeType'] == 'application/vnd.google-apps.folder' else get_file_type_emoji(item['mimeType'])
+                            response += f"    {emoji} {item['name']} (ID: {item['id']})\n"
+                        if len(subfolder_items) > 10:
+                            response += f"    ... and {len(subfolder_items) - 10} more items\n"
+                except Exception:
+                    response += f"\n📁 {folder['name']}: [Could not access contents]\n"
+            report_progress(crawl_total, crawl_total, "Listed subfolders")
+            
+            if len(folders) > 3:
+                response += f"\n... and {len(folders) - 3} more subfolders not shown. Use include_subfolders=False for cleaner output.\n"
+        
+        return response
+    
+    except Exception as e:
+        return ErrorResult(f"Error listing folder contents: {str(e)}")
+
+@mcp.tool()
+def drive_list_all_files(max_results: int = 50, file_type: str = None, order_by: str = "name") -> str:
+    """List all files and folders in Google Drive
+    
+    Args:
+        max_results: Maximum number of items to return (default: 50, max: 1000)
+        file_type: Filter by file type ('folder', 'document', 'spreadsheet', 'presentation', 'pdf', 'image', etc.)
+        order_by: Sort order ('name', 'modifiedTime', 'createdTime', 'quotaBytesUsed')
+    """
+    try:
+        # Build query based on file_type filter
+        query = "trashed=false"
+        
+        if file_type:
+            file_type_queries = {
+                'folder': "mimeType='application/vnd.google-apps.folder'",
+                'document': "mimeType='application/vnd.google-apps.document'",
+                'spreadsheet': "mimeType='application/vnd.google-apps.spreadsheet'",
+                'presentation': "mimeType='application/vnd.google-apps.presentation'",
+                'pdf': "mimeType='application/pdf'",
+                'image': "mimeType contains 'image/'",
+                'video': "mimeType contains 'video/'",
+                'audio': "mimeType contains 'audio/'",
+                'text': "mimeType contains 'text/'"
+            }
+            
+            if file_type.lower() in file_type_queries:
+                query += f" and {file_type_queries[file_type.lower()]}"
+            else:
+                return ErrorResult(f"Unsupported file type filter: {file_type}. Supported types: {', '.join(file_type_queries.keys())}")
+        
+        # Limit max_results to prevent overwhelming output
+        max_results = min(max_results, 1000)
+        
+        results = drive_service.files().list(
+            q=query,
+            pageSize=max_results,
+            fields="files(id, name, mimeType, size, modifiedTime, createdTime, owners, parents, shared, webViewLink)",
+            orderBy=order_by
+        ).execute()
+        
+        items = results.get('files', [])
+        
+        if not items:
+            filter_text = f" matching filter '{file_type}'" if file_type else ""
+            return f"No files found{filter_text}."
+        
+        # Build response
+        filter_text = f" (filtered by: {file_type})" if file_type else ""
+        response = f"All Files in Google Drive{filter_text}:\n"
+        response += f"Showing {len(items)} items (ordered by {order_by}):\n\n"
+        
+        # Separate folders and files for better organization
+        folders = []
+        files = []
+        
+        for item in items:
+            if item['mimeType'] == 'application/vnd.google-apps.folder':
+                folders.append(item)
+            else:
+                files.append(item)
+        
+        # Show folders first
+        if folders:
+            response += f"📁 FOLDERS ({len(folders)}):\n"
+            for folder in folders:
+                modified_date = folder.get('modifiedTime', 'Unknown')[:10]
+                shared_status = " [SHARED]" if folder.get('shared', False) else ""
+                response += f"  📁 {folder['name']} (ID: {folder['id']}) - Modified: {modified_date}{shared_status}\n"
+            response += "\n"
+        
+        # Show files
+        if files:
+            response += f"📄 FILES ({len(files)}):\n"
+            for file in files:
+                size_info = f" - {format_file_size(file.get('size', 'N/A'))}" if file.get('size') else ""
+                modified_date = file.get('modifiedTime', 'Unknown')[:10]
+                shared_status = " [SHARED]" if file.get('shared', False) else ""
+                file_emoji = get_file_type_emoji(file['mimeType'])
+                
+                response += f"  {file_emoji} {file['name']} (ID: {file['id']}){size_info} - Modified: {modified_date}{shared_status}\n"
+        
+        # Add summary statistics
+        total_size = 0
+        size_count = 0
+        for item in items:
+            if item.get('size') and item['size'].isdigit():
+                total_size += int(item['size'])
+                size_count += 1
+        
+        response += f"\n📊 SUMMARY:\n"
+        response += f"  Total items: {len(items)}\n"
+        response += f"  Folders: {len(folders)}\n"
+        response += f"  Files: {len(files)}\n"
+        if size_count > 0:
+            response += f"  Total size (files with size info): {format_file_size(str(total_size))}\n"
+        
+        return response
+    
+    except Exception as e:
+        return ErrorResult(f"Error listing all files: {str(e)}")
+# In mcp_toolkit.py, replace the old drive_create_enhanced function with this:
+
+GOOGLE_DOC_MIME = 'application/vnd.google-apps.document'
+# Formats Drive converts to a Google Doc on upload
+DOC_SOURCE_FORMATS = {'text': 'text/plain', 'markdown': 'text/markdown', 'html': 'text/html'}
+# Multipart uploads are limited to 5 MB; larger documents go through a resumable session
+MULTIPART_UPLOAD_LIMIT = 5 * 1024 * 1024
+# Characters per insertText request when Drive cannot convert the content
+DOC_INSERT_CHUNK = 200_000
+
+def insert_doc_text(document_id: str, text: str):
+    """Append text to a document, one batchUpdate per chunk to stay under Docs request limits."""
+    for start in range(0, len(text), DOC_INSERT_CHUNK):
+        check_cancelled()
+        docs_service.documents().batchUpdate(
+            documentId=document_id,
+            body={'requests': [{'insertText': {'endOfSegmentLocation': {}, 'text': text[start:start + DOC_INSERT_CHUNK]}}]}
+        ).execute()
+        report_progress(min(start + DOC_INSERT_CHUNK, len(text)), len(text), "Inserting document text")
+
+def create_google_doc(file_metadata: dict, content: str, encoding: str, source_format: str) -> dict:
+    """Create a Google Doc in one Drive upload converted from source_format.
+
+    Content Drive refuses to convert is inserted as plain text into an empty document instead.
+    """
+    import_mime = DOC_SOURCE_FORMATS[source_format]
+    if encoding == 'blob':
+        media = blob_upload(content_blob(content), import_mime)
+    else:
+        data = content_text(content, encoding).encode('utf-8')
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype=import_mime, chunksize=MEDIA_CHUNK_SIZE,
+                                  resumable=len(data) > MULTIPART_UPLOAD_LIMIT)
+    try:
+        return drive_service.files().create(
+            body=file_metadata, media_body=media, fields='id, name, webViewLink').execute()
+    except HttpError as e:
+        if e.resp.status not in (400, 413):
+            raise
+        print(f"⚠️ Drive did not convert {file_metadata['name']} ({e.resp.status}), inserting its text instead",
+              file=sys.stderr)
+    doc_file = drive_service.files().create(body=file_metadata, fields='id, name, webViewLink').execute()
+    insert_doc_text(doc_file['id'], content_text(content, encoding))
+    return doc_file
+
+@mcp.tool()
+def drive_create(name: str, mimeType: str, content: str, folder_id: Optional[str] = None,
+                 encoding: Optional[str] = None, source_format: str = 'text') -> str:
+    """
+    Create a new file in Google Drive. Handles Google Docs, PDFs, and plain text.
+    
+    Args:
+        name: Name of the file.
+        mimeType: MIME type ('application/vnd.google-apps.document' for Google Docs, 'application/pdf', 'text/plain', etc.).
+        content: File content. For Google Docs, this is the text that will be in the document.
+        folder_id: Optional Google Drive folder ID to create the file in.
+        encoding: What content holds: 'text' (default), 'base64' for binary data, or 'blob' for a
+                  blob handle ("blob:...") from the blob store (handles are recognized without it).
+        source_format: For Google Docs, how Drive should convert content: 'text' (default),
+                       'markdown' or 'html'.
+    """
+    try:
+        encoding = content_encoding(content, encoding)
+        if source_format not in DOC_SOURCE_FORMATS:
+            raise ValueError(f"source_format must be one of {', '.join(DOC_SOURCE_FORMATS)}, not {source_format!r}")
+        file_metadata = {
+            'name': name,
+            'mimeType': mimeType
+        }
+        if folder_id:
+            file_metadata['parents'] = [folder_id]
+
+        # Google Docs are converted by Drive from the uploaded text, markdown or HTML
+        if mimeType == GOOGLE_DOC_MIME:
+            doc_file = create_google_doc(file_metadata, content, encoding, source_format)
+            return f"✅ Google Document created successfully!\n\n📄 **{name}**\n🆔 Document ID: {doc_file['id']}\n🔗 Link: {doc_file['webViewLink']}"
+
+        # Other file types are uploaded as media
+        media = content_media(content, encoding, mimeType)
+
+        file = drive_service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields='id, name, mimeType, webViewLink'
+        ).execute()
+        
+        return f"✅ File created successfully!\n\n📄 **{file['name']}**\n🆔 ID: {file['id']}\n📋 MIME type: {file['mimeType']}\n🔗 Link: {file.get('webViewLink', 'N/A')}"
+    
+    except Exception as e:
+        return ErrorResult(f"❌ Error creating file: {str(e)}")
+# Helper functions to add at the end of the file (before if __name__ == "__main__":)
+def format_file_size(size_str: str) -> str:
+    """Format file size in human-readable format"""
+    try:
+        if size_str == 'N/A' or not size_str or not size_str.isdigit():
+            return 'Size unknown'
+        
+        size_bytes = int(size_str)
+        
+        if size_bytes < 1024:
+            return f"{size_bytes} B"
+        elif size_bytes < 1024 * 1024:
+            return f"{size_bytes / 1024:.1f} KB"
+        elif size_bytes < 1024 * 1024 * 1024:
+            return f"{size_bytes / (1024 * 1024):.1f} MB"
+        else:
+            return f"{size_bytes / (1024 * 1024 * 1024):.1f} GB"
+    except:
+        return 'Size unknown'
+
+def get_file_type_emoji(mime_type: str) -> str:
+    """Get emoji based on file MIME type"""
+    emoji_map = {
+        'application/vnd.google-apps.folder': '📁',
+        'application/vnd.google-apps.document': '📝',
+        'application/vnd.google-apps.spreadsheet': '📊',
+        'application/vnd.google-apps.presentation': '📽️',
+        'application/vnd.google-apps.drawing': '🎨',
+        'application/pdf': '📄',
+        'image/': '🖼️',
+        'video/': '🎥',
+        'audio/': '🎵',
+        'text/': '📄',
+        'application/zip': '📦',
+        'application/json': '🔧',
+    }
+    
+    # Check exact matches first
+    if mime_type in emoji_map:
+        return emoji_map[mime_type]
+    
+    # Check partial matches
+    for key, emoji in emoji_map.items():
+        if key.endswith('/') and mime_type.startswith(key):
+            return emoji
+    
+    # Default for unknown types
+    return '📄'
+
+# ==================== GMAIL TOOLS ====================
+@traced
+def strip_html_tags(html_content):
+    """Remove HTML tags and convert to clean text"""
+    if not html_content:
+        return ""
+    
+    # Remove HTML tags
+    clean = re.sub('<.*?>', '', html_content)
+    # Decode HTML entities
+    clean = unescape(clean)
+    # Clean up whitespace
+    clean = re.sub(r'\s+', ' ', clean).strip()
+    return clean
+
+def format_file_size(size_str):
+    """Format file size in human readable format"""
+    try:
+        size = int(size_str)
+        for unit in ['B', 'KB', 'MB', 'GB']:
+            if size < 1024:
+                return f"{size:.1f} {unit}"
+            size /= 1024
+        return f"{size:.1f} TB"
+    except:
+        return size_str
+
+@mcp.tool()
+def gmail_list_messages(max_results: int = 10, query: Optional[str] = None) -> str:
+    """List recent emails with clean, AI-friendly format"""
+    try:
+        params = {'userId': 'me', 'maxResults': max_results}
+        if query:
+            params['q'] = query
+        response = gmail_service.users().messages().list(**params).execute()
+        messages = response.get('messages', [])
+        
+        if not messages:
+            return "No messages found."
+        
+        # Get clean info for each message
+        message_list = []
+        for msg in messages:
+            try:
+                full_msg = gmail_service.users().messages().get(
+                    userId='me', id=msg['id'], format='metadata',
+                    metadataHeaders=['From', 'Subject', 'Date', 'To']
+                ).execute()
+                
+                headers = full_msg.get('payload', {}).get('headers', [])
+                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+                from_addr = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
+                to_addr = next((h['value'] for h in headers if h['name'] == 'To'), 'Unknown Recipient')
+                date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
+                
+                # Clean sender name (extract name from "Name <email>" format)
+                sender_clean = from_addr.split('<')[0].strip().strip('"') if '<' in from_addr else from_addr
+                
+                message_list.append(f"ID: {msg['id']}\nSubject: {subject}\nFrom: {sender_clean}\nTo: {to_addr}\nDate: {date}\n")
+                
+            except Exception as e:
+                message_list.append(f"ID: {msg['id']}\nError: Could not fetch details - {str(e)}\n")
+        
+        return "\n" + "="*50 + "\n".join(message_list)
+    
+    except HttpError as e:
+        return ErrorResult(f"Gmail API Error: {str(e)}")
+    except Exception as e:
+        return ErrorResult(f"Error listing messages: {str(e)}")
+
+@mcp.tool()
+def gmail_read_message(message_id: str, include_attachments_info: bool = True) -> str:
+    """Read email content in clean, AI-friendly format with optional attachment info"""
+    try:
+        message = gmail_service.users().messages().get(
+            userId='me', id=message_id, format='full'
+        ).execute()
+
+        # Extract headers
+        headers = message.get('payload', {}).get('headers', [])
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+        sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
+        recipient = next((h['value'] for h in headers if h['name'] == 'To'), 'Unknown Recipient')
+        date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
+        
+        # Clean sender name
+        sender_clean = sender.split('<')[0].strip().strip('"') if '<' in sender else sender
+        
+        # Extract body text
+        body = extract_email_body(message.get('payload', {}))
+        
+        # Format response
+        response = f"EMAIL DETAILS:\n"
+        response += f"Message ID: {message_id}\n"
+        response += f"Subject: {subject}\n"
+        response += f"From: {sender_clean}\n"
+        response += f"To: {recipient}\n"
+        response += f"Date: {date}\n\n"
+        response += f"BODY:\n{body}\n"
+        
+        # Add attachment info if requested
+        if include_attachments_info:
+            attachments = get_attachment_info(message.get('payload', {}))
+            if attachments:
+                response += f"\nATTACHMENTS ({len(attachments)}):\n"
+                for i, att in enumerate(attachments, 1):
+                    response += f"{i}. {att['filename']} ({att['size']}, {att['mime_type']})\n"
+            else:
+                response += "\nNo attachments found.\n"
+
+        return response
+
+    except HttpError as e:
+        return ErrorResult(f"Gmail API Error: {str(e)}")
+    except Exception as e:
+        return ErrorResult(f"Error reading message: {str(e)}")
+
+@traced
+def extract_email_body(payload):
+    """Extract clean text body from email payload"""
+    # Try to get plain text first
+    plain_text = extract_text_from_payload(payload, 'text/plain')
+    if plain_text:
+        return plain_text
+    
+    # Fall back to HTML and strip tags
+    html_text = extract_text_from_payload(payload, 'text/html')
+    if html_text:
+        return strip_html_tags(html_text)
+    
+    return "No readable text content found."
+
+def extract_text_from_payload(payload, mime_type):
+    """Recursively extract text of specific MIME type from payload"""
+    if payload.get('mimeType') == mime_type:
+        data = payload.get('body', {}).get('data')
+        if data:
+            try:
+                return base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
+            except:
+                return None
+
+    for part in payload.get('parts', []):
+        result = extract_text_from_payload(part, mime_type)
+        if result:
+            return result
+
+    return None
+
+def get_attachment_info(payload):
+    """Get basic attachment information without downloading"""
+    attachments = []
+    
+    def process_parts(parts):
+        for part in parts:
+            if 'parts' in part:
+                process_parts(part['parts'])
+            elif part.get('filename') and part['body'].get('attachmentId'):
+                attachments.append({
+                    'filename': part['filename'],
+                    'mime_type': part['mimeType'],
+                    'size': format_file_size(str(part['body'].get('size', 0))),
+                    'attachment_id': part['body']['attachmentId']
+                })
+    
+    if 'parts' in payload:
+        process_parts(payload['parts'])
+    
+    return attachments
+
+@mcp.tool()
+def gmail_read_attachments(
+    message_id: Optional[str] = None,
+    sender: Optional[str] = None,
+    subject_contains: Optional[str] = None,
+    days_back: int = 7,
+    max_results: int = 5,
+    max_attachment_size_mb: int = 10,
+    read_text_content: bool = True
+) -> str:
+    """
+    Efficiently read email attachments with flexible search options
+    
+    Args:
+        message_id: Specific email ID to read attachments from
+        sender: Filter by sender email/name  
+        subject_contains: Filter by subject keywords
+        days_back: How many days back to search (default: 7)
+        max_results: Max emails to process (default: 5)
+        max_attachment_size_mb: Max attachment size to process in MB
+        read_text_content: Whether to extract and preview text content
+    """
+    try:
+        # If specific message ID provided, process that email only
+        if message_id:
+            return process_single_email_attachments(message_id, max_attachment_size_mb, read_text_content)
+        
+        # Build search query for emails with attachments
+        query_parts = ["has:attachment"]
+        
+        # Add date filter
+        date_filter = datetime.now() - timedelta(days=days_back)
+        query_parts.append(f"after:{date_filter.strftime('%Y/%m/%d')}")
+        
+        # Add optional filters
+        if sender:
+            query_parts.append(f"from:({sender})")
+        if subject_contains:
+            query_parts.append(f'subject:"{subject_contains}"')
+        
+        search_query = " ".join(query_parts)
+        
+        # Search for messages
+        results = gmail_service.users().messages().list(
+            userId='me',
+            q=search_query,
+            maxResults=max_results
+        ).execute()
+        
+        messages = results.get('messages', [])
+        
+        if not messages:
+            return f"No emails with attachments found.\nSearch criteria: {search_query}"
+        
+        response = f"FOUND {len(messages)} EMAIL(S) WITH ATTACHMENTS\n"
+        response += f"Search Query: {search_query}\n\n"
+        
+        # Process each email
+        for i, message in enumerate(messages, 1):
+            report_progress(i - 1, len(messages), f"Scanning email {i} of {len(messages)}")
+            try:
+                email_response = process_single_email_attachments(
+                    message['id'], max_attachment_size_mb, read_text_content
+                )
+                response += f"EMAIL {i}:\n{email_response}\n"
+                response += "="*60 + "\n"
+                
+            except Exception as e:
+                response += f"EMAIL {i}: Error processing {message['id']} - {str(e)}\n"
+                continue
+        report_progress(len(messages), len(messages), "Scanned all emails")
+        
+        return response
+        
+    except Exception as e:
+        return ErrorResult(f"Error reading attachments: {str(e)}")
+
+def process_single_email_attachments(message_id: str, max_size_mb: int, read_content: bool) -> str:
+    """Process attachments from a single email"""
+    try:
+        # Get full message
+        message = gmail_service.users().messages().get(
+            userId='me', id=message_id, format='full'
+        ).execute()
+        
+        # Extract email metadata
+        headers = message['payload'].get('headers', [])
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+        sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
+        date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
+        
+        sender_clean = sender.split('<')[0].strip().strip('"') if '<' in sender else sender
+        
+        response = f"Subject: {subject}\n"
+        response += f"From: {sender_clean}\n"
+        response += f"Date: {date}\n"
+        response += f"Message ID: {message_id}\n\n"
+        
+        # Process attachments
+        attachments = extract_attachments_from_message(message_id, message['payload'], max_size_mb, read_content)
+        
+        if not attachments:
+            return response + "No attachments found in this email."
+        
+        response += f"ATTACHMENTS ({len(attachments)}):\n"
+        
+        for i, attachment in enumerate(attachments, 1):
+            response += f"\n{i}. {attachment['filename']}\n"
+            response += f"   Type: {attachment['mime_type']}\n"
+            response += f"   Size: {attachment['size']}\n"
+            response += f"   Status: {attachment['status']}\n"
+            
+            if attachment.get('content_preview'):
+                response += f"   Content Preview:\n   {attachment['content_preview'][:300]}...\n"
+        
+        return response
+        
+    except Exception as e:
+        return ErrorResult(f"Error processing email {message_id}: {str(e)}")
+
+def extract_attachments_from_message(message_id: str, payload: dict, max_size_mb: int, read_content: bool) -> List[Dict]:
+    """Extract and optionally read attachment content from message payload"""
+    attachments = []
+    
+    def process_parts(parts):
+        for part in parts:
+            if 'parts' in part:
+                process_parts(part['parts'])
+            elif part.get('filename') and part['body'].get('attachmentId'):
+                filename = part['filename']
+                mime_type = part['mimeType']
+                size_bytes = part['body'].get('size', 0)
+                attachment_id = part['body']['attachmentId']
+                
+                # Check size limit
+                size_mb = size_bytes / (1024 * 1024) if size_bytes else 0
+                
+                attachment_info = {
+                    'filename': filename,
+                    'mime_type': mime_type,
+                    'size': format_file_size(str(size_bytes)),
+                    'attachment_id': attachment_id
+                }
+                
+                if size_mb > max_size_mb:
+                    attachment_info['status'] = f'Skipped - too large ({size_mb:.1f}MB > {max_size_mb}MB)'
+                    attachment_info['content_preview'] = None
+                else:
+                    try:
+                        # Download attachment data
+                        attachment_data = gmail_service.users().messages().attachments().get(
+                            userId='me',
+                            messageId=message_id,
+                            id=attachment_id
+                        ).execute()
+                        
+                        file_data = base64.urlsafe_b64decode(attachment_data['data'])
+                        attachment_info['status'] = 'Successfully downloaded'
+                        
+                        # Extract content preview if requested
+                        if read_content:
+                            attachment_info['content_preview'] = extract_attachment_content(file_data, mime_type)
+                        else:
+                            attachment_info['content_preview'] = None
+                            
+                    except Exception as e:
+                        attachment_info['status'] = f'Download failed: {str(e)}'
+                        attachment_info['content_preview'] = None
+                
+                attachments.append(attachment_info)
+    
+    if 'parts' in payload:
+        process_parts(payload['parts'])
+    
+    return attachments
+
+@traced
+def extract_attachment_content(file_data: bytes, mime_type: str) -> str:
+    """Extract readable content from attachment based on MIME type"""
+    try:
+        if mime_type.startswith('text/'):
+            return file_data.decode('utf-8', errors='ignore')
+        
+        elif mime_type == 'application/json':
+            return file_data.decode('utf-8', errors='ignore')
+        
+        elif mime_type in ['application/xml', 'text/xml']:
+            return file_data.decode('utf-8', errors='ignore')
+        
+        elif mime_type == 'application/pdf':
+            # Basic PDF text extraction (you'd need PyPDF2 or similar for full extraction)
+            text = file_data.decode('utf-8', errors='ignore')
+            # Remove PDF binary parts and keep readable text
+            cleaned = re.sub(r'[^\x20-\x7E\n\r\t]', '', text)
+            return cleaned if cleaned.strip() else "PDF content (binary - use PDF reader)"
+        
+        else:
+            return f"Binary file ({mime_type}) - {len(file_data)} bytes"
+            
+    except Exception as e:
+        return f"Content extraction failed: {str(e)}"
+
+@mcp.tool()
+def gmail_search_and_summarize(
+    query: Optional[str] = None,
+    sender: Optional[str] = None, 
+    recipient: Optional[str] = None,
+    subject_contains: Optional[str] = None,
+    max_results: int = 10
+) -> str:
+    """Search emails with clean, summarized results"""
+    try:
+        # Build search query
+        search_parts = []
+        
+        if sender:
+            search_parts.append(f"from:({sender})")
+        if recipient:
+            search_parts.append(f"to:({recipient})")
+        if subject_contains:
+            search_parts.append(f"subject:({subject_contains})")
+        if query:
+            search_parts.append(f"({query})")
+            
+        gmail_query = " ".join(search_parts) if search_parts else "in:inbox"
+        
+        # Search messages
+        results = gmail_service.users().messages().list(
+            userId='me',
+            q=gmail_query,
+            maxResults=max_results
+        ).execute()
+        
+        messages = results.get('messages', [])
+        
+        if not messages:
+            return f"No emails found for query: {gmail_query}"
+        
+        response = f"SEARCH RESULTS ({len(messages)} emails):\n"
+        response += f"Query: {gmail_query}\n\n"
+        
+        # Process each message
+        for i, msg in enumerate(messages, 1):
+            try:
+                message = gmail_service.users().messages().get(
+                    userId='me', id=msg['id'], format='full'
+                ).execute()
+                
+                # Extract headers
+                headers = message['payload'].get('headers', [])
+                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+                sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
+                date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown')
+                
+                sender_clean = sender.split('<')[0].strip().strip('"') if '<' in sender else sender
+                
+                # Get body preview
+                body = extract_email_body(message['payload'])
+                body_preview = body[:200].replace('\n', ' ').strip() + "..." if len(body) > 200 else body
+                
+                response += f"{i}. {subject}\n"
+                response += f"   From: {sender_clean}\n"
+                response += f"   Date: {date}\n"
+                response += f"   Preview: {body_preview}\n"
+                response += f"   ID: {msg['id']}\n\n"
+                
+            except Exception as e:
+                response += f"{i}. Error processing email {msg['id']}: {str(e)}\n\n"
+        
+        return response
+        
+    except Exception as e:
+        return ErrorResult(f"Search error: {str(e)}")
+
+@mcp.tool()
+def gmail_send_message(to: str, subject: str, body: str) -> str:
+    """Send a simple email"""
+    try:
+        # Add service validation
+        if gmail_service is None:
+            return ErrorResult("Error: Gmail service not initialized. Please re-authenticate.")
+        
+        # Test the service connection first (the address is cached after the first lookup)
+        try:
+            from_email = get_sender_address()
+        except Exception as auth_error:
+            return ErrorResult(f"Error: Gmail authentication failed. Please re-authenticate. Details: {str(auth_error)}")
+        
+        msg = MIMEText(body)
+        msg['to'] = to
+        msg['from'] = from_email
+        msg['subject'] = subject
+        raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
+        
+        result = gmail_service.users().messages().send(
+            userId='me', body={'raw': raw}
+        ).execute()
+        
+        return f"Email sent successfully!\nMessage ID: {result['id']}\nTo: {to}\nSubject: {subject}"
+    
+    except Exception as e:
+        return ErrorResult(f"Error sending email: {str(e)}")
+
+
+@mcp.tool() 
+def gmail_list_labels() -> str:
+    """List Gmail labels in clean format"""
+    try:
+        response = gmail_service.users().labels().list(userId='me').execute()
+        labels = response.get('labels', [])
+        
+        if not labels:
+            return "No labels found."
+        
+        result = "GMAIL LABELS:\n"
+        for label in labels:
+            result += f"- {label['name']} (ID: {label['id']})\n"
+        
+        return result
+        
+    except Exception as e:
+        return ErrorResult(f"Error listing labels: {str(e)}")
+
+@mcp.tool()
+def gmail_modify_labels(
+    message_id: str,
+    add_labels: Optional[List[str]] = None,
+    remove_labels: Optional[List[str]] = None
+) -> str:
+    """Add or remove labels - returns simple confirmation"""
+    try:
+        add = add_labels or []
+        remove = remove_labels or []
+        body = {'addLabelIds': add, 'removeLabelIds': remove}
+        
+        gmail_service.users().messages().modify(
+            userId='me', id=message_id, body=body
+        ).execute()
+        
+        actions = []
+        if add:
+            actions.append(f"Added: {', '.join(add)}")
+        if remove:
+            actions.append(f"Removed: {', '.join(remove)}")
+        
+        return f"Labels updated for message {message_id}\n{' | '.join(actions)}"
+        
+    except Exception as e:
+        return ErrorResult(f"Error modifying labels: {str(e)}")
+
+@mcp.tool()
+def gmail_delete_message(message_id: str) -> str:
+    """Delete an email - returns simple confirmation"""
+    try:
+        gmail_service.users().messages().delete(userId='me', id=message_id).execute()
+        return f"Email {message_id} deleted successfully."
+    except Exception as e:
+        return ErrorResult(f"Error deleting email: {str(e)}")
+
+@mcp.tool()
+def gmail_send_with_drive_attachment(
+    to: str, subject: str, body: str, drive_file_id: str, 
+    share_with_recipient: bool = True
+) -> str:
+    """Send email with Google Drive file link"""
+    try:
+        # Get file info
+        file_metadata = drive_service.files().get(
+            fileId=drive_file_id, 
+            fields='name,webViewLink'
+        ).execute()
+        
+        file_name = file_metadata['name']
+        file_link = file_metadata['webViewLink']
+        
+        # Share file if requested
+        share_status = "not shared"
+        if share_with_recipient:
+            try:
+                permission = {
+                    'type': 'user',
+                    'role': 'reader', 
+                    'emailAddress': to
+                }
+                drive_service.permissions().create(
+                    fileId=drive_file_id,
+                    body=permission,
+                    sendNotificationEmail=False
+                ).execute()
+                share_status = "shared with recipient"
+            except Exception:
+                share_status = "sharing failed"
+        
+        # Enhanced email body
+        enhanced_body = f"{body}\n\n---\nAttached Google Drive File: {file_name}\nLink: {file_link}"
+        
+        # Send email
+        from_email = get_sender_address()
+        
+        msg = MIMEText(enhanced_body)
+        msg['to'] = to
+        msg['from'] = from_email
+        msg['subject'] = subject
+        raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
+        
+        result = gmail_service.users().messages().send(
+            userId='me', body={'raw': raw}
+        ).execute()
+        
+        return f"Email sent with Drive file!\nMessage ID: {result['id']}\nFile: {file_name} ({share_status})\nLink: {file_link}"
+    
+    except Exception as e:
+        return ErrorResult(f"Error sending email with Drive attachment: {str(e)}")
+
+@mcp.tool()
+def gmail_send_multiple_attachments(
+    to: str, subject: str, body: str, file_paths: List[str]
+) -> str:
+    """Send email with multiple file attachments"""
+    try:
+        # Check files exist
+        missing_files = [f for f in file_paths if not os.path.exists(f)]
+        if missing_files:
+            return ErrorResult(f"Files not found: {', '.join(missing_files)}")
+        
+        # Get sender info
+        from_email = get_sender_address()
+        
+        # Create multipart message
+        msg = MIMEMultipart()
+        msg['to'] = to
+        msg['from'] = from_email
+        msg['subject'] = subject
+        msg.attach(MIMEText(body, 'plain'))
+        
+        attached_files = []
+        total_size = 0
+        
+        # Attach files
+        for file_path in file_paths:
+            filename = os.path.basename(file_path)
+            file_size = os.path.getsize(file_path)
+            total_size += file_size
+            
+            with open(file_path, 'rb') as f:
+                file_data = f.read()
+            
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(file_data)
+            encoders.encode_base64(part)
+            part.add_header('Content-Disposition', f'attachment; filename= {filename}')
+            msg.attach(part)
+            
+            attached_files.append({'name': filename, 'size': format_file_size(str(file_size))})
+        
+        # Send email
+        raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
+        result = gmail_service.users().messages().send(userId='me', body={'raw': raw}).execute()
+        
+        files_info = ", ".join([f"{f['name']} ({f['size']})" for f in attached_files])
+        return f"Email sent with {len(attached_files)} attachments!\nMessage ID: {result['id']}\nFiles: {files_info}\nTotal Size: {format_file_size(str(total_size))}"
+        
+    except Exception as e:
+        return ErrorResult(f"Error sending email with attachments: {str(e)}")
+
+def compile_merge_template(template: str) -> List[tuple]:
+    """Parse a {field} template once so rendering each recipient is just a join"""
+    return list(string.Formatter().parse(template))
+
+def render_merge_template(parts: List[tuple], record: Dict[str, Any]) -> str:
+    """Render a compiled template for one recipient record"""
+    rendered = []
+    for literal, field, format_spec, _ in parts:
+        rendered.append(literal)
+        if field is None:
+            continue
+        if field not in record:
+            raise KeyError(field or '{}')
+        value = record[field]
+        rendered.append(format(value, format_spec) if format_spec else str(value))
+    return ''.join(rendered)
+
+def load_merge_checkpoint(checkpoint_path: str) -> Dict[str, str]:
+    """Read the recipients already sent by a previous run: {recipient_key: message_id}"""
+    sent = {}
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    sent[entry['key']] = entry['message_id']
+                except (ValueError, KeyError):
+                    continue  # torn final line from an interrupted run
+    return sent
+
+@mcp.tool()
+def gmail_mail_merge(
+    subject_template: str,
+    body_template: str,
+    recipients: List[Dict[str, Any]],
+    email_field: str = "email",
+    html: bool = False,
+    max_per_second: float = 2.0,
+    concurrency: int = 4,
+    merge_id: Optional[str] = None,
+    dry_run: bool = False
+) -> str:
+    """
+    Send personalized emails to many recipients in one call (mail merge)
+
+    Args:
+        subject_template: Subject with {field} placeholders, e.g. 'Invoice {invoice_no}'
+        body_template: Body with {field} placeholders filled from each recipient record
+        recipients: List of recipient records, e.g. [{'email': 'a@b.com', 'name': 'Ann'}]
+        email_field: Record field holding the recipient address (default: 'email')
+        html: Whether the body template is HTML
+        max_per_second: Send rate limit (default 2/s, under Gmail's per-user send quota)
+        concurrency: Number of sends in flight at once (max 10)
+        merge_id: Checkpoint id. Re-running with the same id skips recipients already sent
+        dry_run: Render and validate every message without sending
+    """
+    try:
+        if gmail_service is None:
+            return ErrorResult("Error: Gmail service not initialized. Please re-authenticate.")
+        if not recipients:
+            return ErrorResult("No recipients provided.")
+
+        subject_parts = compile_merge_template(subject_template)
+        body_parts = compile_merge_template(body_template)
+
+        # Stable keys let a re-run recognise recipients that were already sent
+        keys = [hashlib.sha1(json.dumps(r, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+                for r in recipients]
+        if not merge_id:
+            digest = hashlib.sha1((subject_template + '\0' + body_template + '\0' + ''.join(keys)).encode('utf-8'))
+            merge_id = digest.hexdigest()[:12]
+        checkpoint_name = re.sub(r'[^\w-]', '_', merge_id)
+        checkpoint_path = os.path.join(get_state_dir('mail_merge', user_state_name(current_user_id())),
+                                       f"{checkpoint_name}.jsonl")
+        already_sent = load_merge_checkpoint(checkpoint_path)
+
+        from_email = None if dry_run else get_sender_address()
+        limiter = RateLimiter(max_per_second, burst=max(1, int(max_per_second)))
+        checkpoint_lock = threading.Lock()
+        results = [None] * len(recipients)
+        pending = []
+
+        # Render everything locally first so template errors never cost an API call
+        for i, record in enumerate(recipients):
+            to = str(record.get(email_field, '')).strip()
+            if not to:
+                results[i] = (to or '-', 'invalid', f"missing '{email_field}'")
+            elif keys[i] in already_sent:
+                results[i] = (to, 'skipped', f"already sent ({already_sent[keys[i]]})")
+            else:
+                try:
+                    subject = render_merge_template(subject_parts, record)
+                    body = render_merge_template(body_parts, record)
+                except KeyError as e:
+                    results[i] = (to, 'invalid', f"missing field {e}")
+                    continue
+                except (ValueError, TypeError) as e:
+                    results[i] = (to, 'invalid', str(e))
+                    continue
+                if dry_run:
+                    results[i] = (to, 'rendered', subject)
+                else:
+                    pending.append((i, to, subject, body))
+
+        def send_one(i, to, subject, body):
+            msg = MIMEText(body, 'html' if html else 'plain')
+            msg['to'] = to
+            msg['from'] = from_email
+            msg['subject'] = subject
+            raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
+            limiter.acquire()
+            # No automatic retries: a send that timed out may have gone out, and a retry would
+            # deliver it twice. Failures are reported and retried by re-running with merge_id.
+            sent = gmail_service.users().messages().send(
+                userId='me', body={'raw': raw}
+            ).execute()
+            with checkpoint_lock:
+                with open(checkpoint_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'key': keys[i], 'to': to, 'message_id': sent['id']}) + "\n")
+            return sent['id']
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, min(concurrency, 10))) as pool:
+                futures = {pool.submit(contextvars.copy_context().run, send_one, *item): item for item in pending}
+                for done, future in enumerate(as_completed(futures), 1):
+                    i, to = futures[future][:2]
+                    try:
+                        results[i] = (to, 'sent', future.result())
+                    except Exception as e:
+                        results[i] = (to, 'failed', str(e))
+                    report_progress(done, len(pending), f"Processed {done} of {len(pending)} recipients")
+
+        counts = {}
+        for _, status, _ in results:
+            counts[status] = counts.get(status, 0) + 1
+        summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+
+        width = min(max(len(r[0]) for r in results), 40)
+        response = f"MAIL MERGE {merge_id}{' (dry run)' if dry_run else ''}: {summary}\n\n"
+        response += f"{'#':>4} | {'To':<{width}} | {'Status':<8} | Detail\n"
+        for i, (to, status, detail) in enumerate(results, 1):
+            detail = detail if len(detail) <= 60 else detail[:57] + "..."
+            response += f"{i:>4} | {to[:width]:<{width}} | {status:<8} | {detail}\n"
+        if counts.get('failed'):
+            response += f"\nRe-run with merge_id='{merge_id}' to retry failed recipients; sent ones are skipped."
+
+        return response
+
+    except Exception as e:
+        return ErrorResult(f"Error running mail merge: {str(e)}")
+# ==================== GOOGLE CALENDAR TOOLS ====================
+
+# How stale the local event store may get before a read triggers an incremental sync
+CALENDAR_SYNC_MAX_AGE = float(os.getenv("CALENDAR_SYNC_MAX_AGE", "30"))
+
+def parse_event_time(value: Dict[str, str], default_tz: Optional[str] = None) -> float:
+    """Convert a Calendar start/end object ({dateTime} or all-day {date}) to a UTC timestamp"""
+    if value.get('dateTime'):
+        return datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00')).timestamp()
+    tz = ZoneInfo(value.get('timeZone') or default_tz or 'UTC')
+    return datetime.fromisoformat(value['date']).replace(tzinfo=tz).timestamp()
+
+def parse_rfc3339(value: str) -> float:
+    """Convert an RFC3339 timestamp to a UTC timestamp (naive values are treated as UTC)"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+class CalendarEventStore:
+    """Local SQLite copy of all of a user's calendars, kept current with syncToken.
+
+    A full sync runs once per calendar; afterwards each sync only transfers the
+    events that changed, and listing/range queries are answered from disk.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS calendars (
+            id TEXT PRIMARY KEY, summary TEXT, is_primary INTEGER, time_zone TEXT, sync_token TEXT
+        );
+        CREATE TABLE IF NOT EXISTS events (
+            calendar_id TEXT, event_id TEXT, start_ts REAL, end_ts REAL, summary TEXT, data TEXT,
+            search_text TEXT, PRIMARY KEY (calendar_id, event_id)
+        );
+        CREATE INDEX IF NOT EXISTS events_by_start ON events (start_ts);
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(self.SCHEMA)
+        self.lock = threading.RLock()
+        self.last_sync = 0.0
+        self._migrate()
+
+    def _migrate(self):
+        """Add and backfill the search_text column in stores created before it existed"""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(events)")}
+        if 'search_text' in columns:
+            return
+        with self.conn:
+            self.conn.execute("ALTER TABLE events ADD COLUMN search_text TEXT")
+            rows = self.conn.execute("SELECT calendar_id, event_id, data FROM events").fetchall()
+            self.conn.executemany(
+                "UPDATE events SET search_text = ? WHERE calendar_id = ? AND event_id = ?",
+                [(self.search_text(json.loads(data)), cal_id, event_id) for cal_id, event_id, data in rows]
+            )
+
+    @staticmethod
+    def search_text(event: Dict[str, Any]) -> str:
+        """Casefolded title, description and location, the fields query(text=...) matches"""
+        return "\n".join(event.get(field) or '' for field in ('summary', 'description', 'location')).casefold()
+
+    def _store_event(self, calendar_id: str, event: Dict[str, Any], start_ts: float, end_ts: float):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO events (calendar_id, event_id, start_ts, end_ts, summary, data, search_text) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (calendar_id, event['id'], start_ts, end_ts, event.get('summary', ''),
+             json.dumps(event, ensure_ascii=False), self.search_text(event))
+        )
+
+    def mark_stale(self):
+        """Force the next read to sync (called after this toolkit writes to the calendar)"""
+        self.last_sync = 0.0
+
+    def ensure_fresh(self, max_age: float = CALENDAR_SYNC_MAX_AGE):
+        if time.time() - self.last_sync <= max_age:
+            return
+        with self.lock:
+            # Callers that queued here behind another sync find the store fresh now
+            if time.time() - self.last_sync > max_age:
+                self.sync()
+
+    def sync(self, full: bool = False) -> Dict[str, int]:
+        """Sync the calendar list and every calendar's events; returns change counts"""
+        with self.lock:
+            stats = {'calendars': 0, 'changed': 0, 'deleted': 0, 'full_syncs': 0}
+            calendars = []
+            page_token = None
+            while True:
+                page = calendar_service.calendarList().list(pageToken=page_token).execute()
+                calendars.extend(page.get('items', []))
+                page_token = page.get('nextPageToken')
+                if not page_token:
+                    break
+
+            known = {row[0]: row[1] for row in self.conn.execute("SELECT id, sync_token FROM calendars")}
+            current_ids = {cal['id'] for cal in calendars}
+            with self.conn:
+                for cal_id in set(known) - current_ids:
+                    self.conn.execute("DELETE FROM calendars WHERE id = ?", (cal_id,))
+                    self.conn.execute("DELETE FROM events WHERE calendar_id = ?", (cal_id,))
+                for cal in calendars:
+                    self.conn.execute(
+                        "INSERT INTO calendars (id, summary, is_primary, time_zone) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(id) DO UPDATE SET summary = excluded.summary, "
+                        "is_primary = excluded.is_primary, time_zone = excluded.time_zone",
+                        (cal['id'], cal.get('summary', cal['id']), 1 if cal.get('primary') else 0, cal.get('timeZone'))
+                    )
+
+            for cal in calendars:
+                sync_token = None if full else known.get(cal['id'])
+                changed, deleted = self._sync_calendar(cal['id'], cal.get('timeZone'), sync_token)
+                stats['calendars'] += 1
+                stats['changed'] += changed
+                stats['deleted'] += deleted
+                if not sync_token:
+                    stats['full_syncs'] += 1
+
+            self.last_sync = time.time()
+            return stats
+
+    def _sync_calendar(self, calendar_id: str, time_zone: Optional[str], sync_token: Optional[str]):
+        params = {'calendarId': calendar_id, 'singleEvents': True, 'maxResults': 2500}
+        if sync_token:
+            params['syncToken'] = sync_token
+        changed = deleted = 0
+        page_token = None
+        with self.conn:
+            if not sync_token:
+                self.conn.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+            while True:
+                try:
+                    page = calendar_service.events().list(pageToken=page_token, **params).execute()
+                except HttpError as e:
+                    if e.resp.status == 410 and sync_token:
+                        # Token expired server-side: fall back to a full sync of this calendar
+                        self.conn.rollback()
+                        return self._sync_calendar(calendar_id, time_zone, None)
+                    raise
+                for event in page.get('items', []):
+                    if event.get('status') == 'cancelled':
+                        self.conn.execute("DELETE FROM events WHERE calendar_id = ? AND event_id = ?",
+                                          (calendar_id, event['id']))
+                        deleted += 1
+                        continue
+                    try:
+                        start_ts = parse_event_time(event['start'], time_zone)
+                        end_ts = parse_event_time(event.get('end', event['start']), time_zone)
+                    except (KeyError, ValueError):
+                        continue
+                    self._store_event(calendar_id, event, start_ts, end_ts)
+                    changed += 1
+                page_token = page.get('nextPageToken')
+                if not page_token:
+                    self.conn.execute("UPDATE calendars SET sync_token = ? WHERE id = ?",
+                                      (page.get('nextSyncToken'), calendar_id))
+                    break
+        return changed, deleted
+
+    def query(self, time_min: float, time_max: float, calendar_ids: Optional[List[str]] = None,
+              text: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Return events overlapping [time_min, time_max), ordered by start time"""
+        sql = "SELECT calendar_id, data FROM events WHERE start_ts < ? AND end_ts > ?"
+        args = [time_max, time_min]
+        if calendar_ids:
+            sql += f" AND calendar_id IN ({','.join('?' * len(calendar_ids))})"
+            args.extend(calendar_ids)
+        if text:
+            # instr rather than LIKE: no wildcard escaping, and casefold() handles non-ASCII text
+            sql += " AND instr(search_text, ?) > 0"
+            args.append(text.casefold())
+        sql += " ORDER BY start_ts LIMIT ?"
+        args.append(limit)
+        with self.lock:
+            rows = self.conn.execute(sql, args).fetchall()
+        events = []
+        for calendar_id, data in rows:
+            event = json.loads(data)
+            event['calendarId'] = calendar_id
+            events.append(event)
+        return events
+
+    def get_event(self, event_id: str, calendar_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Look up a single stored event (primary calendar unless calendar_id is given)"""
+        cal_id = self.resolve_calendar_id(calendar_id)
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM events WHERE calendar_id = ? AND event_id = ?",
+                                    (cal_id, event_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_event(self, event: Dict[str, Any], calendar_id: Optional[str] = None):
+        """Store an event returned by a write, so its new ETag is known without a re-read"""
+        cal_id = self.resolve_calendar_id(calendar_id)
+        if cal_id is None:
+            # Never synced, so the primary calendar's id is unknown; the first sync will pick the event up
+            return
+        try:
+            start_ts = parse_event_time(event['start'])
+            end_ts = parse_event_time(event.get('end', event['start']))
+        except (KeyError, ValueError):
+            return
+        with self.lock, self.conn:
+            self._store_event(cal_id, event, start_ts, end_ts)
+
+    def resolve_calendar_id(self, calendar_id: Optional[str]) -> Optional[str]:
+        if calendar_id in (None, 'primary'):
+            return self.primary_calendar_id()
+        return calendar_id
+
+    def primary_calendar_id(self) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT id FROM calendars WHERE is_primary = 1").fetchone()
+        return row[0] if row else None
+
+    def calendar_names(self) -> Dict[str, str]:
+        with self.lock:
+            return {row[0]: row[1] for row in self.conn.execute("SELECT id, summary FROM calendars")}
+
+_calendar_stores = {}
+_calendar_stores_lock = threading.Lock()
+
+def get_calendar_store() -> CalendarEventStore:
+    """Get the current user's local calendar event store"""
+    user_id = current_user_id()
+    with _calendar_stores_lock:
+        store = _calendar_stores.get(user_id)
+        if store is None:
+            path = os.path.join(get_state_dir('calendar'), f"{user_state_name(user_id)}.sqlite3")
+            store = _calendar_stores[user_id] = CalendarEventStore(path)
+        return store
+
+def mark_calendar_store_stale():
+    """Make the next local-store read sync first, so the toolkit's own writes show up"""
+    store = _calendar_stores.get(current_user_id())
+    if store is not None:
+        store.mark_stale()
+
+@mcp.tool()
+def calendar_sync(full_resync: bool = False) -> str:
+    """Sync all of the user's calendars into the local event store
+    
+    Args:
+        full_resync: Discard sync tokens and re-download every event (default: incremental)
+    """
+    try:
+        stats = get_calendar_store().sync(full=full_resync)
+        return (f"Calendar sync complete: {stats['calendars']} calendars, "
+                f"{stats['changed']} events added/updated, {stats['deleted']} removed "
+                f"({stats['full_syncs']} full syncs)")
+    except Exception as e:
+        return ErrorResult(f"Error syncing calendars: {str(e)}")
+
+@mcp.tool()
+def calendar_list_events(timeMin: str, timeMax: str, maxResults: int = 10,
+                         all_calendars: bool = False, calendar_id: Optional[str] = None,
+                         query: Optional[str] = None) -> str:
+    """List upcoming calendar events within a time range
+    
+    Args:
+        timeMin: RFC3339 timestamp for start of range (e.g., '2024-01-01T00:00:00Z')
+        timeMax: RFC3339 timestamp for end of range (e.g., '2024-01-31T23:59:59Z') 
+        maxResults: Maximum number of events to return (default: 10)
+        all_calendars: Include events from all of the user's calendars, not just primary
+        calendar_id: Only list events from this calendar
+        query: Only include events whose title, description or location contains this text
+    """
+    try:
+        # Answered from the local store; an incremental sync keeps it current
+        store = get_calendar_store()
+        store.ensure_fresh()
+
+        if calendar_id:
+            calendar_ids = [calendar_id]
+        elif all_calendars:
+            calendar_ids = None
+        else:
+            calendar_ids = [store.primary_calendar_id() or 'primary']
+
+        events = store.query(parse_rfc3339(timeMin), parse_rfc3339(timeMax), calendar_ids, query, maxResults)
+
+        if not events:
+            return "No upcoming events found."
+
+        names = store.calendar_names() if calendar_ids is None else {}
+        event_list = []
+        for event in events:
+            start = event['start'].get('dateTime', event['start'].get('date'))
+            location = event.get('location', 'No location')
+            description = event.get('description', 'No description')
+            event_id = event.get('id', 'No ID')
+            
+            event_info = f"ID: {event_id}\nTitle: {event.get('summary', '(No title)')}\nTime: {start}\nLocation: {location}\nDescription: {description[:100]}{'...' if len(description) > 100 else ''}"
+            if names:
+                event_info += f"\nCalendar: {names.get(event['calendarId'], event['calendarId'])}"
+            event_list.append(event_info)
+
+        return f"Found {len(events)} events:\n\n" + "\n\n---\n\n".join(event_list)
+
+    except Exception as e:
+        return ErrorResult(f"Error listing events: {str(e)}")
+
+def build_event_time(value: str, time_zone: str) -> Dict[str, str]:
+    """Build a Calendar start/end object from an RFC3339 time or an all-day YYYY-MM-DD date"""
+    if len(value) == 10:
+        return {'date': value}
+    return {'dateTime': value, 'timeZone': time_zone}
+
+@mcp.tool()
+def calendar_create_event_with_invitations(
+    summary: str,
+    startTime: str, 
+    endTime: str,
+    attendees: Optional[List[str]] = None,
+    location: Optional[str] = None,
+    description: Optional[str] = None,
+    send_invitations: bool = True,
+    timeZone: str = "UTC"
+) -> str:
+    """
+    Create a calendar event and automatically send invitations to attendees.
+    
+    Args:
+        summary: Event title
+        startTime: RFC3339 start time (e.g., '2024-01-15T10:00:00Z'), or YYYY-MM-DD for an all-day event
+        endTime: RFC3339 end time (e.g., '2024-01-15T11:00:00Z'), or YYYY-MM-DD (exclusive) for an all-day event
+        attendees: List of attendee emails
+        location: Event location (optional)
+        description: Event description (optional)
+        send_invitations: Whether to send email invitations (default: True)
+        timeZone: IANA time zone of the event (default: 'UTC')
+    """
+    try:
+        # Prepare event data
+        event_data = {
+            'summary': summary,
+            'start': build_event_time(startTime, timeZone),
+            'end': build_event_time(endTime, timeZone),
+        }
+        
+        # Add optional fields
+        if location:
+            event_data['location'] = location
+        if description:
+            event_data['description'] = description
+            
+        # Add attendees if provided
+        if attendees:
+            event_data['attendees'] = [{'email': email} for email in attendees]
+        
+        # Create the calendar event
+        event = calendar_service.events().insert(
+            calendarId='primary', 
+            body=event_data,
+            sendUpdates='all' if send_invitations and attendees else 'none'
+        ).execute()
+        mark_calendar_store_stale()
+        
+        event_id = event['id']
+        event_link = event.get('htmlLink', '')
+        
+        response = f"Calendar event created successfully!\n"
+        response += f"Event ID: {event_id}\n"
+        response += f"Title: {summary}\n"
+        response += f"Start: {startTime}\n"
+        response += f"End: {endTime}\n"
+        
+        if location:
+            response += f"Location: {location}\n"
+        if description:
+            response += f"Description: {description}\n"
+        if event_link:
+            response += f"Event Link: {event_link}\n"
+            
+        # If attendees were added and invitations should be sent
+        if attendees and send_invitations:
+            response += f"\nInvitations sent to {len(attendees)} attendees:\n"
+            for email in attendees:
+                response += f"- {email}\n"
+                
+            response += f"\nNote: Calendar invitations have been automatically sent via Google Calendar."
+        elif attendees and not send_invitations:
+            response += f"\nAttendees added (no invitations sent):\n"
+            for email in attendees:
+                response += f"- {email}\n"
+        
+        return response
+        
+    except Exception as e:
+        return ErrorResult(f"Error creating calendar event: {str(e)}")
+
+# Calendar batch requests accept at most 50 calls
+CALENDAR_BATCH_SIZE = 50
+ICS_DURATION_RE = re.compile(r'^P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+ICS_ESCAPE_RE = re.compile(r'\\([\\;,nN])')
+
+def unfold_ics_lines(lines):
+    """Yield logical .ics lines, joining RFC 5545 folded continuation lines"""
+    current = None
+    for raw in lines:
+        line = raw.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+        else:
+            if current:
+                yield current
+            current = line
+    if current:
+        yield current
+
+def parse_ics_property(line: str):
+    """Split 'NAME;PARAM=x:value' into (name, params, value), honouring quoted params"""
+    in_quotes = False
+    for i, ch in enumerate(line):
+        if ch == '"':
+            in_quotes = not in_quotes
+        elif ch == ':' and not in_quotes:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        return None
+    name, *raw_params = head.split(';')
+    params = {}
+    for param in raw_params:
+        key, _, val = param.partition('=')
+        params[key.upper()] = val.strip('"')
+    return name.upper(), params, value
+
+def iter_ics_events(lines):
+    """Incrementally parse VEVENT components from an iterable of .ics lines.
+
+    Yields one {NAME: [(params, value, raw_line), ...]} dict per event, so a large
+    calendar file is never held in memory at once.
+    """
+    event = None
+    nested = 0  # components inside a VEVENT, e.g. VALARM
+    for line in unfold_ics_lines(lines):
+        upper = line.upper()
+        if upper == 'BEGIN:VEVENT':
+            event, nested = {}, 0
+        elif event is None:
+            continue
+        elif upper.startswith('BEGIN:'):
+            nested += 1
+        elif upper.startswith('END:'):
+            if nested:
+                nested -= 1
+            elif upper == 'END:VEVENT':
+                yield event
+                event = None
+        elif not nested:
+            prop = parse_ics_property(line)
+            if prop:
+                event.setdefault(prop[0], []).append((prop[1], prop[2], line))
+
+def ics_time_to_event_time(params: Dict[str, str], value: str, default_tz: str):
+    """Convert an ICS DTSTART/DTEND into (Calendar time object, naive datetime, is_all_day)"""
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        day = datetime.strptime(value[:8], '%Y%m%d')
+        return {'date': day.strftime('%Y-%m-%d')}, day, True
+    moment = datetime.strptime(value.rstrip('Z')[:15], '%Y%m%dT%H%M%S')
+    if value.endswith('Z'):
+        return {'dateTime': moment.strftime('%Y-%m-%dT%H:%M:%SZ'), 'timeZone': 'UTC'}, moment, False
+    # TZID-qualified or floating local time
+    return {'dateTime': moment.strftime('%Y-%m-%dT%H:%M:%S'), 'timeZone': params.get('TZID', default_tz)}, moment, False
+
+def ics_event_to_body(props: Dict[str, list], default_tz: str):
+    """Convert a parsed VEVENT into (Calendar event body, idempotency key)"""
+    def text(name):
+        if name not in props:
+            return None
+        return ICS_ESCAPE_RE.sub(lambda m: '\n' if m.group(1) in 'nN' else m.group(1), props[name][0][1])
+
+    start_params, start_value, _ = props['DTSTART'][0]
+    start, start_dt, all_day = ics_time_to_event_time(start_params, start_value, default_tz)
+    if 'DTEND' in props:
+        end, _, _ = ics_time_to_event_time(props['DTEND'][0][0], props['DTEND'][0][1], default_tz)
+    else:
+        match = ICS_DURATION_RE.match(props['DURATION'][0][1]) if 'DURATION' in props else None
+        if match:
+            weeks, days, hours, minutes, seconds = (int(g or 0) for g in match.groups())
+            delta = timedelta(weeks=weeks, days=days, hours=hours, minutes=minutes, seconds=seconds)
+        else:
+            delta = timedelta(days=1) if all_day else timedelta(0)
+        end_dt = start_dt + delta
+        if all_day:
+            end = {'date': end_dt.strftime('%Y-%m-%d')}
+        else:
+            end = dict(start, dateTime=end_dt.strftime('%Y-%m-%dT%H:%M:%S') + ('Z' if start_value.endswith('Z') else ''))
+
+    body = {'summary': text('SUMMARY') or '(No title)', 'start': start, 'end': end}
+    for ics_name, field in (('DESCRIPTION', 'description'), ('LOCATION', 'location')):
+        value = text(ics_name)
+        if value:
+            body[field] = value
+    recurrence = [raw for name in ('RRULE', 'EXDATE', 'RDATE') for _, _, raw in props.get(name, [])]
+    if recurrence:
+        body['recurrence'] = recurrence
+    attendees = [value.split(':', 1)[1] if value.lower().startswith('mailto:') else value
+                 for _, value, _ in props.get('ATTENDEE', [])]
+    if attendees:
+        body['attendees'] = [{'email': email} for email in attendees]
+
+    key = text('UID') or json.dumps([body['summary'], start, end], sort_keys=True)
+    if 'RECURRENCE-ID' in props:
+        key += '/' + props['RECURRENCE-ID'][0][1]
+    return body, key
+
+def iter_bulk_event_bodies(events: Optional[List[Dict[str, Any]]], ics_file_path: Optional[str], time_zone: str):
+    """Yield (label, event body or None, idempotency key or error) from a list and/or an .ics file"""
+    for i, item in enumerate(events or [], 1):
+        try:
+            tz = item.get('timeZone', time_zone)
+            body = {
+                'summary': item['summary'],
+                'start': build_event_time(item['startTime'], tz),
+                'end': build_event_time(item['endTime'], tz),
+            }
+            for field in ('location', 'description', 'recurrence'):
+                if item.get(field):
+                    body[field] = item[field]
+            if item.get('attendees'):
+                body['attendees'] = [{'email': email} for email in item['attendees']]
+            key = item.get('idempotency_key') or json.dumps([body['summary'], body['start'], body['end']], sort_keys=True)
+            yield item['summary'], body, key
+        except KeyError as e:
+            yield f"event {i}", None, f"missing field {e}"
+
+    if ics_file_path:
+        with open(ics_file_path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+            for i, props in enumerate(iter_ics_events(f), 1):
+                try:
+                    body, key = ics_event_to_body(props, time_zone)
+                    yield body['summary'], body, key
+                except (KeyError, ValueError, IndexError) as e:
+                    yield f"VEVENT {i}", None, f"unparseable event: {e}"
+
+def is_retryable_http_error(error: Exception) -> bool:
+    """True for rate-limit and transient server errors worth retrying"""
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    return status == 429 or status >= 500 or (status == 403 and b'ateLimitExceeded' in (error.content or b''))
+
+def execute_calendar_batch(calls: Dict[str, Any], max_attempts: int = 3) -> Dict[str, tuple]:
+    """Run {request_id: HttpRequest} through Calendar batch requests.
+
+    Rate-limited or failed-transiently calls are retried with backoff; returns
+    {request_id: (response, exception)}.
+    """
+    outcomes = {}
+
+    def callback(request_id, response, exception):
+        outcomes[request_id] = (response, exception)
+
+    pending = dict(calls)
+    for attempt in range(max_attempts):
+        batch = calendar_service.new_batch_http_request(callback=callback)
+        for request_id, request in pending.items():
+            batch.add(request, request_id=request_id)
+        batch.execute()
+        pending = {rid: req for rid, req in pending.items() if is_retryable_http_error(outcomes[rid][1])}
+        if not pending:
+            break
+        cancellable_sleep(2 ** attempt + random.random())
+    return outcomes
+
+@mcp.tool()
+def calendar_bulk_create_events(
+    events: Optional[List[Dict[str, Any]]] = None,
+    ics_file_path: Optional[str] = None,
+    calendar_id: str = "primary",
+    time_zone: str = "UTC",
+    send_updates: str = "none"
+) -> str:
+    """
+    Create many calendar events at once from a list and/or an .ics file (batched inserts).
+
+    Each event gets a deterministic ID derived from its idempotency key (or ICS UID),
+    so re-running an import skips events that were already created.
+
+    Args:
+        events: List of events: {'summary', 'startTime', 'endTime', optional 'attendees', 'location',
+                'description', 'recurrence', 'timeZone', 'idempotency_key'}
+        ics_file_path: Path to an .ics file to import (parsed incrementally)
+        calendar_id: Target calendar (default: 'primary')
+        time_zone: Default IANA time zone for events without one (default: 'UTC')
+        send_updates: Invitation emails: 'all', 'externalOnly' or 'none' (default: 'none')
+    """
+    try:
+        if send_updates not in ('all', 'externalOnly', 'none'):
+            return ErrorResult("Error importing events: send_updates must be 'all', 'externalOnly' or 'none'")
+        if not events and not ics_file_path:
+            return ErrorResult("Error importing events: provide events and/or ics_file_path")
+        if ics_file_path and not os.path.exists(ics_file_path):
+            return ErrorResult(f"Error: File not found at {ics_file_path}")
+
+        rows = []  # (label, start, status, detail)
+
+        def flush(chunk):
+            calls = {}
+            for row_index, body in chunk:
+                calls[str(row_index)] = calendar_service.events().insert(
+                    calendarId=calendar_id, body=body, sendUpdates=send_updates
+                )
+            for request_id, (response, error) in execute_calendar_batch(calls).items():
+                label, start, _, _ = rows[int(request_id)]
+                if error is None:
+                    rows[int(request_id)] = (label, start, 'created', response.get('id', ''))
+                elif isinstance(error, HttpError) and error.resp.status == 409:
+                    rows[int(request_id)] = (label, start, 'exists', 'already imported')
+                else:
+                    rows[int(request_id)] = (label, start, 'failed', str(error))
+            report_progress(len(rows), None, f"Imported {len(rows)} events")
+
+        chunk = []
+        for label, body, key in iter_bulk_event_bodies(events, ics_file_path, time_zone):
+            if body is None:
+                rows.append((label, '-', 'invalid', key))
+                continue
+            # Calendar event IDs may use base32hex characters, which include all hex digits
+            body['id'] = hashlib.sha1(f"{calendar_id}\0{key}".encode('utf-8')).hexdigest()
+            start = body['start'].get('dateTime', body['start'].get('date'))
+            rows.append((label, start, 'pending', ''))
+            chunk.append((len(rows) - 1, body))
+            if len(chunk) == CALENDAR_BATCH_SIZE:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+        mark_calendar_store_stale()
+
+        if not rows:
+            return "No events found to import."
+
+        counts = {}
+        for row in rows:
+            counts[row[2]] = counts.get(row[2], 0) + 1
+        summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+        response = f"BULK EVENT IMPORT into '{calendar_id}': {summary}\n\n"
+        response += f"{'#':>4} | {'Status':<8} | {'Start':<20} | Title / detail\n"
+        for i, (label, start, status, detail) in enumerate(rows, 1):
+            detail = detail if len(detail) <= 60 else detail[:57] + "..."
+            response += f"{i:>4} | {status:<8} | {start[:20]:<20} | {label[:40]} - {detail}\n"
+        return response
+
+    except Exception as e:
+        return ErrorResult(f"Error importing events: {str(e)}")
+
+@mcp.tool()
+def calendar_get_availability(timeMin: str, timeMax: str) -> str:
+    """Get free/busy information for primary calendar
+    
+    Args:
+        timeMin: RFC3339 timestamp for start of range
+        timeMax: RFC3339 timestamp for end of range
+    """
+    try:
+        body = {
+            "timeMin": timeMin,
+            "timeMax": timeMax,
+            "items": [{"id": "primary"}]
+        }
+
+        busy_info = calendar_service.freebusy().query(body=body).execute()
+        busy_times = busy_info.get("calendars", {}).get("primary", {}).get("busy", [])
+
+        if not busy_times:
+            return f"No busy times found between {timeMin} and {timeMax}\nYou appear to be free during this entire period!"
+        else:
+            busy_list = []
+            for busy_period in busy_times:
+                start = busy_period.get("start")
+                end = busy_period.get("end")
+                busy_list.append(f"- Busy from {start} to {end}")
+
+            return f"Busy periods between {timeMin} and {timeMax}:\n\n" + "\n".join(busy_list)
+
+    except Exception as e:
+        return ErrorResult(f"Error getting availability: {str(e)}")
+
+# freebusy.query accepts at most 50 calendars per request; long ranges are split too
+FREEBUSY_MAX_CALENDARS = 50
+FREEBUSY_MAX_DAYS = 30
+
+def merge_intervals(intervals: List[tuple], pad: float = 0) -> List[tuple]:
+    """Sort and merge overlapping (start, end) intervals, widening each by pad on both sides"""
+    merged = []
+    for start, end in sorted((s - pad, e + pad) for s, e in intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def working_windows(start_ts: float, end_ts: float, tz: ZoneInfo, day_start: str, day_end: str,
+                    include_weekends: bool = False) -> List[tuple]:
+    """Working-hour windows (as UTC timestamps) for every local day in [start_ts, end_ts)"""
+    start_h, start_m = (int(x) for x in day_start.split(':'))
+    end_h, end_m = (int(x) for x in day_end.split(':'))
+    windows = []
+    day = datetime.fromtimestamp(start_ts, tz).date()
+    last_day = datetime.fromtimestamp(end_ts, tz).date()
+    while day <= last_day:
+        if include_weekends or day.weekday() < 5:
+            open_ts = datetime(day.year, day.month, day.day, start_h, start_m, tzinfo=tz).timestamp()
+            close_ts = datetime(day.year, day.month, day.day, end_h, end_m, tzinfo=tz).timestamp()
+            open_ts, close_ts = max(open_ts, start_ts), min(close_ts, end_ts)
+            if open_ts < close_ts:
+                windows.append((open_ts, close_ts))
+        day += timedelta(days=1)
+    return windows
+
+@traced
+def find_free_slots(windows: List[tuple], busy: List[tuple], duration: float, step: float,
+                    max_slots: int) -> List[tuple]:
+    """Sweep sorted windows against merged busy intervals and return the earliest free slots.
+
+    Slot starts are aligned to multiples of step from the start of their window.
+    """
+    slots = []
+    b = 0
+    for window_start, window_end in windows:
+        cursor = window_start
+        while b < len(busy) and busy[b][1] <= window_start:
+            b += 1
+        i = b
+        while cursor + duration <= window_end and len(slots) < max_slots:
+            while i < len(busy) and busy[i][1] <= cursor:
+                i += 1
+            gap_end = min(window_end, busy[i][0]) if i < len(busy) else window_end
+            if gap_end - cursor >= duration and (i >= len(busy) or busy[i][0] > cursor):
+                slots.append((cursor, cursor + duration))
+                cursor += max(step, duration)
+            else:
+                # Jump past the busy block, realigned to the window's step grid
+                blocked_until = busy[i][1] if i < len(busy) else window_end
+                steps = -(-(blocked_until - window_start) // step)
+                cursor = window_start + steps * step
+        if len(slots) >= max_slots:
+            break
+    return slots
+
+def query_busy_intervals(calendar_ids: List[str], start_ts: float, end_ts: float):
+    """Fetch busy intervals for many calendars with chunked, concurrent freebusy queries.
+
+    Returns (busy intervals, {calendar_id: error reason}).
+    """
+    tasks = []
+    for i in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS):
+        chunk = calendar_ids[i:i + FREEBUSY_MAX_CALENDARS]
+        chunk_start = start_ts
+        while chunk_start < end_ts:
+            chunk_end = min(end_ts, chunk_start + FREEBUSY_MAX_DAYS * 86400)
+            tasks.append((chunk, chunk_start, chunk_end))
+            chunk_start = chunk_end
+
+    def run_query(chunk, chunk_start, chunk_end):
+        body = {
+            "timeMin": datetime.fromtimestamp(chunk_start, timezone.utc).isoformat(),
+            "timeMax": datetime.fromtimestamp(chunk_end, timezone.utc).isoformat(),
+            "items": [{"id": cal_id} for cal_id in chunk]
+        }
+        return calendar_service.freebusy().query(body=body).execute(num_retries=3)
+
+    busy, errors = [], {}
+    with ThreadPoolExecutor(max_workers=min(8, len(tasks))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, run_query, *task) for task in tasks]
+        for result in (future.result() for future in futures):
+            for cal_id, info in result.get("calendars", {}).items():
+                for error in info.get("errors", []):
+                    errors[cal_id] = error.get("reason", "unknown")
+                for period in info.get("busy", []):
+                    busy.append((parse_rfc3339(period["start"]), parse_rfc3339(period["end"])))
+    return busy, errors
+
+@mcp.tool()
+def calendar_find_meeting_slots(
+    attendees: List[str],
+    timeMin: str,
+    timeMax: str,
+    duration_minutes: int = 30,
+    buffer_minutes: int = 0,
+    time_zone: str = "UTC",
+    working_hours_start: str = "09:00",
+    working_hours_end: str = "17:00",
+    include_weekends: bool = False,
+    include_self: bool = True,
+    max_slots: int = 5,
+    slot_step_minutes: int = 30
+) -> str:
+    """
+    Find common free meeting slots for a group of attendees.
+
+    Args:
+        attendees: Attendee emails or calendar IDs to check
+        timeMin: RFC3339 start of the search range
+        timeMax: RFC3339 end of the search range
+        duration_minutes: Meeting length in minutes (default: 30)
+        buffer_minutes: Free time required before and after existing events (default: 0)
+        time_zone: IANA time zone for working hours and output (e.g., 'America/New_York')
+        working_hours_start: Local start of the working day, HH:MM (default: 09:00)
+        working_hours_end: Local end of the working day, HH:MM (default: 17:00)
+        include_weekends: Whether Saturday/Sunday slots are allowed (default: False)
+        include_self: Also check the user's own primary calendar (default: True)
+        max_slots: Number of slots to return, earliest first (default: 5)
+        slot_step_minutes: Granularity of proposed start times (default: 30)
+    """
+    try:
+        tz = ZoneInfo(time_zone)
+        start_ts, end_ts = parse_rfc3339(timeMin), parse_rfc3339(timeMax)
+        if end_ts <= start_ts:
+            return ErrorResult("Error finding meeting slots: timeMax must be after timeMin")
+
+        calendar_ids = list(dict.fromkeys((['primary'] if include_self else []) + list(attendees)))
+        if not calendar_ids:
+            return ErrorResult("Error finding meeting slots: no attendees given")
+
+        busy, errors = query_busy_intervals(calendar_ids, start_ts, end_ts)
+        busy = merge_intervals(busy, pad=buffer_minutes * 60)
+        windows = working_windows(start_ts, end_ts, tz, working_hours_start, working_hours_end, include_weekends)
+        slots = find_free_slots(windows, busy, duration_minutes * 60, max(slot_step_minutes, 1) * 60, max_slots)
+
+        who = f"{len(calendar_ids)} calendars"
+        if not slots:
+            response = f"No common {duration_minutes}-minute slots found for {who} between {timeMin} and {timeMax} " \
+                       f"({working_hours_start}-{working_hours_end} {time_zone}).\n"
+        else:
+            response = f"Found {len(slots)} common free slots for {who} ({duration_minutes} min, {time_zone}):\n\n"
+            for i, (slot_start, slot_end) in enumerate(slots, 1):
+                local_start = datetime.fromtimestamp(slot_start, tz)
+                local_end = datetime.fromtimestamp(slot_end, tz)
+                response += f"{i}. {local_start.strftime('%a %Y-%m-%d %H:%M')}-{local_end.strftime('%H:%M')}" \
+                            f" (start: {local_start.isoformat()}, end: {local_end.isoformat()})\n"
+
+        if errors:
+            response += "\nAvailability unknown (treated as free) for: " + \
+                        ", ".join(f"{cal_id} ({reason})" for cal_id, reason in errors.items())
+        return response
+
+    except Exception as e:
+        return ErrorResult(f"Error finding meeting slots: {str(e)}")
+
+def build_event_patch(summary: Optional[str] = None, startTime: Optional[str] = None,
+                      endTime: Optional[str] = None, attendees: Optional[List[str]] = None,
+                      location: Optional[str] = None, description: Optional[str] = None,
+                      timeZone: Optional[str] = None) -> Dict[str, Any]:
+    """Build a PATCH body holding only the fields that change"""
+    patch = {}
+    if summary is not None:
+        patch["summary"] = summary
+    if startTime is not None:
+        patch["start"] = build_event_time(startTime, timeZone) if timeZone or len(startTime) == 10 else {"dateTime": startTime}
+    if endTime is not None:
+        patch["end"] = build_event_time(endTime, timeZone) if timeZone or len(endTime) == 10 else {"dateTime": endTime}
+    if attendees is not None:
+        patch["attendees"] = [{"email": email} for email in attendees]
+    if location is not None:
+        patch["location"] = location
+    if description is not None:
+        patch["description"] = description
+    return patch
+
+def shift_event_time(value: Dict[str, str], minutes: int) -> Dict[str, str]:
+    """Move a Calendar start/end object by a number of minutes"""
+    if value.get('dateTime'):
+        moved = datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00')) + timedelta(minutes=minutes)
+        shifted = {'dateTime': moved.isoformat()}
+        if value.get('timeZone'):
+            shifted['timeZone'] = value['timeZone']
+        return shifted
+    if minutes % 1440:
+        raise ValueError("all-day events can only be shifted by whole days")
+    moved = datetime.fromisoformat(value['date']) + timedelta(minutes=minutes)
+    return {'date': moved.strftime('%Y-%m-%d')}
+
+def etag_conflict_message(event_id: str) -> str:
+    return (f"Event {event_id} was changed by someone else since it was last read (ETag mismatch); "
+            f"nothing was overwritten. List the event again and retry.")
+
+@mcp.tool()
+def calendar_update_event(event_id: str, 
+                         summary: Optional[str] = None,
+                         startTime: Optional[str] = None,
+                         endTime: Optional[str] = None,
+                         attendees: Optional[List[str]] = None,
+                         location: Optional[str] = None,
+                         description: Optional[str] = None,
+                         timeZone: Optional[str] = None,
+                         send_updates: str = "all",
+                         etag: Optional[str] = None) -> str:
+    """Update an existing calendar event
+    
+    Args:
+        event_id: ID of the event to update
+        summary: New event title (optional)
+        startTime: New RFC3339 start time (optional)
+        endTime: New RFC3339 end time (optional)
+        attendees: New list of attendee emails (optional)
+        location: New event location (optional)
+        description: New event description (optional)
+        timeZone: IANA time zone for the new start/end times (optional)
+        send_updates: Notify attendees: 'all', 'externalOnly' or 'none' (default: 'all')
+        etag: Only update if the event still has this ETag (defaults to the last synced version)
+    """
+    try:
+        if send_updates not in ('all', 'externalOnly', 'none'):
+            return ErrorResult("Error updating event: send_updates must be 'all', 'externalOnly' or 'none'")
+
+        patch = build_event_patch(summary, startTime, endTime, attendees, location, description, timeZone)
+        if not patch:
+            return ErrorResult("Error updating event: no fields to update")
+
+        # The local store usually knows the ETag of the version the user last saw; if not,
+        # fetching just the ETag is cheaper than syncing the whole store to learn it
+        store = get_calendar_store()
+        if etag is None:
+            known = store.get_event(event_id)
+            if known is None:
+                known = calendar_service.events().get(calendarId="primary", eventId=event_id, fields='etag').execute()
+            etag = known.get('etag')
+
+        # Single PATCH with only the changed fields; If-Match rejects concurrent edits
+        request = calendar_service.events().patch(
+            calendarId="primary",
+            eventId=event_id,
+            body=patch,
+            sendUpdates=send_updates
+        )
+        if etag:
+            request.headers['If-Match'] = etag
+        try:
+            updated_event = request.execute()
+        except HttpError as e:
+            if e.resp.status == 412:
+                mark_calendar_store_stale()
+                return ErrorResult(f"Error updating event: {etag_conflict_message(event_id)}")
+            raise
+        store.put_event(updated_event)
+
+        return f"Event updated successfully!\n\nUpdated Details:\n- Title: {updated_event.get('summary')}\n- Event ID: {event_id}\n- Link: {updated_event.get('htmlLink')}"
+
+    except Exception as e:
+        return ErrorResult(f"Error updating event: {str(e)}")
+
+@mcp.tool()
+def calendar_batch_update_events(
+    updates: List[Dict[str, Any]],
+    send_updates: str = "none",
+    calendar_id: str = "primary"
+) -> str:
+    """
+    Update many calendar events in one call (batched PATCH requests with ETag checks).
+
+    Args:
+        updates: List of changes, each {'event_id', optional 'summary', 'startTime', 'endTime',
+                 'location', 'description', 'attendees', 'timeZone', 'shift_minutes', 'etag'}.
+                 shift_minutes moves the event's start and end by that many minutes.
+        send_updates: Notify attendees: 'all', 'externalOnly' or 'none' (default: 'none')
+        calendar_id: Calendar holding the events (default: 'primary')
+    """
+    try:
+        if send_updates not in ('all', 'externalOnly', 'none'):
+            return ErrorResult("Error updating events: send_updates must be 'all', 'externalOnly' or 'none'")
+        if not updates:
+            return ErrorResult("No updates provided.")
+
+        store = get_calendar_store()
+        store.ensure_fresh()
+        rows = [(str(u.get('event_id', '-')), 'pending', '') for u in updates]
+
+        # Shifts need the current times; anything the store doesn't know is fetched in one batch
+        known = {}
+        missing = {}
+        for i, update in enumerate(updates):
+            event_id = update.get('event_id')
+            if not event_id:
+                continue
+            event = store.get_event(event_id, calendar_id)
+            if event:
+                known[i] = event
+            elif update.get('shift_minutes'):
+                missing[str(i)] = calendar_service.events().get(calendarId=calendar_id, eventId=event_id)
+        for request_id, (event, error) in execute_calendar_batch(missing).items() if missing else []:
+            if error is None:
+                known[int(request_id)] = event
+
+        calls = {}
+        for i, update in enumerate(updates):
+            event_id = update.get('event_id')
+            if not event_id:
+                rows[i] = ('-', 'invalid', "missing 'event_id'")
+                continue
+            try:
+                patch = build_event_patch(update.get('summary'), update.get('startTime'), update.get('endTime'),
+                                          update.get('attendees'), update.get('location'),
+                                          update.get('description'), update.get('timeZone'))
+                if update.get('shift_minutes'):
+                    if i not in known:
+                        raise ValueError("event not found")
+                    patch['start'] = shift_event_time(known[i]['start'], int(update['shift_minutes']))
+                    patch['end'] = shift_event_time(known[i]['end'], int(update['shift_minutes']))
+            except (ValueError, KeyError) as e:
+                rows[i] = (event_id, 'invalid', str(e))
+                continue
+            if not patch:
+                rows[i] = (event_id, 'invalid', 'no fields to update')
+                continue
+            request = calendar_service.events().patch(
+                calendarId=calendar_id, eventId=event_id, body=patch, sendUpdates=send_updates
+            )
+            etag = update.get('etag') or known.get(i, {}).get('etag')
+            if etag:
+                request.headers['If-Match'] = etag
+            calls[str(i)] = request
+
+        for chunk_start in range(0, len(calls), CALENDAR_BATCH_SIZE):
+            chunk = dict(list(calls.items())[chunk_start:chunk_start + CALENDAR_BATCH_SIZE])
+            for request_id, (event, error) in execute_calendar_batch(chunk).items():
+                i = int(request_id)
+                event_id = rows[i][0]
+                if error is None:
+                    store.put_event(event, calendar_id)
+                    rows[i] = (event_id, 'updated', event.get('summary', ''))
+                elif isinstance(error, HttpError) and error.resp.status == 412:
+                    rows[i] = (event_id, 'conflict', 'changed by someone else; not overwritten')
+                else:
+                    rows[i] = (event_id, 'failed', str(error))
+        if any(status == 'conflict' for _, status, _ in rows):
+            mark_calendar_store_stale()
+
+        counts = {}
+        for _, status, _ in rows:
+            counts[status] = counts.get(status, 0) + 1
+        summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+        response = f"BATCH EVENT UPDATE: {summary}\n\n"
+        for i, (event_id, status, detail) in enumerate(rows, 1):
+            detail = detail if len(detail) <= 60 else detail[:57] + "..."
+            response += f"{i:>4} | {status:<8} | {event_id} | {detail}\n"
+        return response
+
+    except Exception as e:
+        return ErrorResult(f"Error updating events: {str(e)}")
+
+@mcp.tool()
+def calendar_delete_event(event_id: str) -> str:
+    """Delete a calendar event
+    
+    Args:
+        event_id: ID of the event to delete
+    """
+    try:
+        calendar_service.events().delete(
+            calendarId="primary",
+            eventId=event_id,
+            sendUpdates="all"
+        ).execute()
+        mark_calendar_store_stale()
+
+        return f"Event with ID '{event_id}' has been deleted successfully!"
+
+    except Exception as e:
+        return ErrorResult(f"Error deleting event: {str(e)}")
+
+# ==================== GOOGLE DOCS TOOLS ====================
+
+# A document's structure and text without styling, which is most of a full documents.get response
+DOC_STRUCTURE_FIELDS = (
+    'revisionId,title,body(content(startIndex,endIndex,sectionBreak(sectionStyle(sectionType)),'
+    'tableOfContents(content(startIndex)),'
+    'paragraph(paragraphStyle(namedStyleType,headingId),bullet(nestingLevel),elements(textRun(content))),'
+    'table(rows,columns,tableRows(tableCells(content(paragraph(elements(textRun(content)))))))))'
+)
+DOC_HEADING_LEVELS = {'TITLE': 1, 'HEADING_1': 1, 'HEADING_2': 2, 'HEADING_3': 3,
+                      'HEADING_4': 4, 'HEADING_5': 5, 'HEADING_6': 6}
+DOC_STRUCTURE_CACHE_SIZE = int(os.getenv("MCP_DOC_STRUCTURE_CACHE_SIZE", "32"))
+
+class DocElement:
+    """One structural element of a document body: a paragraph, table, section break or table of contents."""
+
+    __slots__ = ('kind', 'level', 'bullet_level', 'text')
+
+    def __init__(self, kind: str, text: str = '', level: int = 0, bullet_level: Optional[int] = None):
+        self.kind = kind
+        self.text = text
+        self.level = level  # heading level, 0 for body text
+        self.bullet_level = bullet_level
+
+    def render(self) -> str:
+        if self.kind == 'table':
+            return self.text
+        if self.kind == 'table_of_contents':
+            return "[Table of contents]"
+        if self.kind != 'paragraph':
+            return ''
+        text = self.text.rstrip('\n')
+        if self.level:
+            return f"{'#' * self.level} {text.strip()}"
+        if self.bullet_level is not None:
+            return f"{'  ' * self.bullet_level}- {text}"
+        return text
+
+def paragraph_text(paragraph: dict) -> str:
+    return ''.join(run.get('textRun', {}).get('content', '') for run in paragraph.get('elements', []))
+
+def parse_doc_elements(content: List[dict]) -> List[DocElement]:
+    elements = []
+    for item in content:
+        if 'paragraph' in item:
+            paragraph = item['paragraph']
+            style = paragraph.get('paragraphStyle', {}).get('namedStyleType', 'NORMAL_TEXT')
+            bullet = paragraph.get('bullet')
+            elements.append(DocElement('paragraph', paragraph_text(paragraph), DOC_HEADING_LEVELS.get(style, 0),
+                                       bullet.get('nestingLevel', 0) if bullet is not None else None))
+        elif 'table' in item:
+            rows = []
+            for row in item['table'].get('tableRows', []):
+                cells = (' '.join(paragraph_text(c['paragraph']).strip() for c in cell.get('content', []) if 'paragraph' in c)
+                         for cell in row.get('tableCells', []))
+                rows.append('| ' + ' | '.join(cells) + ' |')
+            elements.append(DocElement('table', '\n'.join(rows)))
+        elif 'tableOfContents' in item:
+            elements.append(DocElement('table_of_contents'))
+        else:
+            elements.append(DocElement('section_break'))
+    return elements
+
+def doc_section_end(elements: List[DocElement], start: int) -> int:
+    """Index after the section a heading starts: the next heading at the same or a higher level."""
+    level = elements[start].level
+    for index in range(start + 1, len(elements)):
+        if 0 < elements[index].level <= level:
+            return index
+    return len(elements)
+
+class DocStructureCache:
+    """Parsed Google Docs structures per (user, document), each valid for one revisionId.
+
+    A cached document is revalidated with a documents.get for just its revisionId,
+    so reading another section of an unchanged document costs one tiny request.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, document_id: str):
+        """Return (title, revisionId, elements) of a document."""
+        key = (current_user_id(), document_id)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None:
+            revision = docs_service.documents().get(documentId=document_id, fields='revisionId').execute()
+            if revision.get('revisionId') == entry[1]:
+                with self.lock:
+                    if key in self.entries:
+                        self.entries.move_to_end(key)
+                return entry
+        document = docs_service.documents().get(documentId=document_id, fields=DOC_STRUCTURE_FIELDS).execute()
+        entry = (document.get('title', 'Untitled'), document.get('revisionId'),
+                 parse_doc_elements(document.get('body', {}).get('content', [])))
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+doc_structures = DocStructureCache(DOC_STRUCTURE_CACHE_SIZE)
+
+@mcp.tool()
+def docs_outline(fileId: str) -> str:
+    """List the headings of a Google Doc with the element range and size of each section.
+
+    Use it before docs_read_section to read only the part of a long document you need.
+    """
+    try:
+        title, revision, elements = doc_structures.get(fileId)
+        total_chars = sum(len(element.text) for element in elements)
+        headings = []
+        for index, element in enumerate(elements):
+            if element.level:
+                end = doc_section_end(elements, index)
+                chars = sum(len(e.text) for e in elements[index:end])
+                headings.append(f"{'  ' * (element.level - 1)}- {element.text.strip()} "
+                                f"[elements {index}-{end}, {chars} chars]")
+        summary = f"📑 {title} ({len(elements)} elements, {total_chars} chars, revision {revision})"
+        if not headings:
+            return f"{summary}\n\nNo headings. Read element ranges with docs_read_section(start_element, end_element)."
+        return f"{summary}\n\n" + "\n".join(headings)
+
+    except Exception as e:
+        return ErrorResult(f"Error reading document outline: {str(e)}")
+
+@mcp.tool()
+def docs_read_section(fileId: str, heading: Optional[str] = None, start_element: Optional[int] = None,
+                      end_element: Optional[int] = None) -> str:
+    """
+    Read part of a Google Doc: the section under a heading, or a range of structural elements.
+
+    Args:
+        fileId: The Google Doc's file ID.
+        heading: Heading text of the section to read (exact match first, then the first heading containing it).
+        start_element: First element to read, as numbered by docs_outline (ignored with heading).
+        end_element: Element to stop before (default: the end of the document).
+    """
+    try:
+        title, revision, elements = doc_structures.get(fileId)
+        if heading:
+            wanted = heading.strip().lower()
+            headings = [(index, element.text.strip().lower()) for index, element in enumerate(elements) if element.level]
+            start = next((index for index, text in headings if text == wanted), None)
+            if start is None:
+                start = next((index for index, text in headings if wanted in text), None)
+            if start is None:
+                available = ", ".join(elements[index].text.strip() for index, _ in headings[:20])
+                return ErrorResult(f"No heading matching '{heading}' in {title}. Headings: {available or 'none'}")
+            end = doc_section_end(elements, start)
+        else:
+            start = start_element or 0
+            end = len(elements) if end_element is None else min(end_element, len(elements))
+            if not 0 <= start < end:
+                return ErrorResult(f"Invalid element range {start}-{end}: {title} has {len(elements)} elements")
+        body = "\n".join(filter(None, (element.render() for element in elements[start:end])))
+        return f"📄 {title} (elements {start}-{end} of {len(elements)})\n\n{body}"
+
+    except Exception as e:
+        return ErrorResult(f"Error reading document section: {str(e)}")
+
+# ==================== BACKGROUND JOBS ====================
+
+# Bulk operations that outgrow one tool call run as jobs: a tool starts one and returns
+# its id, the job runs on job_executor, and other tools poll, page through results or cancel
+JOB_WORKERS = int(os.getenv("MCP_JOB_WORKERS", "2"))
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="mcp-job")
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed', 'cancelled')
+JOB_HANDLERS = {}
+_jobs_stopping = threading.Event()
+
+# Messages fetched per attachment-scan checkpoint, and the message fields it needs (no bodies)
+JOB_SCAN_CHUNK = 25
+ATTACHMENT_SCAN_FIELDS = ("id,payload(headers,parts(filename,mimeType,body(attachmentId,size),"
+                          "parts(filename,mimeType,body(attachmentId,size),"
+                          "parts(filename,mimeType,body(attachmentId,size)))))")
+
+def job_handler(kind: str):
+    """Register the function that runs (and resumes) jobs of a kind"""
+    def register(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return register
+
+def process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        return False  # os.kill(pid, 0) would terminate it on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def process_start_time(pid: int) -> Optional[str]:
+    """When a process started, in clock ticks since boot (Linux only); tells a reused PID from its first owner"""
+    try:
+        with open(f"/proc/{pid}/stat", 'rb') as f:
+            return f.read().rsplit(b')', 1)[1].split()[19].decode()
+    except (OSError, IndexError):
+        return None
+
+# Identifies this process as a job owner. A PID alone is not enough: a restarted container
+# usually gets the same one, and any process may reuse the PID of one that died.
+PROCESS_TOKEN = f"{os.getpid()}:{process_start_time(os.getpid()) or os.urandom(8).hex()}"
+
+def job_owner_alive(owner: Optional[str]) -> bool:
+    """Whether the process that wrote owner (a PROCESS_TOKEN) is still running"""
+    if owner == PROCESS_TOKEN:
+        return True
+    try:
+        pid, started = owner.split(':')
+        pid = int(pid)
+    except (AttributeError, ValueError):
+        return False  # written before owner tokens existed
+    if pid == os.getpid() or not process_alive(pid):
+        return False
+    # Without /proc the start time can't be checked, so a live PID counts as the owner
+    current = process_start_time(pid)
+    return current is None or current == started
+
+class JobStore:
+    """A user's background jobs and their result rows in SQLite, so jobs survive restarts.
+
+    A job's new result rows and its checkpoint are written in one transaction, so a
+    job resumed after a crash continues exactly where its last commit left off.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, kind TEXT, params TEXT, state TEXT, status TEXT, owner TEXT,
+            done INTEGER DEFAULT 0, total INTEGER, message TEXT, error TEXT, results INTEGER DEFAULT 0,
+            cancel_requested INTEGER DEFAULT 0, created REAL, updated REAL
+        );
+        CREATE TABLE IF NOT EXISTS job_results (
+            job_id TEXT, seq INTEGER, data TEXT, PRIMARY KEY (job_id, seq)
+        );
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.executescript(self.SCHEMA)
+        self.lock = threading.RLock()
+        self.cancel_events = {}
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        if 'owner' not in columns:
+            # Stores from before owner tokens recorded only a PID; their unfinished jobs count as orphans
+            with self.conn:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+    def create(self, kind: str, params: Dict[str, Any]) -> str:
+        job_id = os.urandom(6).hex()
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO jobs (id, kind, params, state, status, owner, created, updated) "
+                "VALUES (?, ?, ?, '{}', 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(params), PROCESS_TOKEN, now, now)
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            cursor = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            return dict(zip([column[0] for column in cursor.description], row)) if row else None
+
+    def list(self, status: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT * FROM jobs WHERE ? IS NULL OR status = ? ORDER BY created DESC LIMIT ?",
+                (status, status, limit)
+            )
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def claim_orphans(self) -> List[str]:
+        """Take over unfinished jobs whose process is gone; returns their ids"""
+        with self.lock, self.conn:
+            rows = self.conn.execute(
+                "SELECT id, owner FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+            orphans = [job_id for job_id, owner in rows if not job_owner_alive(owner)]
+            for job_id in orphans:
+                self.conn.execute("UPDATE jobs SET owner = ?, status = 'queued' WHERE id = ?", (PROCESS_TOKEN, job_id))
+            return orphans
+
+    def set_status(self, job_id: str, status: str, error: Optional[str] = None):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+                              (status, error, time.time(), job_id))
+
+    def commit(self, job_id: str, rows: List[Dict[str, Any]], state: Dict[str, Any], done: int,
+               total: Optional[int] = None, message: Optional[str] = None) -> bool:
+        """Append result rows and save the checkpoint; returns True if a cancel was requested"""
+        with self.lock, self.conn:
+            results, cancel_requested = self.conn.execute(
+                "SELECT results, cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            self.conn.executemany("INSERT INTO job_results (job_id, seq, data) VALUES (?, ?, ?)",
+                                  [(job_id, results + i, json.dumps(row)) for i, row in enumerate(rows)])
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, done = ?, total = ?, message = ?, results = ?, updated = ? WHERE id = ?",
+                (json.dumps(state), done, total, message, results + len(rows), time.time(), job_id)
+            )
+        return bool(cancel_requested)
+
+    def results(self, job_id: str, offset: int, limit: int) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [json.loads(row[0]) for row in self.conn.execute(
+                "SELECT data FROM job_results WHERE job_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+                (job_id, offset, limit))]
+
+    def request_cancel(self, job_id: str):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        event = self.cancel_events.get(job_id)
+        if event is not None:
+            event.set()
+
+class JobContext:
+    """What a job handler works with: its params, its last checkpoint and commit()"""
+
+    def __init__(self, store: JobStore, job: Dict[str, Any]):
+        self.store = store
+        self.id = job['id']
+        self.params = json.loads(job['params'])
+        self.state = json.loads(job['state'] or '{}')
+        self.done = job['done']
+
+    def commit(self, rows: List[Dict[str, Any]], state: Dict[str, Any], done: int,
+               total: Optional[int] = None, message: Optional[str] = None):
+        """Checkpoint, then stop here if the job was cancelled (from any process)"""
+        if self.store.commit(self.id, rows, state, done, total, message):
+            _cancel_event.get().set()
+        self.state, self.done = state, done
+        check_cancelled()
+
+def run_job(store: JobStore, job_id: str, services, cancel_event: threading.Event):
+    """Run or resume one job in a fresh context bound to its user and cancel event"""
+    _user_services.set(services)
+    _cancel_event.set(cancel_event)
+    job = store.get(job_id)
+    if job is None or job['status'] not in ('queued', 'running'):
+        return
+    started = time.perf_counter()
+    status, error = 'failed', None
+    try:
+        if job['cancel_requested']:
+            raise ToolCancelled("Job was cancelled before it started")
+        store.set_status(job_id, 'running')
+        with trace_span(f"job {job['kind']}", root=True, **{'mcp.job': job_id}):
+            JOB_HANDLERS[job['kind']](JobContext(store, job))
+        status = 'succeeded'
+    except ToolCancelled:
+        # Interrupted by shutdown rather than job_cancel: leave it for the next process to resume
+        stopped = _jobs_stopping.is_set() and not store.get(job_id)['cancel_requested']
+        status = 'queued' if stopped else 'cancelled'
+    except Exception as e:
+        error = str(e)
+        print(f"❌ Job {job_id} ({job['kind']}) failed: {error}", file=sys.stderr)
+    finally:
+        store.set_status(job_id, status, error)
+        store.cancel_events.pop(job_id, None)
+        metrics.observe_tool(f"job {job['kind']}", time.perf_counter() - started, status == 'failed', 0)
+
+def submit_job(store: JobStore, job_id: str):
+    event = store.cancel_events[job_id] = threading.Event()
+    # A new context: the job must not inherit the starting call's deadline or cancellation
+    job_executor.submit(contextvars.Context().run, run_job, store, job_id, _user_services.get(), event)
+
+def stop_jobs():
+    """Interrupt running jobs at their next checkpoint on shutdown; they resume on restart"""
+    _jobs_stopping.set()
+    for store in list(_job_stores.values()):
+        for event in list(store.cancel_events.values()):
+            event.set()
+    job_executor.shutdown(wait=True, cancel_futures=True)
+
+_job_stores = {}
+_job_stores_lock = threading.Lock()
+
+def get_job_store() -> JobStore:
+    """Get the current user's job store, resuming jobs a previous process left unfinished"""
+    user_id = current_user_id()
+    with _job_stores_lock:
+        store = _job_stores.get(user_id)
+        if store is None:
+            path = os.path.join(get_state_dir('jobs'), f"{user_state_name(user_id)}.sqlite3")
+            store = _job_stores[user_id] = JobStore(path)
+            for job_id in store.claim_orphans():
+                print(f"🔁 Resuming job {job_id}", file=sys.stderr)
+                submit_job(store, job_id)
+        return store
+
+def resume_user_jobs(services: UserServices):
+    """Resume a user's unfinished jobs as soon as their clients are opened in this process.
+
+    Under the HTTP transports a job can only run with credentials from its user's request
+    headers, so this is the earliest point an orphaned job can be picked up again.
+    """
+    def resume():
+        _user_services.set(services)
+        get_job_store()
+    contextvars.Context().run(resume)
+
+def release_user_stores(user_id: str):
+    """Drop a user's calendar and job stores once their clients leave the session cache.
+
+    Calls still using a store keep it (and its SQLite connection) alive until they finish;
+    a job store with jobs running in this process stays, so job_cancel can reach them.
+    """
+    with _calendar_stores_lock:
+        _calendar_stores.pop(user_id, None)
+    with _job_stores_lock:
+        store = _job_stores.get(user_id)
+        if store is not None and not store.cancel_events:
+            del _job_stores[user_id]
+
+def format_job(job: Dict[str, Any]) -> str:
+    total = f"/{job['total']}" if job['total'] is not None else ""
+    response = f"Job {job['id']} ({job['kind']}): {job['status']}\n"
+    response += f"Progress: {job['done']}{total}" + (f" - {job['message']}" if job['message'] else "") + "\n"
+    response += f"Results: {job['results']} rows\n"
+    response += f"Created: {datetime.fromtimestamp(job['created']).strftime('%Y-%m-%d %H:%M:%S')}, "
+    response += f"updated: {datetime.fromtimestamp(job['updated']).strftime('%Y-%m-%d %H:%M:%S')}\n"
+    if job['error']:
+        response += f"Error: {job['error']}\n"
+    return response
+
+def start_job(kind: str, params: Dict[str, Any]) -> str:
+    store = get_job_store()
+    job_id = store.create(kind, params)
+    submit_job(store, job_id)
+    return (f"Started {kind} job {job_id}.\n"
+            f"Check it with job_status(job_id='{job_id}') and page through its rows with job_results.")
+
+@job_handler('folder_crawl')
+def crawl_folder_job(job: JobContext):
+    """List a Drive folder tree breadth first, one folder per checkpoint
+
+    The folders still to list are the folder rows among the job's own results, in the order
+    they were found, so a checkpoint only records how many folders have been listed.
+    """
+    max_depth = job.params.get('max_depth', 20)
+    frontier = [[job.params['folder_id'], '', 0]]
+    offset = 0
+    while offset < job.store.get(job.id)['results']:
+        rows = job.store.results(job.id, offset, 1000)
+        offset += len(rows)
+        for row in rows:
+            depth = row.get('depth', row['path'].count('/'))
+            if row['mimeType'] == 'application/vnd.google-apps.folder' and depth < max_depth:
+                frontier.append([row['id'], row['path'], depth])
+    index = job.state.get('next', 0)
+    while index < len(frontier):
+        folder_id, path, depth = frontier[index]
+        rows, page_token = [], None
+        while True:
+            page = drive_service.files().list(
+                q=f"'{folder_id}' in parents and trashed=false",
+                pageSize=1000,
+                pageToken=page_token,
+                fields="nextPageToken, files(id, name, mimeType, size, modifiedTime)"
+            ).execute()
+            for item in page.get('files', []):
+                item_path = f"{path}/{item['name']}"
+                rows.append({'path': item_path, 'id': item['id'], 'mimeType': item['mimeType'],
+                             'size': item.get('size'), 'modifiedTime': item.get('modifiedTime'), 'depth': depth + 1})
+                if item['mimeType'] == 'application/vnd.google-apps.folder' and depth + 1 < max_depth:
+                    frontier.append([item['id'], item_path, depth + 1])
+            page_token = page.get('nextPageToken')
+            if not page_token:
+                break
+        index += 1
+        job.commit(rows, {'next': index}, index, len(frontier), f"Listed {path or '/'}")
+
+def iter_attachment_parts(payload: Dict[str, Any]):
+    for part in payload.get('parts', []):
+        if 'parts' in part:
+            yield from iter_attachment_parts(part)
+        elif part.get('filename') and part.get('body', {}).get('attachmentId'):
+            yield part
+
+@job_handler('attachment_scan')
+def scan_attachments_job(job: JobContext):
+    """List the attachments of every matching message, JOB_SCAN_CHUNK messages per checkpoint"""
+    max_messages = job.params['max_messages']
+    state = job.state or {'page_token': None, 'offset': 0, 'scanned': 0}
+    while state['scanned'] < max_messages:
+        page = gmail_service.users().messages().list(
+            userId='me', q=job.params['query'], maxResults=100, pageToken=state['page_token']
+        ).execute()
+        messages = page.get('messages', [])
+        while state['offset'] < len(messages) and state['scanned'] < max_messages:
+            chunk = messages[state['offset']:state['offset'] + min(JOB_SCAN_CHUNK, max_messages - state['scanned'])]
+            rows = []
+            for ref in chunk:
+                message = gmail_service.users().messages().get(
+                    userId='me', id=ref['id'], format='full', fields=ATTACHMENT_SCAN_FIELDS
+                ).execute()
+                headers = {h['name'].lower(): h['value'] for h in message.get('payload', {}).get('headers', [])}
+                for part in iter_attachment_parts(message.get('payload', {})):
+                    rows.append({'message_id': message['id'], 'date': headers.get('date'),
+                                 'from': headers.get('from'), 'subject': headers.get('subject'),
+                                 'filename': part['filename'], 'mimeType': part.get('mimeType'),
+                                 'size': part['body'].get('size'), 'attachment_id': part['body']['attachmentId']})
+            state = dict(state, offset=state['offset'] + len(chunk), scanned=state['scanned'] + len(chunk))
+            job.commit(rows, state, state['scanned'], max_messages, f"Scanned {state['scanned']} emails")
+        if not page.get('nextPageToken'):
+            break
+        state = dict(state, page_token=page['nextPageToken'], offset=0)
+        job.commit([], state, state['scanned'], max_messages)
+    job.commit([], state, state['scanned'], state['scanned'], f"Scanned {state['scanned']} emails")
+
+@job_handler('bulk_upload')
+def bulk_upload_job(job: JobContext):
+    """Upload local files to Drive one by one, one file per checkpoint"""
+    file_paths = job.params['file_paths']
+    folder_id = job.params.get('folder_id')
+    index = job.state.get('next', 0)
+    while index < len(file_paths):
+        file_path = file_paths[index]
+        try:
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(f"File not found at {file_path}")
+            mime_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+            metadata = {'name': os.path.basename(file_path)}
+            if folder_id:
+                metadata['parents'] = [folder_id]
+            file = drive_service.files().create(
+                body=metadata,
+                media_body=MediaFileUpload(file_path, mimetype=mime_type, resumable=True, chunksize=MEDIA_CHUNK_SIZE),
+                fields='id,name,webViewLink'
+            ).execute()
+            row = {'file_path': file_path, 'status': 'uploaded', 'id': file['id'], 'name': file['name'],
+                   'webViewLink': file.get('webViewLink')}
+        except Exception as e:
+            row = {'file_path': file_path, 'status': 'failed', 'error': str(e)}
+        index += 1
+        result_cache.invalidate(current_user_id(), invalidation_tags('drive_upload_file', job.params))
+        job.commit([row], {'next': index}, index, len(file_paths), f"Uploaded {index} of {len(file_paths)} files")
+
+@mcp.tool()
+def job_start_folder_crawl(folder_id: str = 'root', max_depth: int = 20) -> str:
+    """
+    Start a background job listing every file under a Drive folder, however deeply nested
+    
+    Args:
+        folder_id: Folder to crawl (default: root of My Drive)
+        max_depth: Deepest folder level to descend into (default: 20)
+    """
+    try:
+        return start_job('folder_crawl', {'folder_id': folder_id, 'max_depth': max_depth})
+    except Exception as e:
+        return ErrorResult(f"Error starting folder crawl: {str(e)}")
+
+@mcp.tool()
+def job_start_attachment_scan(
+    days_back: int = 180,
+    sender: Optional[str] = None,
+    subject_contains: Optional[str] = None,
+    max_messages: int = 2000
+) -> str:
+    """
+    Start a background job listing the attachments of every matching email
+    
+    Args:
+        days_back: How many days back to scan (default: 180)
+        sender: Only emails from this sender
+        subject_contains: Only emails whose subject contains this
+        max_messages: Stop after this many emails (default: 2000)
+    """
+    try:
+        query_parts = ["has:attachment", f"after:{(datetime.now() - timedelta(days=days_back)).strftime('%Y/%m/%d')}"]
+        if sender:
+            query_parts.append(f"from:({sender})")
+        if subject_contains:
+            query_parts.append(f'subject:"{subject_contains}"')
+        return start_job('attachment_scan', {'query': " ".join(query_parts), 'max_messages': max_messages})
+    except Exception as e:
+        return ErrorResult(f"Error starting attachment scan: {str(e)}")
+
+@mcp.tool()
+def job_start_bulk_upload(file_paths: List[str], folder_id: Optional[str] = None) -> str:
+    """
+    Start a background job uploading many local files to Google Drive
+    
+    Args:
+        file_paths: Paths of the files to upload (from uploads directory)
+        folder_id: Optional Google Drive folder ID to upload to (defaults to root)
+    """
+    try:
+        if not file_paths:
+            return ErrorResult("Error starting bulk upload: no file paths given")
+        return start_job('bulk_upload', {'file_paths': file_paths, 'folder_id': folder_id})
+    except Exception as e:
+        return ErrorResult(f"Error starting bulk upload: {str(e)}")
+
+@mcp.tool()
+def job_status(job_id: str) -> str:
+    """
+    Get the status and progress of a background job
+    
+    Args:
+        job_id: Id returned by one of the job_start_* tools
+    """
+    try:
+        job = get_job_store().get(job_id)
+        if job is None:
+            return ErrorResult(f"Error: No job with id {job_id}")
+        return format_job(job)
+    except Exception as e:
+        return ErrorResult(f"Error getting job status: {str(e)}")
+
+@mcp.tool()
+def job_results(job_id: str, offset: int = 0, limit: int = 50) -> str:
+    """
+    Get result rows of a background job, including partial results while it runs
+    
+    Args:
+        job_id: Id returned by one of the job_start_* tools
+        offset: Index of the first row to return (default: 0)
+        limit: Maximum rows to return (default: 50)
+    """
+    try:
+        store = get_job_store()
+        job = store.get(job_id)
+        if job is None:
+            return ErrorResult(f"Error: No job with id {job_id}")
+        rows = store.results(job_id, max(offset, 0), max(1, min(limit, 500)))
+        response = f"Job {job_id} ({job['status']}): rows {offset}-{offset + len(rows) - 1} of {job['results']}\n\n"
+        if not rows:
+            response = f"Job {job_id} ({job['status']}): no rows from {offset} (total {job['results']})\n"
+        response += "\n".join(json.dumps(row, ensure_ascii=False) for row in rows)
+        if offset + len(rows) < job['results']:
+            response += f"\n\nMore rows: job_results(job_id='{job_id}', offset={offset + len(rows)})"
+        return response
+    except Exception as e:
+        return ErrorResult(f"Error getting job results: {str(e)}")
+
+@mcp.tool()
+def job_cancel(job_id: str) -> str:
+    """
+    Cancel a background job; rows it already produced are kept
+    
+    Args:
+        job_id: Id returned by one of the job_start_* tools
+    """
+    try:
+        store = get_job_store()
+        job = store.get(job_id)
+        if job is None:
+            return ErrorResult(f"Error: No job with id {job_id}")
+        if job['status'] not in ('queued', 'running'):
+            return f"Job {job_id} already {job['status']}"
+        store.request_cancel(job_id)
+        return f"Cancellation requested for job {job_id}; it stops at its next checkpoint."
+    except Exception as e:
+        return ErrorResult(f"Error cancelling job: {str(e)}")
+
+@mcp.tool()
+def job_list(status: Optional[str] = None, limit: int = 20) -> str:
+    """
+    List recent background jobs
+    
+    Args:
+        status: Only jobs in this status (queued, running, succeeded, failed, cancelled)
+        limit: Maximum jobs to list (default: 20)
+    """
+    try:
+        if status and status not in JOB_STATUSES:
+            return ErrorResult(f"Error: status must be one of {', '.join(JOB_STATUSES)}")
+        jobs = get_job_store().list(status, limit)
+        if not jobs:
+            return "No jobs found."
+        return "\n".join(format_job(job) for job in jobs)
+    except Exception as e:
+        return ErrorResult(f"Error listing jobs: {str(e)}")
+
+# ==================== BATCH EXECUTION ====================
+
+BATCH_MAX_STEPS = 20
+# "${step}" inside a string argument is replaced by that step's output
+BATCH_REF_RE = re.compile(r'\$\{([A-Za-z_][\w-]*)\}')
+
+def batch_references(value) -> set:
+    """Ids of the steps an argument value refers to"""
+    if isinstance(value, str):
+        return set(BATCH_REF_RE.findall(value))
+    if isinstance(value, dict):
+        if '$ref' in value:
+            return {value['$ref']}
+        return set().union(*(batch_references(v) for v in value.values()))
+    if isinstance(value, list):
+        return set().union(*(batch_references(v) for v in value))
+    return set()
+
+def resolve_batch_args(value, outputs: Dict[str, str]):
+    """Substitute earlier step outputs into an argument value.
+
+    {"$ref": "step"} is the step's whole output; with "pattern" it is the first
+    regex match (group 1 if the pattern has a group), the "index"-th match, or
+    every match as a list with "all": true.
+    """
+    if isinstance(value, str):
+        return BATCH_REF_RE.sub(lambda m: outputs[m.group(1)], value)
+    if isinstance(value, list):
+        return [resolve_batch_args(v, outputs) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if '$ref' not in value:
+        return {k: resolve_batch_args(v, outputs) for k, v in value.items()}
+    text = outputs[value['$ref']]
+    if not value.get('pattern'):
+        return text
+    matches = [m.group(1) if m.re.groups else m.group(0) for m in re.finditer(value['pattern'], text)]
+    if value.get('all'):
+        return matches
+    index = value.get('index', 0)
+    if index >= len(matches):
+        raise ValueError(f"pattern {value['pattern']!r} matched {len(matches)} time(s) in the output of step {value['$ref']}")
+    return matches[index]
+
+def plan_batch(steps: List[Dict[str, Any]]) -> Dict[str, set]:
+    """Validate batch steps and return each step's dependencies; raises ValueError"""
+    if not steps:
+        raise ValueError("no steps given")
+    if len(steps) > BATCH_MAX_STEPS:
+        raise ValueError(f"at most {BATCH_MAX_STEPS} steps per batch")
+    ids = [step.get('id') for step in steps]
+    for step in steps:
+        if not step.get('id') or not step.get('tool'):
+            raise ValueError(f"every step needs an id and a tool: {json.dumps(step)}")
+        if step['tool'] == 'toolkit_batch':
+            raise ValueError("batches cannot be nested")
+        after = step.get('after', [])
+        if not isinstance(after, list) or not all(isinstance(step_id, str) for step_id in after):
+            raise ValueError(f"step {step['id']}: 'after' must be a list of step ids, not {json.dumps(after)}")
+    if len(set(ids)) != len(ids):
+        raise ValueError("step ids must be unique")
+    deps = {}
+    for step in steps:
+        deps[step['id']] = batch_references(step.get('args', {})) | set(step.get('after', []))
+        unknown = deps[step['id']] - set(ids)
+        if unknown:
+            raise ValueError(f"step {step['id']} refers to unknown step(s) {', '.join(sorted(unknown))}")
+    # Kahn's algorithm: anything left over sits on a cycle
+    remaining = {step_id: set(d) for step_id, d in deps.items()}
+    while True:
+        ready = [step_id for step_id, d in remaining.items() if not d]
+        if not ready:
+            break
+        for step_id in ready:
+            del remaining[step_id]
+        for d in remaining.values():
+            d.difference_update(ready)
+    if remaining:
+        raise ValueError(f"steps {', '.join(sorted(remaining))} form a dependency cycle")
+    return deps
+
+async def run_batch_step(step: Dict[str, Any], outputs: Dict[str, str]) -> tuple:
+    """Run one step through the normal tool pipeline; returns (status, output, seconds)"""
+    name = step['tool']
+    started = time.perf_counter()
+    error, text = True, ""
+    with trace_span(f"step {step['id']}", **{'mcp.tool': name}):
+        try:
+            args = resolve_batch_args(step.get('args', {}), outputs)
+            result = await mcp.call_tool_text(name, args)
+            error, text = is_error_result(result), str(result)
+        except Exception as e:
+            text = f"Error: {e}"
+        finally:
+            metrics.observe_tool(name, time.perf_counter() - started, error, len(text))
+    return ('failed' if error else 'succeeded'), text, time.perf_counter() - started
+
+@mcp.tool()
+async def toolkit_batch(steps: List[Dict[str, Any]], max_parallel: int = 4,
+                        return_steps: Optional[List[str]] = None) -> str:
+    """
+    Run several toolkit calls in one request, in dependency order, independent ones concurrently
+    
+    Each step is {"id": "...", "tool": "<tool name>", "args": {...}, "after": ["<step id>", ...]}.
+    An argument can use an earlier step's output: "${step_id}" inside a string inserts the whole
+    output, and {"$ref": "step_id", "pattern": "ID: ([\\\\w-]+)"} inserts the first regex match
+    (add "index": n for the n-th match or "all": true for a list of all matches).
+    Referenced steps run first. Steps depending on a failed step are skipped.
+    
+    Args:
+        steps: The calls to make (at most 20)
+        max_parallel: Most steps running at the same time (default: 4)
+        return_steps: Ids of the steps whose output to return (default: all)
+    """
+    try:
+        deps = plan_batch(steps)
+    except ValueError as e:
+        return ErrorResult(f"Error in batch: {str(e)}")
+    started = time.perf_counter()
+    by_id = {step['id']: step for step in steps}
+    outputs, results = {}, {}
+    semaphore = asyncio.Semaphore(max(1, max_parallel))
+
+    async def run(step):
+        async with semaphore:
+            return await run_batch_step(step, outputs)
+
+    running = {}
+    try:
+        while len(results) < len(steps):
+            for step_id, step in by_id.items():
+                if step_id in results or step_id in running or not deps[step_id] <= results.keys():
+                    continue
+                failed = sorted(d for d in deps[step_id] if results[d][0] != 'succeeded')
+                if failed:
+                    results[step_id] = ('skipped', f"Skipped: depends on unsuccessful step(s) {', '.join(failed)}", 0.0)
+                else:
+                    running[step_id] = asyncio.create_task(run(step))
+            if not running:
+                continue
+            done, _ = await asyncio.wait(running.values(), return_when=asyncio.FIRST_COMPLETED)
+            for step_id in [step_id for step_id, task in running.items() if task in done]:
+                results[step_id] = running.pop(step_id).result()
+                if results[step_id][0] == 'succeeded':
+                    outputs[step_id] = results[step_id][1]
+            report_progress(len(results), len(steps), f"Finished {len(results)} of {len(steps)} steps")
+    finally:
+        # The batch request was cancelled or timed out: stop the steps still running
+        for task in running.values():
+            task.cancel()
+
+    counts = {status: sum(1 for r in results.values() if r[0] == status) for status in ('succeeded', 'failed', 'skipped')}
+    response = (f"Batch: {len(steps)} steps, {counts['succeeded']} succeeded, {counts['failed']} failed, "
+                f"{counts['skipped']} skipped ({(time.perf_counter() - started) * 1000:.0f} ms)\n")
+    for step in steps:
+        if return_steps is not None and step['id'] not in return_steps:
+            continue
+        status, text, seconds = results[step['id']]
+        response += f"\n=== [{step['id']}] {step['tool']}: {status} ({seconds * 1000:.0f} ms) ===\n{text}\n"
+    return response
+
+# ==================== METRICS RESOURCES ====================
+
+@mcp.resource("toolkit://metrics", mime_type="application/json")
+def metrics_json() -> str:
+    """Per-tool and per-Google-API-method call counts, errors, bytes and latency percentiles."""
+    return json.dumps(metrics.snapshot(), indent=2)
+
+@mcp.resource("toolkit://metrics/prometheus", mime_type="text/plain")
+def metrics_prometheus() -> str:
+    """The same metrics in Prometheus text exposition format."""
+    return metrics.to_prometheus()
+
+def initialize_services():
+    """Initialize all Google services for the user whose tokens are in the environment."""
+    global drive_service, gmail_service, calendar_service, docs_service, credentials, default_user_services
+    
+    creds = load_credentials()
+    if not creds:
+        print("Warning: No credentials available. Services will not be initialized.",file=sys.stderr)
+        return
+    credentials = creds
+    
+    try:
+        services = default_user_services = UserServices(current_user_id(), creds)
+
+        # Initialize Google Drive service
+        drive_service = services.drive
+        print("✅ Google Drive service initialized",file=sys.stderr)
+        
+        # Initialize Gmail service
+        gmail_service = services.gmail
+        print(f"✅ Gmail service initialized: {get_sender_address()}",file=sys.stderr)
+        
+        # Initialize Calendar service
+        calendar_service = services.calendar
+        calendar_list = calendar_service.calendarList().list().execute()
+        primary_calendar = next((cal for cal in calendar_list.get('items', []) if cal.get('primary')), None)
+        if primary_calendar:
+            print(f"✅ Google Calendar service initialized: {primary_calendar.get('summary', 'Primary Calendar')}",file=sys.stderr)
+        
+        # Initialize Docs service
+        docs_service = services.docs
+        print("✅ Google Docs service initialized",file=sys.stderr)
+
+        if not PDF_SUPPORT:
+            print("⚠️ PDF libraries not installed. PDF creation/editing will be limited.", file=sys.stderr)
+        
+        print("\n🚀 Server ready with Google Drive, Gmail, Calendar, and Docs integration",file=sys.stderr)
+
+        # Pick up background jobs a previous run left unfinished
+        get_job_store()
+
+    except HttpError as e:
+        print(f"❌ A Google API error occurred during initialization: {e}",file=sys.stderr)
+        # Depending on severity, you might want to exit or handle this
+    except Exception as e:
+        print(f"❌ An unexpected error occurred during initialization: {e}",file=sys.stderr)
+
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+def configure_transport_security(host: str, socket_path: Optional[str] = None):
+    """Keep DNS rebinding protection (loopback Host headers only) where browsers could reach us."""
+    if socket_path or host not in LOOPBACK_HOSTS:
+        mcp.settings.transport_security = None
+        if not socket_path:
+            print(f"⚠️ Listening on {host}: requests carry Google tokens, keep this port private to the backend", file=sys.stderr)
+    return mcp.settings.transport_security
+
+def require_user_headers(app):
+    """ASGI middleware answering 401 to HTTP requests that don't name a user and their token.
+
+    Over HTTP there is no default user: the environment's tokens only serve stdio.
+    """
+    from starlette.responses import PlainTextResponse
+
+    async def guarded(scope, receive, send):
+        if scope['type'] == 'http':
+            headers = dict(scope['headers'])
+            if not headers.get(USER_ID_HEADER.encode()) or ACCESS_TOKEN_HEADER.encode() not in headers:
+                response = PlainTextResponse(
+                    f"The {USER_ID_HEADER} and {ACCESS_TOKEN_HEADER} headers are required", status_code=401)
+                return await response(scope, receive, send)
+        return await app(scope, receive, send)
+    return guarded
+
+def serve_http(transport: str, host: str, port: int, socket_path: Optional[str] = None, stateless: bool = False):
+    """Serve MCP over SSE or streamable HTTP to many concurrent clients and users."""
+    import uvicorn
+    global drive_service, gmail_service, calendar_service, docs_service
+
+    drive_service, gmail_service, calendar_service, docs_service = (
+        ServiceProxy(api) for api in ('drive', 'gmail', 'calendar', 'docs'))
+    mcp.settings.host, mcp.settings.port = host, port
+    mcp.settings.stateless_http = stateless
+    configure_transport_security(host, socket_path)
+    app = mcp.streamable_http_app() if transport == "streamable-http" else mcp.sse_app()
+    where = f"unix:{socket_path}" if socket_path else f"http://{host}:{port}"
+    print(f"MCP Toolkit serving {transport} on {where}", file=sys.stderr)
+    uvicorn.run(require_user_headers(app), host=host, port=port, uds=socket_path, log_level="warning")
+
+# ==================== SUPERVISOR ====================
+
+# Seconds between load rebalancing passes, how far above the mean a worker's request
+# count must be before its hottest user is moved off it, and the least load that counts
+REBALANCE_INTERVAL = float(os.getenv("MCP_REBALANCE_INTERVAL", "10"))
+REBALANCE_FACTOR = float(os.getenv("MCP_REBALANCE_FACTOR", "1.5"))
+REBALANCE_MIN_REQUESTS = int(os.getenv("MCP_REBALANCE_MIN_REQUESTS", "20"))
+MAX_PINNED_SESSIONS = 100000
+# Not forwarded between the client, the supervisor and a worker (date and server are set again)
+HOP_HEADERS = frozenset({'host', 'connection', 'keep-alive', 'transfer-encoding', 'content-length',
+                         'te', 'trailer', 'upgrade', 'proxy-connection', 'date', 'server'})
+
+class WorkerProcess:
+    """One streamable-HTTP toolkit worker, restarted whenever it exits."""
+
+    def __init__(self, index: int, runtime_dir: str):
+        import httpx
+        self.index = index
+        self.proc = None
+        self.restarts = 0
+        self.ready = asyncio.Event()
+        self.stopping = False
+        if hasattr(socket, 'AF_UNIX'):
+            self.address = os.path.join(runtime_dir, f"worker-{index}.sock")
+            self.args = ["--socket", self.address]
+            self.url = "http://localhost"
+            transport = httpx.AsyncHTTPTransport(uds=self.address)
+        else:
+            port = int(os.getenv("MCP_WORKER_BASE_PORT", "18800")) + index
+            self.address = f"127.0.0.1:{port}"
+            self.args = ["--host", "127.0.0.1", "--port", str(port)]
+            self.url = f"http://127.0.0.1:{port}"
+            transport = httpx.AsyncHTTPTransport()
+        # SSE responses stay open as long as a tool call runs, so no read timeout here
+        self.client = httpx.AsyncClient(transport=transport, base_url=self.url,
+                                        timeout=httpx.Timeout(None, connect=5.0))
+
+    async def run(self, on_exit):
+        """Keep the worker running, backing off when it crashes right after starting."""
+        backoff = 0.5
+        while not self.stopping:
+            started = time.monotonic()
+            # Without MCP_WORKERS, or each worker would start a supervisor of its own
+            env = {k: v for k, v in os.environ.items() if k != 'MCP_WORKERS'}
+            env.update(MCP_WORKER_INDEX=str(self.index), MCP_SUPERVISOR_PID=str(os.getpid()))
+            self.proc = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), "--transport", "streamable-http", *self.args,
+                env=env, stdin=asyncio.subprocess.DEVNULL)
+            print(f"🧵 Worker {self.index} started (pid {self.proc.pid})", file=sys.stderr)
+            waiter = asyncio.create_task(self.proc.wait())
+            while not waiter.done() and not self.ready.is_set():
+                if await self.accepts_connections():
+                    self.ready.set()
+                else:
+                    await asyncio.wait([waiter], timeout=0.1)
+            code = await waiter
+            self.ready.clear()
+            on_exit(self.index)
+            if self.stopping:
+                break
+            self.restarts += 1
+            backoff = 1.0 if time.monotonic() - started > 30 else min(backoff * 2, 30.0)
+            print(f"❌ Worker {self.index} exited with code {code}; restarting in {backoff:.0f}s", file=sys.stderr)
+            await asyncio.sleep(backoff)
+
+    async def accepts_connections(self) -> bool:
+        try:
+            if self.args[0] == "--socket":
+                reader, writer = await asyncio.open_unix_connection(self.address)
+            else:
+                host, port = self.address.rsplit(':', 1)
+                reader, writer = await asyncio.open_connection(host, int(port))
+        except OSError:
+            return False
+        writer.close()
+        return True
+
+    def terminate(self):
+        self.stopping = True
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.terminate()
+
+    async def stop(self):
+        """Wait for a terminated worker to exit, killing it if it does not."""
+        if self.proc is not None and self.proc.returncode is None:
+            try:
+                await asyncio.wait_for(self.proc.wait(), 5)
+            except asyncio.TimeoutError:
+                self.proc.kill()
+        await self.client.aclose()
+
+def exit_with_supervisor(supervisor_pid: int):
+    """Stop this worker once its supervisor is gone (even if it was killed outright)."""
+    def watch():
+        while os.getppid() == supervisor_pid:
+            time.sleep(1)
+        print("Supervisor exited; stopping worker", file=sys.stderr)
+        os._exit(0)
+    threading.Thread(target=watch, name="supervisor-watch", daemon=True).start()
+
+class ToolkitSupervisor:
+    """Front process that shards users across toolkit worker processes.
+
+    Every user is routed to one worker (rendezvous hashing on the user id header)
+    so its clients, caches and calendar store stay warm there. A streamable-HTTP
+    session stays on the worker that created it. Users that keep one worker much
+    busier than the rest are moved, for new sessions, to the least loaded worker.
+    """
+
+    def __init__(self, n_workers: int):
+        self.runtime_dir = tempfile.mkdtemp(prefix="mcp-toolkit-")
+        self.workers = [WorkerProcess(index, self.runtime_dir) for index in range(n_workers)]
+        self.sessions = OrderedDict()  # mcp-session-id -> worker index
+        self.overrides = {}  # user id -> worker index, set by rebalancing
+        self.load = [{} for _ in self.workers]  # per worker: user id -> requests this interval
+        self.settling = False
+
+    def home_worker(self, user_id: str) -> int:
+        return max(range(len(self.workers)),
+                   key=lambda index: hashlib.sha1(f"{user_id}:{index}".encode('utf-8')).digest())
+
+    def worker_for(self, user_id: str, session_id: Optional[str]) -> int:
+        index = self.sessions.get(session_id) if session_id else None
+        if index is None:
+            index = self.overrides.get(user_id)
+        return index if index is not None else self.home_worker(user_id)
+
+    def worker_exited(self, index: int):
+        """Forget the sessions of a worker that died; their clients must re-initialize."""
+        for session_id in [sid for sid, owner in self.sessions.items() if owner == index]:
+            del self.sessions[session_id]
+
+    async def proxy(self, request):
+        from starlette.background import BackgroundTask
+        from starlette.responses import PlainTextResponse, StreamingResponse
+
+        # Blob uploads are raw bytes, so only MCP POSTs must carry a JSON Content-Type
+        is_mcp_post = request.method == "POST" and not request.url.path.startswith("/blobs")
+        rejected = await self.security.validate_request(request, is_post=is_mcp_post)
+        if rejected is not None:
+            return rejected
+        user_id = request.headers.get(USER_ID_HEADER, "")
+        session_id = request.headers.get("mcp-session-id")
+        index = self.worker_for(user_id, session_id)
+        worker = self.workers[index]
+        try:
+            await asyncio.wait_for(worker.ready.wait(), 30)
+        except asyncio.TimeoutError:
+            return PlainTextResponse(f"Toolkit worker {index} is unavailable", status_code=503)
+        load = self.load[index]
+        load[user_id] = load.get(user_id, 0) + 1
+
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in HOP_HEADERS]
+        # The body is streamed through, so large uploads (blobs) are never held in memory here
+        upstream = worker.client.build_request(request.method, request.url.path, params=request.url.query,
+                                               headers=headers, content=request.stream())
+        try:
+            response = await worker.client.send(upstream, stream=True)
+        except Exception as e:
+            return PlainTextResponse(f"Toolkit worker {index} failed: {e}", status_code=502)
+
+        created = response.headers.get("mcp-session-id")
+        if created and created not in self.sessions:
+            self.sessions[created] = index
+            while len(self.sessions) > MAX_PINNED_SESSIONS:
+                self.sessions.popitem(last=False)
+        if request.method == "DELETE" and session_id:
+            self.sessions.pop(session_id, None)
+        return StreamingResponse(
+            response.aiter_raw(), status_code=response.status_code,
+            headers={k: v for k, v in response.headers.items() if k.lower() not in HOP_HEADERS},
+            background=BackgroundTask(response.aclose))
+
+    async def status(self, request):
+        from starlette.responses import JSONResponse
+        return JSONResponse({
+            'workers': [{'index': w.index, 'pid': w.proc.pid if w.proc else None, 'ready': w.ready.is_set(),
+                         'restarts': w.restarts, 'sessions': sum(1 for i in self.sessions.values() if i == w.index),
+                         'load': sum(self.load[w.index].values())} for w in self.workers],
+            'overrides': self.overrides,
+        })
+
+    def rebalance(self):
+        """Move the hottest user off a worker that is well above the mean load."""
+        totals = [sum(load.values()) for load in self.load]
+        busiest = max(range(len(totals)), key=totals.__getitem__)
+        idlest = min(range(len(totals)), key=totals.__getitem__)
+        mean = sum(totals) / len(totals)
+        loads, self.load = self.load, [{} for _ in self.workers]
+        if self.settling:
+            # Give the last move an interval to show up in the load before judging again
+            self.settling = False
+            return
+        if (totals[busiest] < REBALANCE_MIN_REQUESTS or totals[busiest] <= REBALANCE_FACTOR * mean
+                or len(loads[busiest]) < 2):
+            return
+        user_id, count = max(loads[busiest].items(), key=lambda item: item[1])
+        # Only move a user when that leaves both workers below the current peak
+        if totals[idlest] + count >= totals[busiest]:
+            return
+        if self.home_worker(user_id) == idlest:
+            self.overrides.pop(user_id, None)
+        else:
+            self.overrides[user_id] = idlest
+        self.settling = True
+        print(f"⚖️ Moved user {user_id} ({count} requests) from worker {busiest} to worker {idlest}", file=sys.stderr)
+
+    async def rebalance_loop(self):
+        while True:
+            await asyncio.sleep(REBALANCE_INTERVAL)
+            self.rebalance()
+
+    async def serve(self, host: str, port: int, socket_path: Optional[str] = None):
+        import uvicorn
+        from starlette.applications import Starlette
+        from starlette.routing import Route
+        from mcp.server.transport_security import TransportSecurityMiddleware
+
+        # Workers listen on private sockets, so Host/Origin checks happen here
+        self.security = TransportSecurityMiddleware(configure_transport_security(host, socket_path))
+        app = Starlette(routes=[
+            Route("/supervisor/status", self.status),
+            Route("/{path:path}", self.proxy, methods=["GET", "POST", "DELETE"]),
+        ])
+        tasks = [asyncio.create_task(worker.run(self.worker_exited)) for worker in self.workers]
+        tasks.append(asyncio.create_task(self.rebalance_loop()))
+        where = f"unix:{socket_path}" if socket_path else f"http://{host}:{port}"
+        print(f"MCP Toolkit supervisor serving {len(self.workers)} workers on {where}", file=sys.stderr)
+        try:
+            await uvicorn.Server(uvicorn.Config(app, host=host, port=port, uds=socket_path,
+                                                log_level="warning")).serve()
+        finally:
+            # Signal every worker before the first await, which a second Ctrl-C may cancel
+            for worker in self.workers:
+                worker.terminate()
+            await asyncio.gather(*(worker.stop() for worker in self.workers))
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Google Drive, Gmail, Calendar and Docs MCP server")
+    parser.add_argument("--transport", choices=("stdio", "sse", "streamable-http"),
+                        default=os.getenv("MCP_TRANSPORT", "stdio"))
+    parser.add_argument("--host", default=os.getenv("MCP_HTTP_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MCP_HTTP_PORT", "8808")))
+    parser.add_argument("--socket", default=os.getenv("MCP_HTTP_SOCKET"),
+                        help="Listen on this Unix socket instead of host:port")
+    parser.add_argument("--stateless", action="store_true", default=os.getenv("MCP_HTTP_STATELESS") == "1",
+                        help="Streamable HTTP without sessions (any instance can serve any request, no cancellation)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("MCP_WORKERS", "-1")),
+                        help="Run a supervisor sharding users across this many streamable-HTTP worker "
+                             "processes (0: one per CPU core)")
+    parser.add_argument("--stdio-framing", choices=("fast", "default"), default=STDIO_FRAMING,
+                        help="fast: bytes-level JSON codec and batched writes; default: the MCP SDK's stdio transport")
+    args = parser.parse_args()
+    STDIO_FRAMING = args.stdio_framing
+
+    if args.workers >= 0:
+        if args.transport != "streamable-http":
+            parser.error("--workers requires --transport streamable-http")
+        if args.stateless:
+            os.environ["MCP_HTTP_STATELESS"] = "1"  # inherited by the workers
+        supervisor = ToolkitSupervisor(args.workers or os.cpu_count() or 1)
+        try:
+            asyncio.run(supervisor.serve(args.host, args.port, args.socket))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            shutil.rmtree(supervisor.runtime_dir, ignore_errors=True)
+    elif args.transport == "stdio":
+        initialize_services()
+        print("MCP Toolkit started. Waiting for initialization command...", file=sys.stderr)
+        mcp.run(transport="stdio")
+        stop_jobs()
+    else:
+        if os.getenv("MCP_SUPERVISOR_PID"):
+            exit_with_supervisor(int(os.environ["MCP_SUPERVISOR_PID"]))
+        serve_http(args.transport, args.host, args.port, args.socket, args.stateless)
+        stop_jobs()
@@ -100,6 +100,11 @@ let availableTools = [];
 let pendingResponses = new Map();
 let currentUserId = null;
 
+// How long to wait for an MCP response; tool calls get a slightly shorter deadline so the
+// toolkit stops the work and answers before we give up on it
+const MCP_REQUEST_TIMEOUT_MS = 30000;
+const MCP_TOOL_DEADLINE_MS = MCP_REQUEST_TIMEOUT_MS - 2000;
+
 // Complete list of ALL MCP tools (30+ tools)
 const getAllMCPTools = () => [
     // Google Drive Tools (10 tools)
@@ -161,7 +166,8 @@ const getAllMCPTools = () => [
                     // FIX: Changed mime_type to mimeType to match the Python tool's argument
                     mimeType: { type: "string", description: "MIME type (e.g., 'application/vnd.google-apps.document', 'text/plain', 'application/pdf')" },
                     content: { type: "string", description: "The text content for the file." },
-                    folder_id: { type: "string", description: "Optional parent folder ID to create the file in." }
+                    folder_id: { type: "string", description: "Optional parent folder ID to create the file in." },
+                    encoding: { type: "string", enum: ["text", "base64", "blob"], description: "How content is encoded: 'text' (default), 'base64' for binary data, or 'blob' for a blob handle returned by drive_read." }
                 },
                 // FIX: Added mimeType to the required parameters
                 required: ["name", "mimeType", "content"]
@@ -852,6 +858,9 @@ function sendMCPRequest(method, params = {}) {
         }
 
         const currentRequestId = requestId++;
+        if (method === 'tools/call') {
+            params = { ...params, _meta: { timeoutMs: MCP_TOOL_DEADLINE_MS, ...(params._meta || {}) } };
+        }
         const request = {
             jsonrpc: '2.0',
             id: currentRequestId,
@@ -866,9 +875,14 @@ function sendMCPRequest(method, params = {}) {
         setTimeout(() => {
             if (pendingResponses.has(currentRequestId)) {
                 pendingResponses.delete(currentRequestId);
+                // Let the toolkit stop whatever it is still doing for this request
+                sendMCPNotification('notifications/cancelled', {
+                    requestId: currentRequestId,
+                    reason: 'Request timed out'
+                }).catch(() => {});
                 reject(new Error(`MCP request timeout for method: ${method}`));
             }
-        }, 30000);
+        }, MCP_REQUEST_TIMEOUT_MS);
 
         try {
             mcpProcess.stdin.write(JSON.stringify(request) + '\n');